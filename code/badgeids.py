@@ -0,0 +1,174 @@
+"""
+One registry of small integer IDs for all badges, worn and anchor, for
+code that works on arrays rather than on dictionaries keyed by strings:
+
+    R = Registry.load()
+    R.id("pr017"), R.name(17), R.role(R.id("b154")) == ANCHOR
+    R.roles[ids] == NURSE          (numpy mask for an array of IDs)
+
+IDs are given in order of role then name when the registry is built, so
+anchors are 0 .. R.anchors-1 and "is this an anchor" is a comparison;
+badges first seen later are appended, so IDs never change once given.
+The registry is built from every intervals file and the anchor table,
+and saved as data/contact_arrays/badgeids.json.
+
+Contact intervals in compact form are a numpy structured array (INTERVAL
+below: IDs, start in seconds since 1970, distance, duration and the
+flags of the undirected form, see make_intervals.undirected) saved per
+shift as data/contact_arrays/intervalsNN.npy, 19 bytes an interval.
+
+    python code/badgeids.py        (build registry and arrays, all shifts)
+"""
+
+import sys, os, json
+import numpy as np
+import extractspread
+import make_intervals
+import contactquery
+import codec
+
+DATA_DIR = 'data'
+SUPP_DIR = 'supp'
+ARRAY_DIR = f"{DATA_DIR}/contact_arrays"
+
+# role codes
+ANCHOR, NURSE, PROVIDER, SUPPORT, UNKNOWN = range(5)
+PREFIXES = (("b", ANCHOR), ("n", NURSE), ("p", PROVIDER), ("s", SUPPORT))
+
+INTERVAL = np.dtype([
+    ("badge", "<u2"), ("other", "<u2"), ("start", "<i8"),
+    ("distance", "<u2"), ("duration", "<u4"), ("flags", "u1"),
+])
+
+
+def roleof(name):
+    # role code of a badge name, by its prefix
+    for prefix, role in PREFIXES:
+        if name.startswith(prefix):
+            return role
+    return UNKNOWN
+
+
+class Registry(object):
+    def __init__(self, names=()):
+        self.names, self.ids, self.rolelist = list(), dict(), list()
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name):
+        # ID of name, giving it the next ID if it is new
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.rolelist.append(roleof(name))
+            self._roles = None
+        return self.ids[name]
+
+    def id(self, name):
+        return self.ids[name]
+
+    def name(self, i):
+        return self.names[i]
+
+    def role(self, i):
+        return self.rolelist[i]
+
+    @property
+    def roles(self):
+        # numpy array of role codes indexed by ID
+        if getattr(self, "_roles", None) is None:
+            self._roles = np.array(self.rolelist, dtype="u1")
+        return self._roles
+
+    @property
+    def anchors(self):
+        # anchors have IDs 0 .. anchors-1 (those interned later excepted)
+        n = 0
+        while n < len(self.rolelist) and self.rolelist[n] == ANCHOR:
+            n += 1
+        return n
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, datadir=DATA_DIR, suppdir=SUPP_DIR, shifts=range(1, 15)):
+        # registry of all anchors and every badge in the intervals files
+        names = set(extractspread.getAnchors(suppdir))
+        for n in shifts:
+            for item in json.loads(codec.readbytes(f"{datadir}/contact_intervals/intervals{n:02d}.json.xz")):
+                names.update(item[:2])
+        return cls(sorted(names, key=lambda e: (roleof(e), e)))
+
+    def save(self, filename):
+        with open(filename + ".tmp", "w") as F:
+            json.dump({"names": self.names}, F)
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, arraydir=ARRAY_DIR, datadir=DATA_DIR, suppdir=SUPP_DIR):
+        # the saved registry, built and saved the first time
+        filename = f"{arraydir}/badgeids.json"
+        if os.path.exists(filename):
+            with open(filename) as F:
+                return cls(json.load(F)["names"])
+        R = cls.build(datadir, suppdir)
+        os.makedirs(arraydir, exist_ok=True)
+        R.save(filename)
+        return R
+
+
+def encodeintervals(records, registry):
+    """
+    Compact form of contact intervals (either form, datetimes as
+    strings or datetime objects); new badges are interned. Directed
+    records get flags FORWARD
+    """
+    A = np.empty(len(records), dtype=INTERVAL)
+    for i, item in enumerate(records):
+        T = item[2]
+        start = contactquery.parsetime(T) if isinstance(T, str) else contactquery.toseconds(T)
+        flags = item[5] if len(item) > 5 else make_intervals.FORWARD
+        A[i] = (registry.intern(item[0]), registry.intern(item[1]), start, item[3], item[4], flags)
+    return A
+
+
+def decodeintervals(A, registry, undirected_form=True):
+    """
+    Contact intervals (datetime objects) from the compact form: the
+    undirected form with flags, or directed records if not undirected_form
+    """
+    records = list()
+    for badge, other, start, distance, duration, flags in A.tolist():
+        records.append([registry.names[badge], registry.names[other],
+                        contactquery.todatetime(start), distance, duration, flags])
+    if undirected_form:
+        return records
+    return list(make_intervals.directed(records))
+
+
+def arrayfile(n, arraydir=ARRAY_DIR):
+    return f"{arraydir}/intervals{n:02d}.npy"
+
+
+def saveshift(n, registry, datadir=DATA_DIR, arraydir=ARRAY_DIR):
+    # write the compact (undirected) intervals of shift n, from its intervals file
+    records = make_intervals.readintervals(f"{datadir}/contact_intervals/intervals{n:02d}.json.xz")
+    A = encodeintervals(list(make_intervals.undirected(records)), registry)
+    np.save(arrayfile(n, arraydir), A)
+    return A
+
+
+def loadshift(n, arraydir=ARRAY_DIR, mmap_mode=None):
+    # compact intervals of shift n (mmap_mode "r" maps rather than reads)
+    return np.load(arrayfile(n, arraydir), mmap_mode=mmap_mode)
+
+
+if __name__ == "__main__":
+    os.makedirs(ARRAY_DIR, exist_ok=True)
+    registry = Registry.load()
+    print(len(registry), "badges,", registry.anchors, "anchors")
+    for n in range(1, 15):
+        A = saveshift(n, registry)
+        print("shift", n, len(A), "intervals", A.nbytes, "bytes")
+    registry.save(f"{ARRAY_DIR}/badgeids.json")  # in case of new badges
@@ -0,0 +1,330 @@
+"""
+Centrality of badges in the hypergraph of a shift, beyond the
+participation count of analysis.py (the hyperedges a badge is a member
+of), which rewards being present rather than being a bridge between
+groups:
+
+    I = incidence(5)                          distinct hyperedges of the whole shift
+    x = eigenvector(I, weight="duration")     {badge: value}, values sum to 1
+    p = pagerank(I, weight="unit")
+    b = sbetweenness(I, s=2, samples=256, processes=8)
+    T = table(5)                              rows of every measure, by badge
+
+Hyperedges are those of repro3.py (a badge with contacts and its
+contacts, at least minsize members), but taken from every second of the
+shift history (shiftcache), not the first hour of the hypergraph stage,
+or from the stage itself with stage=True. Hyperedge-seconds with the
+same members are one hyperedge of the incidence matrix B (nodes x
+hyperedges, scipy.sparse), of weight 1 ("unit") or of the seconds it
+was present ("duration", the temporal variant). W is the diagonal of
+weights.
+
+    eigenvector   leading eigenvector of the clique expansion B W B^T less
+                  its diagonal (badges weighted by the time in groups they
+                  share), by power iteration on it plus the identity
+    pagerank      stationary distribution of the walk of Zhou et al. (a
+                  hyperedge of the current badge with probability by weight,
+                  then any member of it), damped by alpha
+    sbetweenness  betweenness in the s-line graph of Aksoy et al.: distinct
+                  hyperedges adjacent when they share at least s members;
+                  a badge scores the sum, by weight, of its hyperedges'.
+                  With dual=True, badges adjacent when they share at least s
+                  hyperedges instead, and the betweenness is the badge's
+
+Betweenness follows Brandes from sampled sources (Brandes and Pich), the
+estimate scaled by nodes / samples; the searches run a batch of sources
+at once as sparse matrix products, level by level, and batches go to a
+process pool. The power iterations take milliseconds; betweenness is
+most of the time, about two minutes on one CPU for the densest shift
+(shift 5: 305k hyperedge-seconds, 19688 hyperedges, 72M adjacencies of
+the 2-line graph), less on more processes or with fewer samples.
+
+    python code/centrality.py [shift] [--stage] [--samples N] [--processes P]
+        (top badges by each measure, saved to data/centrality/centralityNN.csv)
+"""
+
+import sys, os, csv, time
+from multiprocessing import Pool
+import numpy as np
+from scipy import sparse
+import badgeids
+import shiftcache
+import instrument
+
+DATA_DIR = 'data'
+PAD = np.iinfo(np.uint16).max  # no member, in rows of members
+BATCH = 1 << 22  # entries (nodes x sources) of a batch of searches
+WEIGHTS = ("unit", "duration")
+
+
+class Incidence(object):
+    """
+    Distinct hyperedges of a shift: ids (badge ID of each node), B
+    (nodes x hyperedges, 1 for a member), duration (seconds present),
+    seconds (hyperedge-seconds in all) and the registry
+    """
+
+    def __init__(self, ids, B, duration, seconds, registry):
+        self.ids, self.B, self.duration = ids, B, duration
+        self.seconds, self.registry = seconds, registry
+
+    @property
+    def names(self):
+        return [self.registry.name(i) for i in self.ids.tolist()]
+
+    def weight(self, weight):
+        if weight not in WEIGHTS:
+            raise ValueError(f"weight is one of {WEIGHTS}, not {weight!r}")
+        return self.duration.astype(np.float64) if weight == "duration" else np.ones(self.B.shape[1])
+
+    def bybadge(self, x):
+        return dict(zip(self.names, x.tolist()))
+
+
+def historyedges(H):
+    # (second index, offsets, members) of the hyperedges of every second of History H
+    A = H.arrays
+    entries = len(A["entry_badge"])
+    when = np.repeat(np.arange(len(H)), np.diff(A["second_offsets"]))
+    # each entry's badge ahead of its contacts
+    members = np.insert(A["contacts"], A["contact_offsets"][:-1], A["entry_badge"])
+    offsets = A["contact_offsets"] + np.arange(entries + 1)
+    return when, offsets, members
+
+
+def stageedges(n):
+    # the same of the hypergraph stage of shift n (the first hour)
+    E = shiftcache.get_shift(n, "hypergraph")
+    return E.time, E.arrays["offsets"], E.arrays["members"]
+
+
+def rows(offsets, members):
+    # members as sorted rows padded with PAD, repeated members dropped
+    sizes = np.diff(offsets)
+    width = int(sizes.max()) if len(sizes) else 1
+    R = np.full((len(sizes), width), PAD, dtype=np.uint16)
+    row = np.repeat(np.arange(len(sizes)), sizes)
+    R[row, np.arange(len(members)) - offsets[row]] = members
+    R.sort(axis=1)
+    R[:, 1:][R[:, 1:] == R[:, :-1]] = PAD
+    R.sort(axis=1)
+    return R
+
+
+def incidence(n, stage=False, minsize=3):
+    """
+    Incidence of shift n: the hyperedges of every second of its history
+    (or of the hypergraph stage, stage=True), those of the same members
+    merged into one of their duration in seconds
+    """
+    registry = shiftcache.CACHE.registry
+    with instrument.span("incidence", shift=n) as sp:
+        when, offsets, members = stageedges(n) if stage else historyedges(shiftcache.get_shift(n))
+        R = rows(offsets, members)
+        keep = (R != PAD).sum(axis=1) >= minsize
+        R, when = R[keep], when[keep]
+        # one per second (two badges of a group list the same members), then by members
+        R = np.unique(np.column_stack([when.astype(np.uint32).view(np.uint16).reshape(-1, 2), R]), axis=0)
+        seconds = len(R)
+        R, duration = np.unique(R[:, 2:], axis=0, return_counts=True)
+        edge, slot = np.nonzero(R != PAD)
+        ids, node = np.unique(R[edge, slot], return_inverse=True)
+        B = sparse.csr_matrix((np.ones(len(edge)), (node, edge)), shape=(len(ids), len(R)))
+        sp.count("hyperedge_seconds", seconds)
+        sp.count("hyperedges", len(R))
+    return Incidence(ids.astype(np.int64), B, duration, seconds, registry)
+
+
+def iterate(step, x, tol=1e-10, maxiter=1000):
+    # x <- step(x) to a fixed point, in L1; x and step(x) sum to 1
+    for _ in range(maxiter):
+        y = step(x)
+        if np.abs(y - x).sum() < tol:
+            return y
+        x = y
+    print(f"[WARN] no convergence in {maxiter} iterations")
+    return x
+
+
+def eigenvector(I, weight="duration", tol=1e-10, maxiter=1000):
+    """
+    Clique expansion eigenvector centrality, {badge: value} summing to 1
+    """
+    B, w = I.B, I.weight(weight)
+    d = B @ w  # the diagonal of B W B^T
+
+    def step(x):
+        y = B @ (w * (B.T @ x)) - d * x + x  # plus the identity: no oscillation
+        return y / y.sum()
+
+    with instrument.span("eigenvector", weight=weight):
+        x = iterate(step, np.full(B.shape[0], 1 / B.shape[0]), tol, maxiter)
+    return I.bybadge(x)
+
+
+def pagerank(I, weight="duration", alpha=0.85, tol=1e-10, maxiter=1000):
+    """
+    PageRank of the hypergraph random walk, {badge: value} summing to 1
+    """
+    B, w = I.B, I.weight(weight)
+    size = np.asarray(B.sum(axis=0)).ravel()
+    d = B @ w  # every node is in a hyperedge
+    nodes = B.shape[0]
+
+    def step(x):
+        y = alpha * (B @ (w / size * (B.T @ (x / d))))
+        return y + (1 - y.sum()) / nodes
+
+    with instrument.span("pagerank", weight=weight):
+        x = iterate(step, np.full(nodes, 1 / nodes), tol, maxiter)
+    return I.bybadge(x)
+
+
+def linegraph(B, s=1):
+    # the s-line graph of the columns of B: adjacent when they share s rows or more
+    B = sparse.csr_matrix(B, dtype=np.float64)
+    G = (B.T @ B).tocsr()
+    G.setdiag(0)
+    G.data = (G.data >= s).astype(np.float64)
+    G.eliminate_zeros()
+    return G
+
+
+def brandes(G, sources):
+    """
+    Dependencies of each node on the sources, summed (Brandes), for the
+    unweighted graph G: breadth first searches from all sources at once,
+    a frontier of path counts per level, then dependencies back up the
+    levels
+    """
+    nodes, k = G.shape[0], len(sources)
+    columns = np.arange(k)
+    sigma = np.zeros((nodes, k))
+    depth = np.full((nodes, k), -1, dtype=np.int32)
+    sigma[sources, columns], depth[sources, columns] = 1, 0
+    F, level = sigma.copy(), 0
+    while True:
+        F = G @ F
+        F[depth >= 0] = 0
+        new = F > 0
+        if not new.any():
+            break
+        level += 1
+        depth[new], sigma[new] = level, F[new]
+    delta = np.zeros((nodes, k))
+    for d in range(level, 0, -1):
+        at = depth == d
+        coef = np.zeros((nodes, k))
+        coef[at] = (1 + delta[at]) / sigma[at]
+        above = depth == d - 1
+        delta[above] += sigma[above] * (G @ coef)[above]
+    delta[sources, columns] = 0
+    return delta.sum(axis=1)
+
+
+_graph = None  # graph of a worker process
+
+
+def _prepare(graph):
+    global _graph
+    _graph = graph
+
+
+def _brandes(sources):
+    return brandes(_graph, sources)
+
+
+def betweenness(G, samples=None, processes=None, seed=0):
+    """
+    Betweenness of each node of the undirected graph G, from samples
+    sources drawn at random (all nodes if None), scaled to estimate the
+    sum over all sources
+    """
+    nodes = G.shape[0]
+    rng = np.random.default_rng(seed)
+    sources = np.arange(nodes) if samples is None or samples >= nodes else \
+        np.sort(rng.choice(nodes, samples, replace=False))
+    workers = processes or os.cpu_count() or 1
+    size = max(1, min(-(-len(sources) // workers), BATCH // max(1, nodes)))  # a batch per worker at least
+    batches = [sources[i : i + size] for i in range(0, len(sources), size)]
+    with instrument.span("betweenness", nodes=nodes, edges=G.nnz // 2, sources=len(sources)):
+        if processes == 1 or len(batches) == 1:
+            parts = [brandes(G, b) for b in batches]
+        else:
+            with Pool(processes, initializer=_prepare, initargs=(G,)) as pool:
+                parts = pool.map(_brandes, batches)
+    # each path is counted from both ends
+    return np.sum(parts, axis=0) * (nodes / max(1, len(sources))) / 2
+
+
+def sbetweenness(I, s=1, weight="duration", dual=False, samples=256, processes=None, seed=0):
+    """
+    s-line graph betweenness, {badge: value}: the weighted sum of the
+    betweenness of a badge's hyperedges, or with dual=True the
+    betweenness of the badge in the graph of badges sharing s hyperedges
+    """
+    if dual:
+        return I.bybadge(betweenness(linegraph(I.B.T, s), samples, processes, seed))
+    b = betweenness(linegraph(I.B, s), samples, processes, seed)
+    return I.bybadge(I.B @ (I.weight(weight) * b))
+
+
+def table(n, stage=False, s=2, samples=256, processes=None, minsize=3, I=None):
+    """
+    Rows (badge, role, events, then each measure) of shift n; events is
+    the participation count of analysis.py, in hyperedge-seconds
+    """
+    I = I or incidence(n, stage, minsize)
+    events = np.asarray(I.B @ I.duration).ravel()
+    measures = {"events": I.bybadge(events)}
+    for weight in WEIGHTS:
+        measures[f"eigenvector_{weight}"] = eigenvector(I, weight)
+        measures[f"pagerank_{weight}"] = pagerank(I, weight)
+    measures["sbetweenness_duration"] = sbetweenness(I, s, "duration", False, samples, processes)
+    measures["sbetweenness_dual"] = sbetweenness(I, s, dual=True, samples=samples, processes=processes)
+    roles = I.registry.roles
+    return [dict({"badge": b, "role": "anchor" if roles[i] == badgeids.ANCHOR else "hcp"},
+                 **{m: V[b] for m, V in measures.items()})
+            for b, i in zip(I.names, I.ids.tolist())]
+
+
+def tablefile(n, stage=False, datadir=DATA_DIR):
+    return f"{datadir}/centrality/centrality{n:02d}{'_stage' if stage else ''}.csv"
+
+
+def save(T, filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w", newline="") as F:
+        W = csv.DictWriter(F, fieldnames=list(T[0]))
+        W.writeheader()
+        W.writerows(T)
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    args = sys.argv[1:]
+    options = {"--samples": 256, "--processes": None, "--s": 2}
+    for flag in options:
+        if flag in args:
+            i = args.index(flag)
+            options[flag] = int(args[i + 1])
+            del args[i : i + 2]
+    stage = "--stage" in args
+    args = [a for a in args if not a.startswith("--")]
+    n = int(args[0]) if args else 5
+    began = time.perf_counter()
+    I = incidence(n, stage)
+    print(f"shift {n}: {I.seconds} hyperedge-seconds, {I.B.shape[1]} distinct hyperedges, "
+          f"{I.B.shape[0]} badges ({time.perf_counter() - began:.1f}s)")
+    T = table(n, stage, options["--s"], options["--samples"], options["--processes"], I=I)
+    print(f"measures in {time.perf_counter() - began:.1f}s")
+    from scipy.stats import spearmanr
+
+    hcps = [r for r in T if r["role"] == "hcp"]
+    for m in list(T[0])[2:]:
+        top = sorted(hcps, key=lambda r: -r[m])[:5]
+        rho = spearmanr([r["events"] for r in hcps], [r[m] for r in hcps])[0]
+        print(f"{m:24s} rho {rho:5.2f} vs events  " + " ".join(r["badge"] for r in top))
+    filename = tablefile(n, stage)
+    save(T, filename)
+    print("saved", filename)
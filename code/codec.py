@@ -0,0 +1,216 @@
+"""
+Compression codecs for every file the pipeline reads or writes. All
+artifacts used to be written by lzma.open(..., "wb") at the default
+preset; that is still the default, but a codec can be chosen per call
+or for a whole run with the MICU_CODEC environment variable:
+
+    xz        lzma, default preset (6), as before
+    xz:N      lzma at preset N (0 fastest .. 9 smallest)
+    xzmt:N    lzma at preset N, written as a sequence of independent
+              xz streams (BLOCKSIZE of input each) compressed by a pool
+              of threads; any xz reader handles the file, and readbytes
+              decompresses its streams in parallel
+    gz:N      gzip at level N (default 6)
+    raw       no compression (readers can use mapfile for mmap access)
+
+The codec of a file is detected from its first bytes when reading, so
+a reader never needs to know how a file was written. Run this module
+to compare codecs on the real shifts:
+
+    python code/codec.py data/histories/histories02.json.xz ...
+"""
+
+import sys, os, io, lzma, gzip, mmap, time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT = os.environ.get("MICU_CODEC", "xz")
+BLOCKSIZE = 8 << 20  # input bytes per stream for xzmt
+THREADS = os.cpu_count() or 1
+
+XZMAGIC = b"\xfd7zXZ\x00"
+GZMAGIC = b"\x1f\x8b"
+
+
+def parse(spec):
+    # "xz:3" -> ("xz", 3); missing level means the codec's default
+    name, _, level = (spec or DEFAULT).partition(":")
+    if name not in ("xz", "xzmt", "gz", "raw"):
+        raise ValueError(f"unknown codec {spec}")
+    return name, int(level) if level else None
+
+
+def detect(path):
+    # name of the codec that wrote path, from its magic bytes
+    with open(path, "rb") as F:
+        head = F.read(6)
+    if head.startswith(XZMAGIC):
+        return "xz"
+    if head.startswith(GZMAGIC):
+        return "gz"
+    return "raw"
+
+
+class ParallelXZWriter(io.RawIOBase):
+    """
+    Binary file object that cuts its input into BLOCKSIZE pieces and
+    compresses them, as independent xz streams, on a thread pool (lzma
+    releases the GIL while compressing); streams are written in order
+    """
+
+    def __init__(self, path, preset=None, blocksize=BLOCKSIZE, threads=THREADS):
+        self.F = open(path, "wb")
+        self.preset = 6 if preset is None else preset
+        self.blocksize = blocksize
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.pending, self.buffer = list(), bytearray()
+        self.limit = 2 * threads  # streams in flight
+
+    def writable(self):
+        return True
+
+    def write(self, B):
+        self.buffer += B
+        while len(self.buffer) >= self.blocksize:
+            self.submit(bytes(self.buffer[: self.blocksize]))
+            del self.buffer[: self.blocksize]
+        return len(B)
+
+    def submit(self, block):
+        self.pending.append(self.pool.submit(lzma.compress, block, preset=self.preset))
+        while len(self.pending) > self.limit:
+            self.F.write(self.pending.pop(0).result())
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer or not self.pending:
+            self.submit(bytes(self.buffer))  # an empty file is one empty stream
+        for future in self.pending:
+            self.F.write(future.result())
+        self.pool.shutdown()
+        self.F.close()
+        super().close()
+
+
+def openfile(path, mode="rb", codec=None):
+    """
+    Open path like lzma.open: mode is "rb", "wb", "rt" or "wt"; for
+    reading the codec is detected, for writing it is given by codec
+    (a spec such as "xz:1") or else by MICU_CODEC
+    """
+    binary = mode.replace("t", "") + ("b" if "b" not in mode else "")
+    if "r" in mode:
+        name, level = detect(path), None
+    else:
+        name, level = parse(codec)
+    if name == "xz":
+        F = lzma.open(path, binary, preset=level) if "w" in mode else lzma.open(path, binary)
+    elif name == "xzmt" and "w" in mode:
+        F = io.BufferedWriter(ParallelXZWriter(path, level), buffer_size=1 << 20)
+    elif name == "gz":
+        F = gzip.open(path, binary, compresslevel=6 if level is None else level)
+    else:
+        F = open(path, binary)
+    if "t" in mode:
+        return io.TextIOWrapper(F, encoding="utf-8")
+    return F
+
+
+def varint(B, pos):
+    # xz index numbers are little-endian base-128
+    value, shift = 0, 0
+    while True:
+        byte = B[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def xzstreams(B):
+    """
+    Return (start,end) offsets of the xz streams concatenated in the
+    bytes-like B, found by walking stream footers and indexes backwards
+    """
+    spans, end = list(), len(B)
+    while end > 0:
+        while end >= 4 and B[end - 4 : end] == b"\0\0\0\0":
+            end -= 4  # stream padding
+        if end == 0:
+            break
+        footer = B[end - 12 : end]
+        if footer[10:12] != b"YZ":
+            raise ValueError("not an xz file")
+        indexsize = (int.from_bytes(footer[4:8], "little") + 1) * 4
+        index = B[end - 12 - indexsize : end - 12]
+        count, pos = varint(index, 1)
+        blocks = 0
+        for _ in range(count):
+            unpadded, pos = varint(index, pos)
+            _, pos = varint(index, pos)
+            blocks += (unpadded + 3) // 4 * 4
+        start = end - 12 - indexsize - blocks - 12
+        spans.append((start, end))
+        end = start
+    return spans[::-1]
+
+
+def readbytes(path, threads=THREADS):
+    """
+    Return the decompressed contents of path; an xz file made of
+    several streams (codec xzmt) is decompressed in parallel
+    """
+    name = detect(path)
+    if name != "xz" or threads < 2:
+        with openfile(path, "rb") as F:
+            return F.read()
+    with open(path, "rb") as F, mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ) as M:
+        spans = xzstreams(M)
+        if len(spans) == 1:
+            return lzma.decompress(M)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            parts = pool.map(lambda span: lzma.decompress(M[span[0] : span[1]]), spans)
+            return b"".join(parts)
+
+
+def mapfile(path):
+    # read-only mmap of an uncompressed (raw) artifact
+    if detect(path) != "raw":
+        raise ValueError(f"{path} is compressed; use readbytes")
+    with open(path, "rb") as F:
+        return mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def compare(paths, codecs=("xz", "xz:1", "xz:0", "xzmt:1", "xzmt:6", "gz:6", "gz:1", "raw")):
+    """
+    For each file in paths, recompress its contents with each codec
+    and report compression/decompression throughput (MB/s of
+    uncompressed data) and size; returns rows of dictionaries
+    """
+    import tempfile
+
+    rows = list()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for path in paths:
+            data = readbytes(path)
+            mb = len(data) / 1e6
+            for spec in codecs:
+                target = f"{tmpdir}/artifact"
+                began = time.perf_counter()
+                with openfile(target, "wb", codec=spec) as F:
+                    F.write(data)
+                middle = time.perf_counter()
+                again = readbytes(target)
+                done = time.perf_counter()
+                assert again == data
+                rows.append({"file": os.path.basename(path), "codec": spec,
+                             "MB": round(mb, 1), "ratio": round(len(data) / os.path.getsize(target), 1),
+                             "write MB/s": round(mb / (middle - began), 1),
+                             "read MB/s": round(mb / (done - middle), 1)})
+                print(rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    compare(sys.argv[1:])
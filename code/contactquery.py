@@ -0,0 +1,222 @@
+"""
+Queries over contact intervals, answered from an index instead of a scan:
+
+    Q = ContactIndex.load()   # all 14 shifts
+    Q.contacts("pr045", datetime(2023, 4, 19, 9, 0), datetime(2023, 4, 19, 9, 30))
+    Q.overlap("pr045", "pr037")
+    Q.occupants("b143", datetime(2023, 4, 19, 9, 0), datetime(2023, 4, 19, 9, 30))
+
+For each badge (worn or anchor) the index keeps the badge's contact
+intervals as parallel arrays sorted by start time: start and end (in
+seconds since 1970, as integers), the other badge (an index into a list
+of names) and the distance. A query for [t1,t2) uses binary search on
+the starts: an interval can only overlap if it starts before t2 and no
+earlier than t1 minus the badge's longest interval, so just that slice
+is checked. Since contact intervals are symmetric (see enforceSymmetry
+in make_intervals.py), indexing by the first badge of each interval
+covers both badges, and anchors get an index like any other badge; an
+interval file in the undirected form is indexed under each badge its
+flags name as first badge.
+
+The index for each shift is saved in data/contact_index (as a pickle)
+and rebuilt only when the intervals file is newer.
+"""
+
+import sys, os, json, pickle, calendar, time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+import codec
+import make_intervals
+
+DATA_DIR = 'data'
+EPOCH = datetime(1970, 1, 1)
+
+
+def parsetime(s):
+    # "datetime(2023, 4, 18, 7, 0, 1)" -> seconds since 1970, without eval
+    fields = [int(e) for e in s[s.index("(") + 1 : -1].split(",")]
+    return calendar.timegm(tuple(fields + [0] * (6 - len(fields))))
+
+
+def toseconds(T):
+    if isinstance(T, datetime):
+        return int((T - EPOCH).total_seconds())
+    return int(T)
+
+
+def todatetime(t):
+    return EPOCH + timedelta(seconds=t)
+
+
+class BadgeIntervals(object):
+    # the contact intervals of one badge, sorted by start
+
+    __slots__ = ("start", "end", "other", "distance", "longest")
+
+    def __init__(self):
+        self.start, self.end = array("q"), array("q")
+        self.other, self.distance = array("H"), array("H")
+        self.longest = 0
+
+    def append(self, start, end, other, distance):
+        self.start.append(start)
+        self.end.append(end)
+        self.other.append(other)
+        self.distance.append(distance)
+        self.longest = max(self.longest, end - start)
+
+    def extend(self, more):
+        for name in self.__slots__[:-1]:
+            getattr(self, name).extend(getattr(more, name))
+        self.longest = max(self.longest, more.longest)
+
+    def select(self, t1, t2):
+        # positions of intervals overlapping [t1,t2)
+        lo = bisect_left(self.start, t1 - self.longest)
+        hi = bisect_left(self.start, t2)
+        return [i for i in range(lo, hi) if self.end[i] > t1]
+
+
+def buildshift(intervalfile):
+    """
+    Return (names, badges) for one intervals file: names is the list
+    of badge names, badges maps name -> BadgeIntervals
+    """
+    records = json.loads(codec.readbytes(intervalfile))
+    names, ids, badges = list(), dict(), dict()
+    for item in records:
+        T, distance, duration = item[2:5]
+        start = parsetime(T)
+        for badge, other in make_intervals.directions(item):
+            if other not in ids:
+                ids[other] = len(names)
+                names.append(other)
+            if badge not in badges:
+                badges[badge] = BadgeIntervals()
+            badges[badge].append(start, start + duration, ids[other], distance)
+    return names, badges
+
+
+def loadshift(n, datadir=DATA_DIR, indexdir=None):
+    # index of one shift, from the saved pickle when it is up to date
+    indexdir = indexdir or f"{datadir}/contact_index"
+    intervalfile = f"{datadir}/contact_intervals/intervals{n:02d}.json.xz"
+    indexfile = f"{indexdir}/index{n:02d}.pickle"
+    if os.path.exists(indexfile) and os.path.getmtime(indexfile) >= os.path.getmtime(intervalfile):
+        with open(indexfile, "rb") as F:
+            return pickle.load(F)
+    names, badges = buildshift(intervalfile)
+    os.makedirs(indexdir, exist_ok=True)
+    with open(indexfile + ".tmp", "wb") as F:
+        pickle.dump((names, badges), F, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(indexfile + ".tmp", indexfile)
+    return names, badges
+
+
+class ContactIndex(object):
+    def __init__(self):
+        self.names, self.ids = list(), dict()
+        self.badges = dict()  # name -> BadgeIntervals
+
+    @classmethod
+    def load(cls, shifts=range(1, 15), datadir=DATA_DIR):
+        """
+        Load the index for shifts; shifts are disjoint in time and added
+        in time order, so each badge's intervals stay sorted by start
+        """
+        Q = cls()
+        for n in sorted(shifts):
+            Q.add(*loadshift(n, datadir))
+        return Q
+
+    def add(self, names, badges):
+        # merge one shift, translating its name indexes to ours
+        remap = array("H")
+        for name in names:
+            if name not in self.ids:
+                self.ids[name] = len(self.names)
+                self.names.append(name)
+            remap.append(self.ids[name])
+        for badge, B in badges.items():
+            B.other = array("H", (remap[i] for i in B.other))
+            if badge in self.badges:
+                self.badges[badge].extend(B)
+            else:
+                self.badges[badge] = B
+
+    def contacts(self, badge, start, end):
+        """
+        Return list of (other,start,end,distance) for each contact
+        interval of badge overlapping [start,end); times are datetimes
+        """
+        B = self.badges.get(badge)
+        if B is None:
+            return list()
+        t1, t2 = toseconds(start), toseconds(end)
+        return [
+            (self.names[B.other[i]], todatetime(B.start[i]), todatetime(B.end[i]), B.distance[i])
+            for i in B.select(t1, t2)
+        ]
+
+    def overlap(self, badgeA, badgeB, start=None, end=None):
+        """
+        Return the times badgeA and badgeB were in contact, as a list
+        of disjoint (start,end) datetime pairs, optionally within [start,end)
+        """
+        A = self.badges.get(badgeA)
+        if A is None or badgeB not in self.ids:
+            return list()
+        t1 = toseconds(start) if start is not None else -(1 << 62)
+        t2 = toseconds(end) if end is not None else 1 << 62
+        merged = self.spans(A, t1, t2, only=self.ids[badgeB]).get(badgeB, [])
+        return [(todatetime(s), todatetime(e)) for s, e in merged]
+
+    def occupants(self, anchor, start, end):
+        """
+        Return dictionary worn badge -> seconds of contact with the
+        anchor within [start,end)
+        """
+        B = self.badges.get(anchor)
+        if B is None:
+            return dict()
+        t1, t2 = toseconds(start), toseconds(end)
+        seconds = dict()
+        for badge, spans in self.spans(B, t1, t2).items():
+            if not badge.startswith("b"):
+                seconds[badge] = sum(e - s for s, e in spans)
+        return seconds
+
+    def spans(self, B, t1, t2, only=None):
+        # name -> merged (start,end) second pairs for intervals of B in [t1,t2)
+        byother = dict()
+        for i in B.select(t1, t2):
+            if only is not None and B.other[i] != only:
+                continue
+            byother.setdefault(B.other[i], list()).append((max(B.start[i], t1), min(B.end[i], t2)))
+        result = dict()
+        for other, pairs in byother.items():
+            merged = list()
+            for s, e in sorted(pairs):
+                if merged and s <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], e)
+                else:
+                    merged.append([s, e])
+            result[self.names[other]] = merged
+        return result
+
+
+if __name__ == "__main__":
+    # e.g. python code/contactquery.py pr045 "2023-04-19 09:00" "2023-04-19 09:30"
+    began = time.perf_counter()
+    Q = ContactIndex.load()
+    print(f"loaded index of {len(Q.badges)} badges in {time.perf_counter() - began:.2f}s")
+    badge = sys.argv[1] if len(sys.argv) > 1 else "pr045"
+    start = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else datetime(2023, 4, 19, 9, 0)
+    end = datetime.fromisoformat(sys.argv[3]) if len(sys.argv) > 3 else start + timedelta(minutes=30)
+    began = time.perf_counter()
+    result = Q.contacts(badge, start, end)
+    elapsed = 1000 * (time.perf_counter() - began)
+    for other, s, e, distance in result:
+        print(other, s, e, distance)
+    print(f"{len(result)} intervals in {elapsed:.2f} ms")
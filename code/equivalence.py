@@ -0,0 +1,176 @@
+"""
+Check that two pipeline artifacts hold the same contact intervals or
+the same histories, whatever their layout: indented or one record a
+line, directed or undirected form (make_intervals.undirected), JSON in
+any codec or the compact arrays of badgeids.py (intervalsNN.npy). Both
+files are read as streams, side by side (jsonstream.iterrecords and
+iteritems), never as whole JSON trees, so memory is that of one block.
+
+Each file becomes a sequence of canonical lines, one per directed
+contact interval or per second of history, grouped in blocks of
+blocksize seconds by time; the lines of a block are sorted (records of
+one second may come in any order) and hashed, and blocks are compared
+by hash. Histories are compared without regard to the order of keys or
+of contact lists, which are dictionary keys in make_histories.history.
+For the first block that differs, the report gives the first differing
+second and a short diff, by badge for histories.
+
+    python code/equivalence.py A B          two files
+    python code/equivalence.py DIRA DIRB    every intervalsNN / historiesNN
+                                            in both (e.g. data/histories and
+                                            a new engine's output directory)
+"""
+
+import sys, os, re, json, hashlib, difflib
+from multiprocessing import Pool
+import numpy as np
+import codec
+import jsonstream
+import make_intervals
+import contactquery
+
+BLOCKSIZE = 600  # seconds of a block
+DIFFLINES = 12  # most lines of diff in a report
+
+
+def kindof(path):
+    # "intervals" or "histories", from a compact array or the first character
+    if path.endswith(".npy"):
+        return "intervals"
+    with codec.openfile(path, "rt") as F:
+        first = F.read(64).lstrip()[:1]
+    return "histories" if first == "{" else "intervals"
+
+
+def units(path, kind):
+    # yield (seconds, canonical line) of the file, in file order
+    if path.endswith(".npy"):
+        import badgeids
+
+        registry = badgeids.Registry.load()
+        for item in badgeids.decodeintervals(np.load(path), registry):
+            t = contactquery.toseconds(item[2])
+            for badge, other in make_intervals.directions(item):
+                yield t, f"{t}\t{badge}\t{other}\t{item[3]}\t{item[4]}"
+        return
+    with codec.openfile(path, "rt") as F:
+        if kind == "intervals":
+            for item in jsonstream.iterrecords(F):
+                t = contactquery.parsetime(item[2])
+                for badge, other in make_intervals.directions(item):
+                    yield t, f"{t}\t{badge}\t{other}\t{item[3]}\t{item[4]}"
+            return
+        for key, snapshot in jsonstream.iteritems(F):
+            for status in snapshot.values():
+                if len(status.get("contacts", ())) > 1:
+                    status["contacts"].sort()
+            t = contactquery.parsetime(key)
+            yield t, f"{t}\t" + json.dumps(snapshot, sort_keys=True, separators=(",", ":"))
+
+
+def blocks(path, kind, blocksize=BLOCKSIZE):
+    # yield (block start, sorted lines, digest), blocks in time order
+    current, lines = None, list()
+    for t, line in units(path, kind):
+        start = t - t % blocksize
+        if current is not None and start != current:
+            if start < current:
+                raise ValueError(f"{path} is not in time order at {contactquery.todatetime(t)}")
+            lines.sort()
+            yield current, lines, hashlib.sha256("\n".join(lines).encode()).digest()
+            lines = list()
+        current = start
+        lines.append(line)
+    if current is not None:
+        lines.sort()
+        yield current, lines, hashlib.sha256("\n".join(lines).encode()).digest()
+
+
+def readable(lines, kind):
+    # lines for a diff: histories split into one line per badge
+    if kind == "intervals":
+        return [jsonstream.datetimestr(contactquery.todatetime(int(t))) + " " + rest.replace("\t", " ")
+                for t, rest in (line.split("\t", 1) for line in lines)]
+    out = list()
+    for line in lines:
+        t, snapshot = line.split("\t", 1)
+        when = jsonstream.datetimestr(contactquery.todatetime(int(t)))
+        for badge, status in sorted(json.loads(snapshot).items()):
+            out.append(f"{when} {badge} {json.dumps(status, sort_keys=True)}")
+    return out
+
+
+def firstdiff(A, B, kind):
+    # (seconds of the first differing line, diff lines) for two blocks' lines
+    i = next((i for i, (a, b) in enumerate(zip(A, B)) if a != b), min(len(A), len(B)))
+    line = A[i] if i < len(A) else B[i]
+    t = int(line.split("\t", 1)[0])
+    pick = lambda L: [x for x in L if x.startswith(f"{t}\t")]
+    diff = difflib.unified_diff(readable(pick(A), kind), readable(pick(B), kind), "A", "B", n=0, lineterm="")
+    return t, [d for d in diff if not d.startswith(("---", "+++", "@@"))][:DIFFLINES]
+
+
+def compare(pathA, pathB, blocksize=BLOCKSIZE):
+    """
+    Compare two artifacts block by block; returns a dictionary with
+    equal, blocks (compared), differing (block starts, in seconds), and
+    for the first differing block first (datetime) and diff (lines)
+    """
+    kind = kindof(pathA)
+    if kindof(pathB) != kind:
+        raise ValueError(f"{pathA} holds {kind}, {pathB} does not")
+    result = {"kind": kind, "blocks": 0, "differing": list(), "first": None, "diff": list()}
+    streamA, streamB = blocks(pathA, kind, blocksize), blocks(pathB, kind, blocksize)
+    a, b = next(streamA, None), next(streamB, None)
+    while a is not None or b is not None:
+        result["blocks"] += 1
+        if b is None or (a is not None and a[0] < b[0]):
+            start, A, B = a[0], a[1], []
+            a = next(streamA, None)
+        elif a is None or b[0] < a[0]:
+            start, A, B = b[0], [], b[1]
+            b = next(streamB, None)
+        else:
+            start, A, B = a[0], a[1], b[1]
+            same = a[2] == b[2]
+            a, b = next(streamA, None), next(streamB, None)
+            if same:
+                continue
+        result["differing"].append(start)
+        if result["first"] is None:
+            t, result["diff"] = firstdiff(A, B, kind)
+            result["first"] = contactquery.todatetime(t)
+    result["equal"] = not result["differing"]
+    return result
+
+
+def _compare(task):
+    return compare(*task)
+
+
+def pairs(dirA, dirB):
+    # (A, B) paths of the artifacts of the same name in both directories
+    found = list()
+    for name in sorted(os.listdir(dirA)):
+        if re.match(r"(intervals|histories)\d\d\.", name) and os.path.exists(os.path.join(dirB, name)):
+            found.append((os.path.join(dirA, name), os.path.join(dirB, name)))
+    return found
+
+
+def report(pathA, pathB, result):
+    lines = [f"{os.path.basename(pathA)}: " + (
+        f"equal ({result['blocks']} blocks)" if result["equal"] else
+        f"{len(result['differing'])} of {result['blocks']} blocks differ, first at "
+        + jsonstream.datetimestr(result["first"]))]
+    lines.extend("    " + d for d in result["diff"])
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    A, B = sys.argv[1:3]
+    tasks = pairs(A, B) if os.path.isdir(A) else [(A, B)]
+    with Pool() as pool:
+        results = pool.map(_compare, tasks, chunksize=1)
+    for (pathA, pathB), result in zip(tasks, results):
+        print(report(pathA, pathB, result))
+    sys.exit(0 if all(r["equal"] for r in results) else 1)
@@ -0,0 +1,204 @@
+"""
+Contact intervals from raw exports larger than memory. make_intervals.py
+parses all of fulldata.xz into one list, then sorts and groups each
+shift in memory; here the raw records are streamed from the file
+(jsonstream.iterrecords), packed into fixed-size binary records (RAW
+below) and spilled, by hour of their datetime, to partition files in a
+scratch directory, appended in arrival order. Reading back, partitions
+are taken in time order, each sorted in memory by a stable sort, so
+records of the same second keep their order in the export (as with
+the sort of makecontactintervals); a partition larger than the memory
+budget is first split by time into 16 finer partitions, streaming, and
+so on. Each pass reads and writes files sequentially.
+
+The sorted records come out as slots (datetime, records of that second),
+which IntervalStream turns into contact intervals in the constant
+memory of its lookahead, giving the same files as makecontactintervals:
+
+    with SpillSort(memory=256 << 20) as S:
+        S.extend(rawrecords("data/fulldata.xz"))
+        for T, Slot in S.slots(start, limit): ...
+
+    python code/externalsort.py [--memory MB] [--undirected] [rawfile]
+        (all shifts, as make_intervals.py does, into data/contact_intervals)
+"""
+
+import sys, os, shutil, tempfile, time
+import numpy as np
+import instrument
+import codec
+import jsonstream
+import contactquery
+import make_intervals
+
+DATA_DIR = 'data'
+MEMORY = 256 << 20  # bytes of records sorted or buffered at once
+WIDTH = 3600  # seconds of a first-level partition
+FANOUT = 16  # finer partitions of one too large to sort in memory
+BUFFERBYTES = 256  # bytes of a buffered record, as Python objects
+
+RAW = np.dtype([
+    ("t", "<i8"), ("badge", "S16"), ("other", "S16"), ("distance", "<i4"), ("duration", "<i4"),
+])
+SORTBYTES = 2 * RAW.itemsize + 8  # a record, its sorted copy and the sort order
+
+
+def rawrecords(filename):
+    # stream the records of a raw export, datetimes as seconds since 1970
+    with codec.openfile(filename, "rt") as F:
+        for item in jsonstream.iterrecords(F):
+            T = item[2]
+            item[2] = contactquery.parsetime(T) if isinstance(T, str) else contactquery.toseconds(T)
+            yield item
+
+
+class SpillSort(object):
+    """
+    Records spilled to time partitions of a scratch directory (removed
+    by close, or on leaving a with block); parts maps the start of a
+    partition (seconds) to its file
+    """
+
+    def __init__(self, memory=MEMORY, directory=None, width=WIDTH):
+        self.memory, self.width = memory, width
+        self.directory = tempfile.mkdtemp(prefix="spill", dir=directory)
+        self.limit = max(1, memory // SORTBYTES)  # records sorted at once
+        self.buffered = max(1, memory // BUFFERBYTES)  # records buffered before a spill
+        self.buffer = list()
+        self.parts = dict()
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def add(self, item):
+        # one raw record: badge, otherbadge, seconds (or datetime), distance, duration
+        badge, other, T, distance, duration = item[:5]
+        if len(badge) > 16 or len(other) > 16:
+            raise ValueError(f"badge name too long for RAW: {item}")
+        self.buffer.append((contactquery.toseconds(T), badge, other, distance, duration))
+        if len(self.buffer) >= self.buffered:
+            self.flush()
+
+    def extend(self, records):
+        with instrument.span("spill") as sp:
+            for item in records:
+                self.add(item)
+            self.flush()
+            sp.count("records", self.count)
+            sp.count("partitions", len(self.parts))
+
+    def flush(self):
+        if self.buffer:
+            A = np.array(self.buffer, dtype=RAW)
+            self.buffer = list()
+            self.count += len(A)
+            spill(A, self.parts, self.width, self.directory)
+
+    def slots(self, start=None, limit=None):
+        """
+        Generate (datetime, records) for each second start <= T < limit
+        (datetimes or seconds; None for no bound) in time order; records
+        are [badge, otherbadge, datetime, distance, duration] in the
+        order they were added
+        """
+        self.flush()
+        lo = None if start is None else contactquery.toseconds(start)
+        hi = None if limit is None else contactquery.toseconds(limit)
+        for key in sorted(self.parts):
+            if (hi is None or key < hi) and (lo is None or key + self.width > lo):
+                yield from partslots(self.parts[key], self.width, self.limit, lo, hi)
+
+
+def spill(A, parts, width, directory):
+    # append records A to the partition files of parts (key -> path), by t
+    keys = A["t"] - A["t"] % width
+    order = np.argsort(keys, kind="stable")
+    A, keys = A[order], keys[order]
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(A)]):
+        key = int(keys[lo])
+        if key not in parts:
+            parts[key] = os.path.join(directory, f"{key}_{width}")
+        with open(parts[key], "ab") as F:
+            A[lo:hi].tofile(F)
+
+
+def partslots(path, width, limit, lo=None, hi=None):
+    # slots of one partition file, split into finer partitions if too large
+    size = os.path.getsize(path) // RAW.itemsize
+    if size > limit and width > 1:
+        finer, directory = dict(), tempfile.mkdtemp(dir=os.path.dirname(path))
+        try:
+            for offset in range(0, size, limit):  # stream, limit records at a time
+                spill(np.fromfile(path, dtype=RAW, count=limit, offset=offset * RAW.itemsize),
+                      finer, max(1, width // FANOUT), directory)
+            for key in sorted(finer):
+                yield from partslots(finer[key], max(1, width // FANOUT), limit, lo, hi)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return
+    A = np.fromfile(path, dtype=RAW)
+    A = A[np.argsort(A["t"], kind="stable")]
+    if lo is not None:
+        A = A[A["t"] >= lo]
+    if hi is not None:
+        A = A[A["t"] < hi]
+    bounds = np.flatnonzero(np.diff(A["t"])) + 1
+    for first, last in zip(np.r_[0, bounds].tolist(), np.r_[bounds, len(A)].tolist()):
+        T = contactquery.todatetime(int(A["t"][first]))
+        yield T, [[b.decode(), o.decode(), T, d, u] for t, b, o, d, u in A[first:last].tolist()]
+
+
+def streamintervals(slots, mindistance=12, orphanduration=10, mergewindow=15):
+    """
+    Contact intervals (directed, in datetime order) of slots in time
+    order, through make_intervals.IntervalStream: a slot is final once
+    the slots within mergewindow seconds after it have been added
+    """
+    S = make_intervals.IntervalStream(mergewindow, mindistance, orphanduration)
+    for T, Slot in slots:
+        for item in Slot:
+            S.add(item)
+        for _, final in S.advance(T):
+            yield from final
+    for _, final in S.advance():
+        yield from final
+
+
+def makeshifts(rawfile, shifts=range(1, 15), datadir=DATA_DIR, memory=MEMORY, directory=None,
+               undirected_form=False, mindistance=12, orphanduration=10, mergewindow=15):
+    # contact interval files of shifts from rawfile, spilling once for all
+    os.makedirs(f"{datadir}/contact_intervals", exist_ok=True)
+    with SpillSort(memory, directory) as S:
+        S.extend(rawrecords(rawfile))
+        for n in shifts:
+            filename = f"{datadir}/contact_intervals/intervals{n:02d}.json.xz"
+            slots = S.slots(make_intervals.ShiftTable[n], make_intervals.ShiftTable[n + 1])
+            with instrument.span("makecontactintervals", shift=n) as sp:
+                R = streamintervals(slots, mindistance, orphanduration, mergewindow)
+                sp.count("bytes", make_intervals.writeintervals(R, filename, undirected_form))
+            print("saved shift", n, "contact intervals")
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    args = sys.argv[1:]
+    memory = MEMORY
+    if "--memory" in args:
+        i = args.index("--memory")
+        memory = int(float(args[i + 1]) * 2**20)
+        del args[i : i + 2]
+    undirected_form = "--undirected" in args
+    args = [a for a in args if not a.startswith("--")]
+    rawfile = args[0] if args else f"{DATA_DIR}/fulldata.xz"
+    began = time.perf_counter()
+    makeshifts(rawfile, memory=memory, undirected_form=undirected_form)
+    print(f"done in {time.perf_counter() - began:.1f}s")
@@ -11,8 +11,10 @@ the middle 8 hours of a 12 hour shift.
 
 from datetime import datetime, timedelta
 from collections import OrderedDict
-import sys, os, lzma, json
+import sys, os, json
 from pprint import pprint
+import codec
+import make_intervals
 
 DATA_DIR = 'data'
 
@@ -30,10 +32,9 @@ def hcplist(contactintervalfile, centerhours=12):
     """
 
     # read the compressed file and reconstitute datetime objects
-    with lzma.open(contactintervalfile, "r") as F:
-        U = F.read().decode("utf-8")
+    U = codec.readbytes(contactintervalfile).decode("utf-8")
     T = json.loads(U)
-    K = [[item[0], item[1], eval(item[2]), item[3], item[4]] for item in T]
+    K = [[item[0], item[1], eval(item[2])] + item[3:] for item in T]  # either form
 
     # filter the shift by the "center" time window
     startofshift = min(e[2] for e in K)  # start of shift as a datetime object
@@ -52,13 +53,15 @@ def hcplist(contactintervalfile, centerhours=12):
 
     # summarize badges observed and return as output
     R = {"nurse": set(), "provider": set(), "support": set()}
-    for badge, other, timestamp, distance, duration in J:
-        if badge.startswith("n"):
-            R["nurse"] |= {badge}
-        if badge.startswith("p"):
-            R["provider"] |= {badge}
-        if badge.startswith("s"):
-            R["support"] |= {badge}
+    for item in J:
+        # first badge of each directed record (both, for an undirected pair)
+        for badge, other in make_intervals.directions(item):
+            if badge.startswith("n"):
+                R["nurse"] |= {badge}
+            if badge.startswith("p"):
+                R["provider"] |= {badge}
+            if badge.startswith("s"):
+                R["support"] |= {badge}
     daytable = "Mon Tue Wed Thu Fri Sat Sun".split()
     R["dayofweek"] = daytable[startofshift.weekday()]
     return R
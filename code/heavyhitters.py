@@ -0,0 +1,228 @@
+"""
+Top-k HCPs and anchors of a stream of hyperedges (or contacts) in fixed
+memory, for counts over a whole deployment or a live feed, where the
+exact counter of analysis.py would have to hold every ID:
+
+    H = HeavyHitters(capacity=64)
+    for event in events:
+        H.update(event["members"])
+    H.topk(10)      [(id, lower, upper), ...], lower <= true count <= upper
+    H.merge(G)      G from another shift or worker, same width/depth/seed
+
+Two summaries are kept. Space-Saving (Metwally et al.) holds capacity
+counters: an ID not held takes the counter of the least count, whose
+value becomes its error, so a held ID's count is at most error more
+than the truth and any ID with more than N/capacity events is held.
+Count-Min (Cormode and Muthukrishnan) is depth rows of width counters,
+an ID adding to one counter per row, chosen by a keyed hash; the least
+of its counters over-counts by at most 2N/width with probability
+1 - 2^-depth. The upper bound of an ID is the lesser of the two, the
+lower its Space-Saving count less error. Both merge (summaries of
+disjoint streams add, as in the mergeable summaries of Agarwal et al.),
+so shifts can be summarized in parallel and combined. Where a second
+pass over the stream is possible, refine() counts just the candidates
+exactly.
+
+    python code/heavyhitters.py [hcp|anchor] [capacity]    (all shifts)
+"""
+
+import sys, heapq, hashlib
+from collections import Counter
+from functools import lru_cache
+from multiprocessing import Pool
+import numpy as np
+
+
+class SpaceSaving(object):
+    # capacity counters: id -> count, and id -> error (overestimate bound)
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.count, self.error = dict(), dict()
+        self.heap = list()  # (count, id), some entries stale
+        self.total = 0
+
+    def update(self, item, n=1):
+        self.total += n
+        if item in self.count:
+            self.count[item] += n
+        elif len(self.count) < self.capacity:
+            self.count[item], self.error[item] = n, 0
+        else:
+            least, victim = self.least()
+            del self.count[victim], self.error[victim]
+            self.count[item], self.error[item] = least + n, least
+        heapq.heappush(self.heap, (self.count[item], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, i) for i, c in self.count.items()]
+            heapq.heapify(self.heap)
+
+    def least(self):
+        # (count, id) of the least held counter
+        while True:
+            c, item = self.heap[0]
+            if self.count.get(item) == c:
+                return c, item
+            heapq.heappop(self.heap)
+
+    @property
+    def floor(self):
+        # count of an ID not held is at most this
+        return self.least()[0] if len(self.count) >= self.capacity else 0
+
+    def merge(self, other):
+        # summary of both streams, in place
+        fa, fb = self.floor, other.floor
+        count, error = dict(), dict()
+        for item in self.count.keys() | other.count.keys():
+            count[item] = self.count.get(item, fa) + other.count.get(item, fb)
+            error[item] = self.error.get(item, fa) + other.error.get(item, fb)
+        keep = heapq.nlargest(self.capacity, count, key=lambda i: (count[i], i))
+        self.count = {i: count[i] for i in keep}
+        self.error = {i: error[i] for i in keep}
+        self.heap = [(c, i) for i, c in self.count.items()]
+        heapq.heapify(self.heap)
+        self.total += other.total
+        return self
+
+
+class CountMin(object):
+    # depth x width counters; hashes are keyed by seed, so that summaries merge
+
+    def __init__(self, width=1024, depth=4, seed=0):
+        self.width, self.depth, self.seed = width, depth, seed
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.rows = np.arange(depth)
+
+    def cells(self, item):
+        return cells(item, self.width, self.depth, self.seed)
+
+    def update(self, item, n=1):
+        self.table[self.rows, self.cells(item)] += n
+
+    def estimate(self, item):
+        return int(self.table[self.rows, self.cells(item)].min())
+
+    def merge(self, other):
+        assert (self.width, self.depth, self.seed) == (other.width, other.depth, other.seed)
+        self.table += other.table
+        return self
+
+
+@lru_cache(maxsize=4096)
+def cells(item, width, depth, seed):
+    # the counter of item in each row (IDs recur, so hashes are cached)
+    key = seed.to_bytes(8, "little")
+    digest = hashlib.blake2b(item.encode(), digest_size=4 * depth, key=key).digest()
+    return np.frombuffer(digest, dtype="<u4") % width
+
+
+class HeavyHitters(object):
+    """
+    Space-Saving and Count-Min over the IDs of a stream; keep is a
+    predicate on IDs (e.g. only anchors), None for all
+    """
+
+    def __init__(self, capacity=64, width=1024, depth=4, seed=0, keep=None):
+        self.summary = SpaceSaving(capacity)
+        self.sketch = CountMin(width, depth, seed)
+        self.keep = keep
+
+    def update(self, members, n=1):
+        # one event: every member (duplicates too, as analysis.py counts) gets n
+        for item in members:
+            if self.keep is None or self.keep(item):
+                self.summary.update(item, n)
+                self.sketch.update(item, n)
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def bounds(self, item):
+        S = self.summary
+        upper = min(S.count.get(item, S.floor), self.sketch.estimate(item))
+        lower = S.count[item] - S.error[item] if item in S.count else 0
+        return lower, upper
+
+    def ranked(self):
+        return sorted(((i,) + self.bounds(i) for i in self.summary.count),
+                      key=lambda e: (-e[2], -e[1], e[0]))
+
+    def topk(self, k=10):
+        """
+        List of (id, lower, upper) for the k held IDs of highest upper
+        bound; an ID is surely in the true top k when its lower bound is
+        at least the upper bound of every ID after the first k
+        """
+        return self.ranked()[:k]
+
+    def certain(self, k=10):
+        # IDs of topk(k) surely in the true top k
+        ranked = self.ranked()
+        beyond = max([e[2] for e in ranked[k:]] + [self.summary.floor])
+        return [e[0] for e in ranked[:k] if e[1] >= beyond]
+
+    @property
+    def total(self):
+        return self.summary.total
+
+
+def refine(events, candidates):
+    # exact counts of candidate IDs over events (a second pass)
+    candidates = set(candidates)
+    exact = Counter()
+    for members in events:
+        exact.update(m for m in members if m in candidates)
+    return exact
+
+
+def ishcp(item):
+    return not item.startswith("b")
+
+
+def isanchor(item):
+    return item.startswith("b")
+
+
+def summarize(task):
+    # worker: summary of the hyperedges of one hypergraph file
+    import json, codec
+
+    filename, kind, capacity = task
+    H = HeavyHitters(capacity, keep=ishcp if kind == "hcp" else isanchor)
+    with codec.openfile(filename, "rt") as F:
+        for event in json.load(F):
+            H.update(event["members"])
+    return H
+
+
+def deployment(files, kind="hcp", capacity=64, processes=None):
+    # one merged summary of the hypergraph files, one worker a file
+    with Pool(processes) as pool:
+        summaries = pool.map(summarize, [(f, kind, capacity) for f in files])
+    H = summaries[0]
+    for other in summaries[1:]:
+        H.merge(other)
+    return H
+
+
+if __name__ == "__main__":
+    import instrument
+    import pipeline
+
+    instrument.configure(sys.argv)
+    kind = sys.argv[1] if len(sys.argv) > 1 else "hcp"
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    G = pipeline.graph()
+    files = list()
+    for n, stage in G["hypergraph"].items():
+        pipeline.build(stage)
+        files.append(stage.artifact("spatial_hypergraph.json"))
+    with instrument.span("heavyhitters", kind=kind, capacity=capacity):
+        H = deployment(files, kind, capacity)
+    sure = set(H.certain(10))
+    print(f"{H.total} {kind} memberships, {capacity} counters")
+    for item, lower, upper in H.topk(10):
+        print(f"{item:8s} {lower:8d} .. {upper:8d}{'  certain' if item in sure else ''}")
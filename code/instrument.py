@@ -0,0 +1,201 @@
+"""
+Instrumentation for the processing pipeline. Stages and sub-stages are
+wrapped in spans, for example
+
+    with instrument.span("history", shift=n) as sp:
+        T = history(K)
+        sp.count("seconds", len(T))
+
+and each span, when it finishes, writes one JSON line with its wall
+time, CPU time, peak memory and counts:
+
+    {"span": "makehistory/history", "wall": 12.1, "cpu": 12.0,
+     "maxrss_kb": 2310044, "shift": 2, "counts": {"seconds": 43799}}
+
+Tracing is off unless requested, and then span() returns a shared
+do-nothing object, so instrumented code runs as before. Requests come
+from environment variables or from the same options on a command line
+(see configure, which each script calls with sys.argv):
+
+    MICU_TRACE=file        --trace file         JSON lines to file ("-" for stderr)
+    MICU_PROFILE=name      --profile name       cProfile the span(s) called name
+    MICU_TRACEMALLOC=name  --tracemalloc name   tracemalloc the span(s) called name
+
+With tracemalloc running, peak_kb (peak of traced Python allocations
+within the span) is reported in addition to maxrss_kb, which is the
+high-water mark of the whole process.
+"""
+
+import os, sys, time, json, resource
+
+TRACE = os.environ.get("MICU_TRACE")
+PROFILE = os.environ.get("MICU_PROFILE")
+TRACEMALLOC = os.environ.get("MICU_TRACEMALLOC")
+
+stack = list()  # names of open spans, outermost first
+stream = None  # open file for TRACE, once needed
+
+
+def configure(argv=None, trace=None, profile=None, tracemalloc=None):
+    """
+    Set tracing options, either directly or by removing --trace,
+    --profile and --tracemalloc options (each followed by a value)
+    from argv, which is modified in place
+    """
+    global TRACE, PROFILE, TRACEMALLOC
+    options = {"--trace": trace, "--profile": profile, "--tracemalloc": tracemalloc}
+    if argv is not None:
+        i = 1
+        while i < len(argv):
+            if argv[i] in options and i + 1 < len(argv):
+                options[argv[i]] = argv[i + 1]
+                del argv[i : i + 2]
+            else:
+                i += 1
+    TRACE = options["--trace"] or TRACE
+    PROFILE = options["--profile"] or PROFILE
+    TRACEMALLOC = options["--tracemalloc"] or TRACEMALLOC
+    # export, so scripts run as subprocesses (stat.py) trace the same way
+    for key, value in (("MICU_TRACE", TRACE), ("MICU_PROFILE", PROFILE),
+                       ("MICU_TRACEMALLOC", TRACEMALLOC)):
+        if value:
+            os.environ[key] = value
+
+
+def enabled():
+    return bool(TRACE or PROFILE or TRACEMALLOC)
+
+
+class NullSpan(object):
+    # stands in for a span when instrumentation is off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, key, n=1):
+        pass
+
+
+NULLSPAN = NullSpan()
+
+
+class Span(object):
+    def __init__(self, name, fields):
+        self.name, self.fields, self.counts = name, fields, dict()
+        self.profiler = None
+        self.tracing = False
+
+    def count(self, key, n=1):
+        # add n to the count for key (items processed, records written, ...)
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def __enter__(self):
+        stack.append(self.name)
+        self.path = "/".join(stack)
+        if TRACEMALLOC == self.name:
+            import tracemalloc
+
+            self.tracing = not tracemalloc.is_tracing()
+            if self.tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.snapbase = tracemalloc.take_snapshot()
+        if PROFILE == self.name:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        if self.profiler:
+            self.profiler.disable()
+            report(self.path, profile=self.profiler)
+        entry = {"span": self.path, "wall": round(wall, 6), "cpu": round(cpu, 6)}
+        entry["maxrss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if TRACEMALLOC == self.name:
+            import tracemalloc
+
+            entry["peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            snapshot = tracemalloc.take_snapshot()
+            report(self.path, top=snapshot.compare_to(self.snapbase, "lineno")[:15])
+            if self.tracing:
+                tracemalloc.stop()
+        entry.update(self.fields)
+        if self.counts:
+            entry["counts"] = self.counts
+        if exc[0] is not None:
+            entry["error"] = exc[0].__name__
+        stack.pop()
+        emit(entry)
+        return False
+
+
+def span(name, **fields):
+    """
+    Return a context manager timing the named stage; fields (shift
+    number, file name, ...) are copied into the JSON line
+    """
+    if not (TRACE or PROFILE or TRACEMALLOC):
+        return NULLSPAN
+    return Span(name, fields)
+
+
+def output():
+    global stream
+    if stream is None:
+        if not TRACE or TRACE == "-":
+            stream = sys.stderr
+        else:
+            stream = open(TRACE, "a")
+    return stream
+
+
+def emit(entry):
+    if not TRACE:
+        return  # only profiling was requested
+    F = output()
+    F.write(json.dumps(entry, default=str) + "\n")
+    F.flush()
+
+
+def report(path, profile=None, top=None):
+    # human-readable profile output goes to stderr
+    print(f"--- profile of span {path} ---", file=sys.stderr)
+    if profile is not None:
+        import pstats
+
+        pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    for line in top or []:
+        print(line, file=sys.stderr)
+
+
+def summarize(tracefile):
+    """
+    Read a JSON-lines trace and return a dictionary span path ->
+    {"n":calls,"wall":total,"cpu":total}, for a quick look at where
+    time goes across a run
+    """
+    S = dict()
+    with open(tracefile) as F:
+        for line in F:
+            entry = json.loads(line)
+            total = S.setdefault(entry["span"], {"n": 0, "wall": 0.0, "cpu": 0.0})
+            total["n"] += 1
+            total["wall"] += entry["wall"]
+            total["cpu"] += entry["cpu"]
+    return S
+
+
+if __name__ == "__main__":
+    # summarize a trace file, slowest spans first
+    S = summarize(sys.argv[1])
+    for path in sorted(S, key=lambda p: -S[p]["wall"]):
+        t = S[path]
+        print(f"{t['wall']:10.2f}s wall {t['cpu']:10.2f}s cpu {t['n']:6d}x  {path}")
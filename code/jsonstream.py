@@ -0,0 +1,187 @@
+"""
+Streaming JSON output for contact intervals and histories. Instead of
+building the whole json.dumps(R, indent=4) string (and then a second,
+encoded copy of it) before compressing, records are encoded one at a
+time and handed to the (compressed) file in chunks of about chunksize
+bytes, so memory for writing is bounded by the chunk size.
+
+Records are written one per line, without indentation padding:
+
+    [
+    ["b154", "ss041", "datetime(2023, 4, 18, 7, 0)", 33, 10],
+    ["ss041", "b154", "datetime(2023, 4, 18, 7, 0)", 33, 10],
+    ...
+    ]
+
+which json.load reads exactly as it reads the older indented files.
+With indent=4 the output is instead byte-for-byte what json.dumps(R,
+indent=4) produced, for comparing with files made by earlier versions.
+
+For reading, iterrecords and iteritems are the streaming counterparts
+of json.load for a top-level array or object: they yield one element
+(or key and value) at a time from a text file, reading it in chunks,
+so memory is bounded by the largest element rather than the file.
+Both layouts above, and any other whitespace, read the same.
+"""
+
+import json, codecs
+
+CHUNKSIZE = 1 << 20  # bytes handed to the compressor at a time
+
+
+def datetimestr(T):
+    # the string form of datetimes used in all the JSON files
+    return repr(T).replace("datetime.datetime", "datetime")
+
+
+def intervalstr(item):
+    # copy of a contact interval with its datetime as a string
+    # (and flags, for the undirected form of make_intervals.undirected)
+    return [item[0], item[1], datetimestr(item[2])] + list(item[3:])
+
+
+class ChunkWriter(object):
+    # collects encoded pieces, writing them to F about chunksize at a time
+
+    def __init__(self, F, chunksize=CHUNKSIZE):
+        self.F, self.chunksize = F, chunksize
+        self.pieces, self.size, self.total = list(), 0, 0
+
+    def write(self, s):
+        self.pieces.append(s)
+        self.size += len(s)
+        if self.size >= self.chunksize:
+            self.flush()
+
+    def flush(self):
+        if self.pieces:
+            B = "".join(self.pieces).encode("utf-8")
+            self.F.write(B)
+            self.total += len(B)
+            self.pieces, self.size = list(), 0
+
+
+def encoder(indent):
+    # returns function encoding one element at nesting level 1
+    if indent is None:
+        return json.dumps
+    pad = " " * indent
+
+    def encode(value):
+        return json.dumps(value, indent=indent).replace("\n", "\n" + pad)
+
+    return encode
+
+
+def dumprecords(records, F, indent=None, chunksize=CHUNKSIZE):
+    """
+    Write iterable records to binary file F as a JSON array;
+    returns the number of bytes written
+    """
+    W, encode = ChunkWriter(F, chunksize), encoder(indent)
+    pad = "" if indent is None else " " * indent
+    first = True
+    for item in records:
+        W.write(("[\n" if first else ",\n") + pad + encode(item))
+        first = False
+    W.write("[]" if first else "\n]")
+    W.flush()
+    return W.total
+
+
+def dumpmapping(items, F, indent=None, chunksize=CHUNKSIZE):
+    """
+    Write iterable (key,value) pairs, keys being strings, to binary
+    file F as a JSON object; returns the number of bytes written
+    """
+    W, encode = ChunkWriter(F, chunksize), encoder(indent)
+    pad = "" if indent is None else " " * indent
+    first = True
+    for key, value in items:
+        W.write(("{\n" if first else ",\n") + pad + json.dumps(key) + ": " + encode(value))
+        first = False
+    W.write("{}" if first else "\n}")
+    W.flush()
+    return W.total
+
+
+class ChunkReader(object):
+    # decodes level-1 elements of a JSON text file read chunksize at a time
+
+    def __init__(self, F, chunksize=CHUNKSIZE):
+        self.F, self.chunksize = F, chunksize
+        self.buffer, self.pos, self.eof = "", 0, False
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()  # for binary files
+
+    def more(self):
+        # read another chunk; False at end of file
+        chunk = ""
+        while not chunk:  # a chunk of bytes may hold only part of a character
+            if self.eof:
+                return False
+            raw = self.F.read(self.chunksize)
+            if isinstance(raw, bytes):
+                chunk = self.utf8.decode(raw, final=not raw)
+            else:
+                chunk = raw
+            self.eof = not raw
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # next character that is not whitespace ("" at end of file)
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.more():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars or not c:
+            raise ValueError(f"expected one of {chars!r}, found {c!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        # decode the next value, which is complete once a delimiter follows
+        # (a number at the end of the buffer may be cut short)
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) and self.buffer[end] in " \t\n\r,:]}" or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            if not self.more():
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+
+    def elements(self, opening, closing, pair):
+        self.expect(opening)
+        if self.peek() == closing:
+            self.pos += 1
+            return
+        while True:
+            if pair:
+                key = self.value()
+                self.expect(":")
+                yield key, self.value()
+            else:
+                yield self.value()
+            if self.expect("," + closing) == closing:
+                return
+
+
+def iterrecords(F, chunksize=CHUNKSIZE):
+    # yield the elements of the JSON array in (text or binary) file F
+    return ChunkReader(F, chunksize).elements("[", "]", False)
+
+
+def iteritems(F, chunksize=CHUNKSIZE):
+    # yield the (key,value) pairs of the JSON object in file F, in file order
+    return ChunkReader(F, chunksize).elements("{", "}", True)
@@ -0,0 +1,29 @@
+"""
+Anchor positions on the ICU layout image (figures/iculayout.png), for
+code that draws on the layout or computes with positions. The yaml file
+placement005.yaml has anchor coordinates in pixel units, but offset:
+the image position of an anchor is (x - minx + 50, y - miny + 50),
+minx and miny being the least coordinates over all anchors, as in
+showbadge.py (the offset owes to the Java program that made the yaml).
+"""
+
+import yaml
+
+SUPP_DIR = 'supp'
+FIG_DIR = 'figures'
+
+# a patient room, door anchor to sink anchor, is about 46 pixels and
+# 13 feet; Instant-Trace distances are in inches
+INCHES_PER_PIXEL = 3.5
+
+
+def anchorcoords(placement_file=f"{SUPP_DIR}/placement005.yaml"):
+    # map anchor -> (x,y) position on iculayout.png, in pixels
+    with open(placement_file) as F:
+        anchorlist = yaml.safe_load(F)["anchors"]
+    minx = int(min(anchorlist[badge]["x"] for badge in anchorlist))
+    miny = int(min(anchorlist[badge]["y"] for badge in anchorlist))
+    return {
+        badge: (anchorlist[badge]["x"] - minx + 50, anchorlist[badge]["y"] - miny + 50)
+        for badge in anchorlist
+    }
@@ -0,0 +1,250 @@
+"""
+Online mode of the pipeline, for alerts during a shift rather than after
+it. Raw Instant-Trace records (one JSON list per line, in the fulldata.xz
+form [badge, otherbadge, "datetime(...)", distance, duration]) arrive from
+a tailed file or a local socket, and the service publishes
+
+    ("interval", [badge, otherbadge, T, distance, duration])
+        for each contact interval, once it can no longer change
+    ("state", moment, badge, {"room": ..., "inroom": ..., "pending": ...})
+        for each change of a badge's room state (state None: left room)
+
+to every subscriber (an asyncio.Queue from subscribe()). Work is done in
+event time: the watermark is the latest record datetime seen, less a
+lateness of 15 seconds, and it also advances with the wall clock when
+no records arrive. make_intervals.IntervalStream does the clean,
+enforceSymmetry and intervalMerge steps; RoomTracker replays each final
+second through make_histories.genstate, as inroomhist does for a shift.
+
+    python code/livestream.py tail FILE           (follow a growing file)
+    python code/livestream.py serve PORT          (records sent to localhost:PORT)
+    python code/livestream.py replay FILE SPEED   (e.g. synthetic.py output at 100x)
+
+Replay feeds a recorded shift (fulldata.xz form, any codec) at SPEED
+times real time and reports the latency, wall-clock seconds from a
+record's arrival to the publication of its slot's intervals.
+"""
+
+import sys, os, json, time, asyncio
+from datetime import datetime, timedelta
+from make_intervals import IntervalStream
+import make_histories
+from make_histories import State
+import codec
+
+LATENESS = 15  # seconds a record may lag the latest one seen
+
+
+def parserecord(line):
+    # one raw record from a line of text, datetime converted
+    item = json.loads(line) if isinstance(line, (str, bytes)) else list(line)
+    if isinstance(item[2], str):
+        item[2] = eval(item[2]) if item[2].startswith("datetime") else datetime.fromisoformat(item[2])
+    return item
+
+
+class RoomTracker(object):
+    """
+    Follows room states second by second from final contact intervals:
+    for each second it rebuilds the contact map that history() would
+    have for that moment and applies genstate to every worn badge
+    """
+
+    def __init__(self):
+        self.active = list()  # intervals covering the current second, in order
+        self.upcoming = list()  # final intervals not yet started
+        self.moment = None  # next second to evaluate
+        State.InitState(None, set())
+
+    def addintervals(self, intervals):
+        for item in intervals:
+            for badge in item[:2]:
+                if not badge.startswith("b") and badge not in State.StateMap:
+                    State.StateMap[badge] = State(badge)
+            self.upcoming.append(item)
+            if self.moment is None:
+                self.moment = item[2]
+
+    def advance(self, final):
+        """
+        Evaluate every second up to and including final (all intervals
+        starting by then have been added); returns list of state changes
+        """
+        changes = list()
+        while self.moment is not None and self.moment <= final:
+            moment = self.moment
+            started = [e for e in self.upcoming if e[2] <= moment]
+            self.upcoming = [e for e in self.upcoming if e[2] > moment]
+            self.active = [e for e in self.active + started
+                           if e[2] + timedelta(seconds=e[4]) > moment]
+            snapshot = {badge: dict() for badge in State.StateMap}
+            for badge, other, T, distance, duration in self.active:
+                if not badge.startswith("b"):
+                    snapshot[badge][other] = distance
+            T = {moment: snapshot}
+            for badge in snapshot:
+                before = self.summary(State.StateMap[badge])
+                make_histories.genstate(T, moment, badge, State.StateMap)
+                after = self.summary(State.StateMap[badge])
+                if after != before:
+                    changes.append((moment, badge, after))
+            self.moment = moment + timedelta(seconds=1)
+        return changes
+
+    @staticmethod
+    def summary(state):
+        # the form of a state in histories (see combineRoomHist)
+        if not state.room:
+            return None
+        entry = {"room": state.room}
+        if state.inroom:
+            entry["inroom"] = True
+        if state.pending:
+            entry["pending"] = True
+        return entry
+
+
+class LiveService(object):
+    def __init__(self, lateness=LATENESS, speed=1.0):
+        self.stream = IntervalStream()
+        self.rooms = RoomTracker()
+        self.lateness = timedelta(seconds=lateness)
+        self.speed = speed  # event seconds per wall second (replay)
+        self.subscribers = list()
+        self.latest = None  # latest record datetime seen
+        self.arrival = None  # wall time of latest record
+        self.slotwall = dict()  # T -> wall time of last record of slot T
+        self.latencies = list()
+
+    def subscribe(self, maxsize=0):
+        Q = asyncio.Queue(maxsize)
+        self.subscribers.append(Q)
+        return Q
+
+    def publish(self, message):
+        for Q in self.subscribers:
+            if not Q.full():
+                Q.put_nowait(message)
+
+    def ingest(self, item):
+        now = time.perf_counter()
+        self.stream.add(item)
+        T = item[2]
+        self.slotwall[T] = now
+        if self.latest is None or T > self.latest:
+            self.latest, self.arrival = T, now
+        self.flush(self.latest - self.lateness)
+
+    def flush(self, watermark):
+        final = self.stream.advance(watermark)
+        if not final:
+            return
+        now = time.perf_counter()
+        for T, intervals in final:
+            self.latencies.append(now - self.slotwall.pop(T, now))
+            for item in intervals:
+                self.publish(("interval", item))
+            self.rooms.addintervals(intervals)
+        for moment, badge, state in self.rooms.advance(final[-1][0]):
+            self.publish(("state", moment, badge, state))
+
+    async def heartbeat(self, period=1.0):
+        # let the watermark follow the clock while no records arrive
+        while True:
+            await asyncio.sleep(period)
+            if self.latest is not None:
+                idle = time.perf_counter() - self.arrival
+                self.flush(self.latest + timedelta(seconds=idle * self.speed) - self.lateness)
+
+    async def run(self, source):
+        # consume an async iterator of raw records until it ends
+        beat = asyncio.ensure_future(self.heartbeat())
+        try:
+            async for item in source:
+                self.ingest(item)
+        finally:
+            beat.cancel()
+        self.flush(None)  # end of input: everything is final
+        self.publish(("end",))
+
+    def stats(self):
+        L = sorted(self.latencies)
+        if not L:
+            return dict()
+        pick = lambda q: round(1000 * L[min(len(L) - 1, int(q * len(L)))], 3)
+        return {"slots": len(L), "late": self.stream.late, "p50_ms": pick(0.5),
+                "p99_ms": pick(0.99), "max_ms": round(1000 * L[-1], 3)}
+
+
+async def tailfile(path, poll=0.5):
+    # yield records appended to a file, as tail -f does
+    with open(path) as F:
+        while True:
+            line = F.readline()
+            if not line:
+                await asyncio.sleep(poll)
+                continue
+            if line.strip():
+                yield parserecord(line)
+
+
+async def socketsource(port, host="127.0.0.1"):
+    # yield records sent, one per line, by clients of a local socket
+    Q = asyncio.Queue()
+
+    async def client(reader, writer):
+        async for line in reader:
+            if line.strip():
+                await Q.put(parserecord(line))
+        writer.close()
+
+    server = await asyncio.start_server(client, host, port)
+    async with server:
+        while True:
+            yield await Q.get()
+
+
+async def replaysource(Raw, speed):
+    """
+    Yield recorded raw records (sorted by datetime) at speed times
+    their original pace
+    """
+    began, origin = time.perf_counter(), None
+    for item in Raw:
+        item = parserecord(item)
+        origin = origin or item[2]
+        due = began + (item[2] - origin).total_seconds() / speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield item
+
+
+async def printer(Q):
+    # a subscriber that logs state changes
+    while True:
+        message = await Q.get()
+        if message[0] == "end":
+            return
+        if message[0] == "state":
+            print(*message)
+
+
+async def main(argv):
+    mode = argv[1]
+    if mode == "replay":
+        speed = float(argv[3]) if len(argv) > 3 else 100
+        Raw = json.loads(codec.readbytes(argv[2]))
+        service = LiveService(speed=speed)
+        source = replaysource(Raw, speed)
+    else:
+        service = LiveService()
+        source = tailfile(argv[2]) if mode == "tail" else socketsource(int(argv[2]))
+    listener = asyncio.ensure_future(printer(service.subscribe()))
+    await service.run(source)
+    await listener
+    print("latency", service.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv))
@@ -0,0 +1,187 @@
+"""
+Estimated positions of worn badges on the ICU layout, from their
+distances to anchors. A badge's anchor contacts (from the contact
+intervals: the anchor and the distance in inches) change only when an
+interval starts or ends, so each badge's time is cut into segments with
+a fixed set of anchor contacts, and one position is estimated for each
+segment by weighted least-squares trilateration: with anchors a_i at
+distances r_i, minimize the sum of w_i (|p - a_i| - r_i)^2 where the
+weights w_i = 1/r_i^2 trust near anchors more.
+
+All segments of a shift are solved together as arrays: a linear
+least-squares start (from |p|^2 - 2 a_i.p + |a_i|^2 = r_i^2, needing
+three anchors not in a line; otherwise a weighted centroid), refined by
+damped Gauss-Newton steps. A segment with one anchor is placed at that
+anchor, its residual then being the distance (the radius of doubt);
+in the study data most badge-seconds have just one anchor in contact.
+Positions are pixels of figures/iculayout.png (see layout.py).
+
+The result for a shift is a trajectory table (TRACK below: badge ID of
+badgeids.py, start, end, x, y, number of anchors, RMS residual in
+inches), saved as data/contact_arrays/trackNN.npy.
+
+    python code/localize.py              (all shifts)
+"""
+
+import sys, os, time
+from bisect import bisect_right
+import numpy as np
+import make_intervals
+import badgeids
+from badgeids import ARRAY_DIR
+import contactquery
+import layout
+
+DATA_DIR = 'data'
+MAXANCHORS = 8  # nearest anchors used for a segment
+ITERATIONS = 5  # Gauss-Newton steps
+DAMPING = 1e-3
+
+TRACK = np.dtype([
+    ("badge", "<u2"), ("start", "<i8"), ("end", "<i8"), ("x", "<f4"), ("y", "<f4"),
+    ("anchors", "u1"), ("residual", "<f4"),
+])
+
+
+def segments(records, coords):
+    """
+    Given directed contact intervals (datetime objects), return (keys,
+    A, R) for every stretch of time a worn badge has a fixed set of
+    anchor contacts: keys is a list of (badge, start, end) in seconds,
+    A[s,k] the pixel position of the k-th anchor of segment s and R[s,k]
+    its distance in pixels (nan where a segment has fewer anchors)
+    """
+    contacts = dict()  # badge -> list of (start, end, anchor, distance)
+    for badge, other, T, distance, duration in records:
+        if badge.startswith("b") or other not in coords:
+            continue
+        start = contactquery.toseconds(T)
+        contacts.setdefault(badge, list()).append((start, start + duration, other, distance))
+    keys, rows = list(), list()
+    for badge, intervals in contacts.items():
+        events = sorted({t for e in intervals for t in e[:2]})
+        intervals.sort()
+        active, nxt = list(), 0
+        for t, until in zip(events, events[1:]):
+            while nxt < len(intervals) and intervals[nxt][0] <= t:
+                active.append(intervals[nxt])
+                nxt += 1
+            active = [e for e in active if e[1] > t]
+            if not active:
+                continue
+            nearest = dict()  # anchor -> distance, the latest interval winning
+            for start, end, anchor, distance in active:
+                nearest[anchor] = distance
+            keys.append((badge, t, until))
+            rows.append(sorted((d, a) for a, d in nearest.items())[:MAXANCHORS])
+    A = np.full((len(rows), MAXANCHORS, 2), np.nan)
+    R = np.full((len(rows), MAXANCHORS), np.nan)
+    for s, row in enumerate(rows):
+        for k, (distance, anchor) in enumerate(row):
+            A[s, k] = coords[anchor]
+            R[s, k] = distance / layout.INCHES_PER_PIXEL
+    return keys, A, R
+
+
+def trilaterate(A, R, iterations=ITERATIONS):
+    """
+    Weighted least-squares positions for arrays A (S,K,2) and R (S,K)
+    as returned by segments; returns P (S,2) and the RMS residual (S,)
+    in the units of R
+    """
+    mask = ~np.isnan(R)
+    n = mask.sum(axis=1)
+    A0, R0 = np.where(mask[..., None], A, 0.0), np.where(mask, R, 0.0)
+    W = np.where(mask, 1.0 / np.maximum(R0, 1.0) ** 2, 0.0)
+    # start: weighted centroid
+    P = (W[..., None] * A0).sum(axis=1) / W.sum(axis=1)[:, None]
+    # linear least squares in (px, py, |p|^2), where three anchors allow
+    M = np.concatenate([2 * A0, -np.ones(R0.shape + (1,))], axis=2)
+    b = (A0 ** 2).sum(axis=2) - R0 ** 2
+    MtW = M.transpose(0, 2, 1) * W[:, None, :]
+    N = MtW @ M
+    good = (n >= 3) & (np.abs(np.linalg.det(N)) > 1e-9 * np.abs(N).max(axis=(1, 2)) ** 3)
+    if good.any():
+        X = np.linalg.solve(N[good], (MtW[good] @ b[good][..., None]))[..., 0]
+        P[good] = X[:, :2]
+    # damped Gauss-Newton on the distances themselves
+    refine = n >= 2
+    for _ in range(iterations):
+        D = P[:, None, :] - A0
+        norm = np.maximum(np.sqrt((D ** 2).sum(axis=2)), 1e-6)
+        J = D / norm[..., None]
+        E = np.where(mask, norm - R0, 0.0)
+        JtW = J.transpose(0, 2, 1) * W[:, None, :]
+        H = JtW @ J + DAMPING * np.eye(2)
+        g = (JtW @ E[..., None])[..., 0]
+        step = np.linalg.solve(H, g[..., None])[..., 0]
+        P = np.where(refine[:, None], P - step, P)
+    D = np.sqrt(((P[:, None, :] - A0) ** 2).sum(axis=2))
+    E = np.where(mask, D - R0, 0.0)
+    residual = np.sqrt((E ** 2).sum(axis=1) / np.maximum(n, 1))
+    return P, residual
+
+
+def localizeshift(intervalfile, registry, coords=None, batch=1 << 16):
+    # trajectory table (TRACK) of every worn badge for one intervals file
+    coords = coords or layout.anchorcoords()
+    keys, A, R = segments(make_intervals.readintervals(intervalfile), coords)
+    track = np.empty(len(keys), dtype=TRACK)
+    for s in range(0, len(keys), batch):
+        P, residual = trilaterate(A[s : s + batch], R[s : s + batch])
+        track["x"][s : s + batch], track["y"][s : s + batch] = P[:, 0], P[:, 1]
+        track["residual"][s : s + batch] = residual * layout.INCHES_PER_PIXEL
+        track["anchors"][s : s + batch] = (~np.isnan(R[s : s + batch])).sum(axis=1)
+    track["badge"] = [registry.intern(badge) for badge, start, end in keys]
+    track["start"] = [start for badge, start, end in keys]
+    track["end"] = [end for badge, start, end in keys]
+    return track[np.lexsort((track["start"], track["badge"]))]
+
+
+def trackfile(n, arraydir=ARRAY_DIR):
+    return f"{arraydir}/track{n:02d}.npy"
+
+
+def loadtrack(n, registry, datadir=DATA_DIR, arraydir=ARRAY_DIR):
+    # trajectory table of shift n, from the saved array when it is up to date
+    intervalfile = f"{datadir}/contact_intervals/intervals{n:02d}.json.xz"
+    filename = trackfile(n, arraydir)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(intervalfile):
+        return np.load(filename)
+    track = localizeshift(intervalfile, registry)
+    os.makedirs(arraydir, exist_ok=True)
+    np.save(filename, track)
+    registry.save(f"{arraydir}/badgeids.json")  # in case of new badges
+    return track
+
+
+class Trajectory(object):
+    # position lookup over a trajectory table, sorted by badge then start
+
+    def __init__(self, track, registry):
+        self.track, self.registry = track, registry
+        self.first = np.searchsorted(track["badge"], np.arange(len(registry) + 1))
+
+    def at(self, badge, T):
+        # (x,y) of badge at datetime (or seconds) T, None if no anchor in contact
+        i = self.registry.ids.get(badge)
+        if i is None or i + 1 >= len(self.first):
+            return None
+        lo, hi = self.first[i], self.first[i + 1]
+        t = contactquery.toseconds(T)
+        k = lo + bisect_right(self.track["start"][lo:hi], t) - 1
+        if k < lo or t >= self.track["end"][k]:
+            return None
+        return float(self.track["x"][k]), float(self.track["y"][k])
+
+
+if __name__ == "__main__":
+    registry = badgeids.Registry.load()
+    for n in range(1, 15):
+        began = time.perf_counter()
+        track = loadtrack(n, registry)
+        seconds = int((track["end"] - track["start"]).sum())
+        several = track["residual"][track["anchors"] >= 2]
+        print(f"shift {n}: {len(track)} segments, {seconds} badge-seconds placed, "
+              f"median residual {np.median(several):.1f} in (two or more anchors), "
+              f"{time.perf_counter() - began:.1f}s")
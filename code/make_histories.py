@@ -1,7 +1,11 @@
 from datetime import datetime, timedelta
 from collections import OrderedDict
-import sys, os, lzma, json
+import sys, os, json
 import extractspread
+import make_intervals
+import instrument
+import jsonstream
+import codec
 DATA_DIR = 'data'
 SUPP_DIR = 'supp'
 """
@@ -127,14 +131,16 @@ class State(object):
         return new
 
 
-def genstate(T, moment, badge, oldstatemap):
+def genstate(T, moment, badge, oldstatemap, timeout=60, pendingcutoff=180):
     """
     This function is intended for iterative update of State.StateMap;
     for specified moment, and having a copy of the previous State.StateMap
     in oldstatemap, it updates State.StateMap[badge] with new information,
     if possible; otherwise the new State.StateMap will just be the same
     as oldstatemap. For this idea to be correct, genstate will need to
-    be invoked on all badges for the specified moment.
+    be invoked on all badges for the specified moment. timeout is the
+    seconds an in-room badge with no anchors keeps its room, and
+    pendingcutoff the seconds a pending room entry waits for validation
     """
     assert badge in oldstatemap
     assert badge in T[moment]
@@ -163,7 +169,7 @@ def genstate(T, moment, badge, oldstatemap):
         if len(candidates) == 0:
             # curious case -- no reason to quit room except for timeout
             elapsed = (moment - current.doortime).total_seconds()
-            if elapsed > 60:
+            if elapsed > timeout:
                 # print(badge,"timeout/left room",moment)
                 current.room = current.doortime = current.door = None
                 current.inroom = current.pending = False
@@ -191,11 +197,11 @@ def genstate(T, moment, badge, oldstatemap):
     elapsed = 0
     if current.doortime:
         elapsed = (moment - current.doortime).total_seconds()
-    if not current.inroom and current.pending and elapsed > 180:  # cutoff at 3 mins
+    if not current.inroom and current.pending and elapsed > pendingcutoff:  # cutoff at 3 mins
         current.room = current.doortime = current.door = None
         current.inroom = current.pending = False
         return
-    if not current.inroom and current.pending:  # elapsed <= 180
+    if not current.inroom and current.pending:  # elapsed <= pendingcutoff
         # NOTE: here is a case where being in a room (inroom attribute)
         # can be falsified: test visible anchors to see if any belongs outside room
         candidates = [e for e in T[moment][badge] if e.startswith("b")]
@@ -236,6 +242,8 @@ def history(records):
     Input:
         each item of records is contact interval of the form
          (badge,otherbadge,datetime,distance,duration)
+        or its undirected form (lo,hi,datetime,distance,duration,flags),
+        which stands for one or both of (lo,hi,...) and (hi,lo,...)
         see contactinterval.py to learn how this was computed
     Output:
         an ordered dictionary mapping local datetime -> badge status
@@ -254,7 +262,7 @@ def history(records):
     maxdate = max(t[2] for t in records)
     # establish H as dictionary from datetime to empty dictionary
     for second in range(
-        (maxdate - mindate).seconds + 600
+        int((maxdate - mindate).total_seconds()) + 600
     ):  # +600 to account for possible last interval
         H.setdefault(mindate + timedelta(seconds=second), dict())
 
@@ -268,18 +276,19 @@ def history(records):
 
     # traverse contact intervals and use them to fill history
     for r in records:
-        reltime = (r[2] - mindate).seconds  # relative time in history
+        reltime = int((r[2] - mindate).total_seconds())  # relative time in history
         duration = r[4]  # duration of badge-to-badge close proximity
-        for t in range(duration):  # step through each second of interval
-            histime = mindate + timedelta(seconds=t) + timedelta(seconds=reltime)  # identify second in history
-            if histime not in H: continue  # if went beyond end of history, ignore
-            if r[0].startswith('b'): continue  # ignore anchors in history
-            H[histime][r[0]][r[1]] = r[3]  # record distance value from record for that second in time
+        for badge, other in make_intervals.directions(r):
+            if badge.startswith('b'): continue  # ignore anchors in history
+            for t in range(duration):  # step through each second of interval
+                histime = mindate + timedelta(seconds=t) + timedelta(seconds=reltime)  # identify second in history
+                if histime not in H: continue  # if went beyond end of history, ignore
+                H[histime][badge][other] = r[3]  # record distance value from record for that second in time
 
     return H
 
 
-def inroomhist(T):
+def inroomhist(T, timeout=60, pendingcutoff=180):
     """
     Create and return a dictionary from datetimes to distinct
     copies of StateMap (attribute of State class): this dictionary
@@ -309,7 +318,7 @@ def inroomhist(T):
             previous = State.fullcopy(None)
         for badge in T[moment]:
             if badge.startswith("b"): continue  # for full symmetry, we could do more!
-            genstate(T, moment, badge, previous)
+            genstate(T, moment, badge, previous, timeout, pendingcutoff)
         previous = State.StateMap
         StateMapHistory[moment] = State.fullcopy(None)
 
@@ -343,31 +352,37 @@ def combineRoomHist(T, V):
     return R
 
 
-def makehistory(contactintervalfile, filename):
+def makehistory(contactintervalfile, filename, timeout=60, pendingcutoff=180):
     # given a file of JSON-encoded contact intervals
     # sorted order by datetime, make a history and
-    # write its JSON to the specified file
-    with lzma.open(contactintervalfile, "r") as F:
-        U = F.read().decode("utf-8")
-    T = json.loads(U)
-    K = [[item[0], item[1], eval(item[2]), item[3], item[4]] for item in T]
-    T = history(K)
-    V = inroomhist(T)
-    R = combineRoomHist(T, V)
-    # convert R to list of item with datetime objects as strings
-    S = dict(
-        (repr(k).replace("datetime.datetime", "datetime"), v) for k, v in R.items()
-    )
-    with lzma.open(filename, "wb") as F:
-        U = json.dumps(S, indent=4)
-        B = U.encode("utf-8")
-        F.write(B)
+    # write its JSON to the specified file (timeout and
+    # pendingcutoff are passed to genstate)
+    with instrument.span("decompress") as sp:
+        U = codec.readbytes(contactintervalfile).decode("utf-8")
+        sp.count("chars", len(U))
+    with instrument.span("parse") as sp:
+        T = json.loads(U)
+        K = [[item[0], item[1], eval(item[2])] + item[3:] for item in T]  # either form
+        sp.count("intervals", len(K))
+    with instrument.span("history") as sp:
+        T = history(K)
+        sp.count("seconds", len(T))
+    with instrument.span("statemachine"):
+        V = inroomhist(T, timeout, pendingcutoff)
+    with instrument.span("combine"):
+        R = combineRoomHist(T, V)
+    # stream R to the file, with datetime objects as strings
+    with instrument.span("serialize") as sp:
+        S = ((jsonstream.datetimestr(k), v) for k, v in R.items())
+        with codec.openfile(filename, "wb") as F:
+            sp.count("bytes", jsonstream.dumpmapping(S, F))
 
 if __name__ == "__main__":
     # Unit test
     # contactintervalfile = f"{DATA_DIR}/contact_intervals/intervals02.json.xz"
     # makehistory(contactintervalfile,"debug.json.xz")
 
+    instrument.configure(sys.argv)
     # iterate over shifts 1 .. 14 making separate files
     if not os.path.exists(f'{DATA_DIR}/histories'):
         os.makedirs(f'{DATA_DIR}/histories')
@@ -375,5 +390,6 @@ if __name__ == "__main__":
     for n in range(1, 15):
         contactintervalsfile = f"{DATA_DIR}/contact_intervals/intervals{n:02d}.json.xz"
         historyfile = f"{DATA_DIR}/histories/histories{n:02d}.json.xz"
-        makehistory(contactintervalsfile, historyfile)
+        with instrument.span("makehistory", shift=n):
+            makehistory(contactintervalsfile, historyfile)
         print("saved shift", n, "histories")
@@ -1,6 +1,9 @@
 from datetime import datetime, timedelta
-import sys, os, lzma, json, copy
+import sys, os, json
 from collections import OrderedDict
+import instrument
+import jsonstream
+import codec
 DATA_DIR = 'data'
 
 """
@@ -37,20 +40,20 @@ DATA_DIR = 'data'
 """
 
 
-def clean(Slot):
+def clean(Slot, mindistance=12, orphanduration=10):
     """
     Slot is a list of tuples, all with the same datetime; some
     things in Slot should be removed -- such as tuples representing
     a start-of-contact where an end-of-contact is present in Slot.
     After removing all of these, still some start-of-contact might
     remain, but these are forced to have 10 second duration instead
-    because Instant-Trace considered them to be fleeting contacts,
-    but we know this is valuable information
+    (orphanduration) because Instant-Trace considered them to be
+    fleeting contacts, but we know this is valuable information
     """
     newSlot = list()
     for item in Slot:
         badge, otherbadge, T, distance, duration = item
-        if distance < 12:  # less than 12 inches is likely a
+        if distance < mindistance:  # less than 12 inches is likely a
             # deployment error (handing out or collecting badges)
             continue
         similars = [e for e in Slot if e[0] == badge and e[1] == otherbadge]
@@ -64,7 +67,7 @@ def clean(Slot):
     for item in newSlot:
         badge, otherbadge, T, distance, duration = item
         if duration == 0:
-            item[4] = 10  # force 10 second contact interval
+            item[4] = orphanduration  # force 10 second contact interval
     # theoretically, there might be duplicates?
     dedup = list()
     for item in newSlot:
@@ -113,11 +116,13 @@ def intervalMerge(intvl, Slot):
     intvl is a contact interval (has duration), Slot
     is some list of intervals which start after intvl.
     This function looks for an overlapping interval
-    within Slot and attempts to merge with that
+    within Slot and attempts to merge with that; it returns
+    a list of copies of the intervals removed from Slot
     """
     badge, otherbadge, T, distance, duration = intvl
     EndT = T + timedelta(seconds=duration)  # to detect overlap
     SlotRevised = False  # flag will become True if change needed
+    absorbed = list()
     for prospect in Slot:
         if intvl is prospect:
             continue  # leave self alone!
@@ -129,12 +134,184 @@ def intervalMerge(intvl, Slot):
         if otherEndT > EndT:  # we can absorb the excess
             excess = int((otherEndT - T).total_seconds())
             intvl[4] = excess
+            absorbed.append(list(prospect))
             prospect[0], SlotRevised = 0, True  # invalidate other interval
     if SlotRevised:  # only needed rarely
         Slot[:] = [e for e in Slot if e[0] != 0]
+    return absorbed
 
 
-def makecontactintervals(Raw, Shift=None, filename=None):
+"""
+    Undirected form: after enforceSymmetry most intervals are stored
+    twice, as (a,b) and (b,a). The undirected form keeps one record
+        [lo, hi, datetime, distance, duration, flags]
+    with lo < hi (so an anchor, "b...", is always lo) where flags has
+    FORWARD for the directed record (lo,hi,...) and REVERSE for (hi,lo,...);
+    a pair whose two directions differ (after merging, or because
+    enforceSymmetry kept different durations) simply gets two records.
+    Records are in datetime order, and within a datetime sorted, so
+    directed() gives back exactly the records of the directed file.
+"""
+FORWARD, REVERSE, ANCHOR = 1, 2, 4
+
+
+def slots(records):
+    # group consecutive records with equal datetime
+    Slot = list()
+    for item in records:
+        if Slot and item[2] != Slot[0][2]:
+            yield Slot
+            Slot = list()
+        Slot.append(item)
+    if Slot:
+        yield Slot
+
+
+def undirected(records):
+    # generate the undirected form of directed records (in datetime order)
+    for Slot in slots(records):
+        folded = dict()  # (lo,hi,distance,duration) -> list of flags
+        for badge, otherbadge, T, distance, duration in Slot:
+            lo, hi = min(badge, otherbadge), max(badge, otherbadge)
+            flags = folded.setdefault((lo, hi, distance, duration), list())
+            direction = FORWARD if badge == lo else REVERSE
+            # pair this record with an unpaired one for the other direction
+            for i, f in enumerate(flags):
+                if f == (FORWARD | REVERSE) ^ direction:
+                    flags[i] |= direction
+                    break
+            else:
+                flags.append(direction)
+        for (lo, hi, distance, duration), flags in sorted(folded.items()):
+            anchor = ANCHOR if lo.startswith("b") else 0
+            for f in sorted(flags):
+                yield [lo, hi, T, distance, duration, f | anchor]
+
+
+def directions(item):
+    # (badge,otherbadge) of each directed record an item stands for
+    if len(item) == 5:
+        return [(item[0], item[1])]
+    pairs = list()
+    if item[5] & FORWARD:
+        pairs.append((item[0], item[1]))
+    if item[5] & REVERSE:
+        pairs.append((item[1], item[0]))
+    return pairs
+
+
+def directed(records):
+    # generate directed records from records in either form
+    for Slot in slots(records):
+        if len(Slot[0]) == 5:
+            yield from Slot
+            continue
+        expanded = list()
+        for item in Slot:
+            for badge, otherbadge in directions(item):
+                expanded.append([badge, otherbadge] + item[2:5])
+        yield from sorted(expanded)
+
+
+def writeintervals(records, filename, undirected_form=False):
+    """
+    Write directed contact intervals (datetime objects, in datetime
+    order) to filename, in the undirected form if undirected_form;
+    returns the number of bytes before compression
+    """
+    if undirected_form:
+        records = undirected(records)
+    R = (jsonstream.intervalstr(item) for item in records)
+    with codec.openfile(filename, "wb") as F:
+        return jsonstream.dumprecords(R, F)
+
+
+def readintervals(filename, directed_form=True):
+    """
+    Return list of the contact intervals in filename (either form),
+    with datetime strings converted; directed unless directed_form is
+    False, in which case records are left in the form of the file
+    """
+    records = json.loads(codec.readbytes(filename))
+    for item in records:
+        item[2] = eval(item[2])
+    return list(directed(records)) if directed_form else records
+
+
+class IntervalStream(object):
+    """
+    Incremental form of steps 3 through 8 of makecontactintervals, for
+    records that arrive over time (livestream.py) or in pieces: add()
+    takes raw records (datetime already converted) in roughly datetime
+    order, and advance(watermark) returns the contact intervals of every
+    slot that can no longer change, as a list of (T, intervals) in
+    datetime order. A slot T is final once no record at or before
+    T + lookahead can still arrive, because merging looks ahead that far;
+    the caller promises that by the watermark (the datetime before which
+    all records have been added). Records for a slot already returned
+    are too late to use: they are counted in self.late and dropped.
+    The output equals that of makecontactintervals for the same records.
+    """
+
+    def __init__(self, lookahead=15, mindistance=12, orphanduration=10):
+        self.lookahead = timedelta(seconds=lookahead)
+        self.mindistance, self.orphanduration = mindistance, orphanduration
+        self.G = dict()  # T -> raw records of slots not yet final
+        self.done = None  # datetime of the latest slot returned
+        self.late = 0
+
+    def add(self, item):
+        if item[0].startswith("b") and item[1].startswith("b"):
+            return  # Step 3: anchor-anchor records
+        T = item[2]
+        if self.done is not None and T <= self.done:
+            self.late += 1
+            return
+        if T not in self.G:
+            self.G[T] = list()
+        self.G[T].append(item)
+
+    def advance(self, watermark=None):
+        # finalize slots T with T + lookahead < watermark (all if None)
+        final = list()
+        ready = sorted(T for T in self.G if watermark is None or T + self.lookahead < watermark)
+        for T in ready:
+            clean(self.G[T], self.mindistance, self.orphanduration)
+            enforceSymmetry(self.G[T])
+            for delta in range(self.lookahead.seconds + 1):
+                I = T + timedelta(seconds=delta)
+                for item in self.G[T]:
+                    if I in self.G:
+                        intervalMerge(item, self.G[I])
+            final.append((T, self.G.pop(T)))
+            self.done = T
+        return final
+
+
+# start of each shift; shift n is ShiftTable[n] <= T < ShiftTable[n+1]
+ShiftTable = {
+    0: datetime(2023, 4, 17, 12, 0),
+    1: datetime(2023, 4, 17, 19, 0),
+    2: datetime(2023, 4, 18, 7, 0),
+    3: datetime(2023, 4, 18, 19, 0),
+    4: datetime(2023, 4, 19, 7, 0),
+    5: datetime(2023, 4, 19, 19, 0),
+    6: datetime(2023, 4, 20, 7, 0),
+    7: datetime(2023, 4, 20, 19, 0),
+    8: datetime(2023, 4, 21, 7, 0),
+    9: datetime(2023, 4, 21, 19, 0),
+    10: datetime(2023, 4, 22, 7, 0),
+    11: datetime(2023, 4, 22, 19, 0),
+    12: datetime(2023, 4, 23, 7, 0),
+    13: datetime(2023, 4, 23, 19, 0),
+    14: datetime(2023, 4, 24, 7, 0),
+    15: datetime(2023, 4, 24, 19, 0),
+}
+
+
+def makecontactintervals(Raw, Shift=None, filename=None, start=None, limit=None,
+                         undirected_form=False, mindistance=12, orphanduration=10,
+                         mergewindow=15):
     """
     Input:
         Raw is the full list of tuples from fulldata.xz, modified
@@ -143,6 +320,12 @@ def makecontactintervals(Raw, Shift=None, filename=None):
         number; odd shift numbers are evenings; the first shift
         is April 18th.
         filename is where to store the output json
+        start and limit are used instead of Shift for data that
+        does not come from the 2023 study (e.g. synthetic.py); they
+        bound the datetimes included, as start <= T < limit
+        undirected_form writes the undirected form (see undirected)
+        mindistance, orphanduration and mergewindow are the thresholds
+        of clean and of Step 8 (for parameter sweeps, see sweep.py)
     Output:
         an ordered dictionary mapping datetime to a contact interval;
         all contact intervals from the specified shift are included
@@ -157,68 +340,52 @@ def makecontactintervals(Raw, Shift=None, filename=None):
                                      Shift 15 is not valid because we were removing
                                          anchors during that time.
     """
-    ShiftTable = {
-        0: datetime(2023, 4, 17, 12, 0),
-        1: datetime(2023, 4, 17, 19, 0),
-        2: datetime(2023, 4, 18, 7, 0),
-        3: datetime(2023, 4, 18, 19, 0),
-        4: datetime(2023, 4, 19, 7, 0),
-        5: datetime(2023, 4, 19, 19, 0),
-        6: datetime(2023, 4, 20, 7, 0),
-        7: datetime(2023, 4, 20, 19, 0),
-        8: datetime(2023, 4, 21, 7, 0),
-        9: datetime(2023, 4, 21, 19, 0),
-        10: datetime(2023, 4, 22, 7, 0),
-        11: datetime(2023, 4, 22, 19, 0),
-        12: datetime(2023, 4, 23, 7, 0),
-        13: datetime(2023, 4, 23, 19, 0),
-        14: datetime(2023, 4, 24, 7, 0),
-        15: datetime(2023, 4, 24, 19, 0),
-    }
-    start = ShiftTable[Shift]  # min datetime in shift
-    limit = ShiftTable[Shift + 1]  # limit beyond shift datetime
+    if Shift is not None:
+        start = ShiftTable[Shift]  # min datetime in shift
+        limit = ShiftTable[Shift + 1]  # limit beyond shift datetime
+    elif start is None or limit is None:
+        raise ValueError("give Shift, or start and limit")
     # Step 2: filter to just the desired shift
-    ShiftData = [e for e in Raw if start <= e[2] < limit]
-    # Step 3: eliminate anchor-anchor records
-    ShiftData = [
-        e for e in ShiftData if (not e[0].startswith("b")) or (not e[1].startswith("b"))
-    ]
+    with instrument.span("filter", shift=Shift) as sp:
+        ShiftData = [e for e in Raw if start <= e[2] < limit]
+        # Step 3: eliminate anchor-anchor records
+        ShiftData = [
+            e for e in ShiftData if (not e[0].startswith("b")) or (not e[1].startswith("b"))
+        ]
+        sp.count("records", len(ShiftData))
     # Steps 4 and 5: sort, put in OrderedDictionary; duplicates will be removed later, I hope
-    ShiftData = sorted(ShiftData, key=lambda e: e[2])
-    G = OrderedDict()
-    for item in ShiftData:
-        badge, otherbadge, T, distance, duration = (
-            item[0],
-            item[1],
-            item[2],
-            item[3],
-            item[4],
-        )
-        if T not in G:
-            G[T] = list()  # prep empty list as needed
-        G[T].append(item)  # could introduce duplication, de-dupe later
+    with instrument.span("group", shift=Shift) as sp:
+        ShiftData = sorted(ShiftData, key=lambda e: e[2])
+        G = OrderedDict()
+        for item in ShiftData:
+            badge, otherbadge, T, distance, duration = (
+                item[0],
+                item[1],
+                item[2],
+                item[3],
+                item[4],
+            )
+            if T not in G:
+                G[T] = list()  # prep empty list as needed
+            G[T].append(item)  # could introduce duplication, de-dupe later
+        sp.count("slots", len(G))
     # Step 6 is kind of a mess: clean up the list for G[T]
-    for T in sorted(G.keys()):
-        clean(G[T])  # careful not to use assignment on dictionary!
-        enforceSymmetry(G[T])
-        # Step 8 is to merge overlapping intervals, which is done by
-        # looking at current/future intervals only, and for at most 15 seconds
-        for delta in range(16):  # 0 .. 15 seconds
-            I = T + timedelta(seconds=delta)
-            for item in G[T]:
-                if I in G.keys():
-                    intervalMerge(item, G[I])
-    # Step 9 converts G to JSON and writes to file
-    R = list()
-    for T in sorted(G.keys()):
-        for item in G[T]:
-            stritem = copy.deepcopy(item)
-            stritem[2] = repr(stritem[2]).replace("datetime.datetime", "datetime")
-            R.append(stritem)
-    with lzma.open(filename, "wb") as F:
-        S = json.dumps(R, indent=4)
-        B = S.encode("utf-8")
-        F.write(B)
+    with instrument.span("clean-symmetry-merge", shift=Shift) as sp:
+        for T in sorted(G.keys()):
+            clean(G[T], mindistance, orphanduration)  # careful not to use assignment on dictionary!
+            enforceSymmetry(G[T])
+            # Step 8 is to merge overlapping intervals, which is done by
+            # looking at current/future intervals only, and for at most 15 seconds
+            for delta in range(mergewindow + 1):  # 0 .. 15 seconds
+                I = T + timedelta(seconds=delta)
+                for item in G[T]:
+                    if I in G.keys():
+                        intervalMerge(item, G[I])
+        sp.count("intervals", sum(len(G[T]) for T in G))
+    # Step 9 converts G to JSON, streaming it to the file
+    with instrument.span("serialize", shift=Shift) as sp:
+        R = (item for T in sorted(G.keys()) for item in G[T])
+        sp.count("bytes", writeintervals(R, filename, undirected_form))
 
 
 if __name__ == "__main__":
@@ -232,14 +399,26 @@ if __name__ == "__main__":
     #             Raw[i][2] = eval(Raw[i][2])
     # makecontactintervals(Raw, Shift=2, filename="debug.json.xz")
 
+    instrument.configure(sys.argv)
+    undirected_form = "--undirected" in sys.argv  # write the undirected form
+    if "--memory" in sys.argv:  # out of core: at most this many MB of records at once
+        import externalsort
+
+        memory = int(float(sys.argv[sys.argv.index("--memory") + 1]) * 2**20)
+        externalsort.makeshifts(f"{DATA_DIR}/fulldata.xz", memory=memory,
+                                undirected_form=undirected_form)
+        sys.exit(0)
     # open full data file, decompress and convert datetimes
-    with lzma.open(f"{DATA_DIR}/fulldata.xz", "r") as F:
-        S = F.read().decode("utf-8")
+    with instrument.span("decompress") as sp:
+        S = codec.readbytes(f"{DATA_DIR}/fulldata.xz").decode("utf-8")
+        sp.count("chars", len(S))
+    with instrument.span("parse") as sp:
         U = S.split("\n")
         Raw = json.loads(S)
         for i in range(len(Raw)):
             if Raw[i][2].startswith("datetime"):
                 Raw[i][2] = eval(Raw[i][2])
+        sp.count("records", len(Raw))
 
     # iterate over shifts 1 .. 14 making separate files
     if not os.path.exists(f'{DATA_DIR}/contact_intervals'):
@@ -247,5 +426,7 @@ if __name__ == "__main__":
 
     for n in range(1, 15):
         shiftfilename = f"{DATA_DIR}/contact_intervals/intervals{n:02d}.json.xz"
-        makecontactintervals(Raw, Shift=n, filename=shiftfilename)
+        with instrument.span("makecontactintervals", shift=n):
+            makecontactintervals(Raw, Shift=n, filename=shiftfilename,
+                                 undirected_form=undirected_form)
         print("saved shift", n, "contact intervals")
@@ -0,0 +1,128 @@
+"""
+One command line for the study's processing and figures:
+
+    python code/micu.py intervals [2 3 ...]    contact intervals (needs data/fulldata.xz)
+    python code/micu.py histories [shifts]     1-second histories
+    python code/micu.py validation [shifts]    figures/dayniteTen.png (validation.py)
+    python code/micu.py hypergraph [shifts]    spatial hypergraphs (repro3.py)
+    python code/micu.py analysis [shifts]      HCP and anchor risk tables (analysis.py)
+    python code/micu.py report                 final_hyperhai_risk_report.csv
+    python code/micu.py trend                  top_10_hcp_risk_trend.png
+    python code/micu.py heatmap                risk_heatmap.png (usage.py)
+    python code/micu.py centrality [shifts]    hypergraph centrality tables (centrality.py)
+    python code/micu.py status [stage] [shifts]   stale stages, builds nothing
+
+All but validation and centrality are stages of pipeline.py, built
+with their stale inputs and taken from the artifact cache otherwise
+(--force reruns the named stage). Paths resolve from one root, the directory holding data/,
+supp/ and figures/: --root DIR, else MICU_ROOT, else the top directory
+of the repository, so the command can be given from anywhere; the
+tables and figures of reproducibility/ are published under the root
+too. Libraries (numpy, pandas, matplotlib, cv2 ...) are imported by
+the subcommands that use them, when they run, so --help and status
+start in a fraction of a second. The options of instrument.py
+(--trace, --profile, --tracemalloc) work as for every script.
+"""
+
+import sys, os, argparse
+import instrument
+
+TOP_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+ROOT = os.environ.get("MICU_ROOT", TOP_DIR)
+
+# subcommand -> (pipeline stage, help)
+STAGES = {
+    "intervals": ("intervals", "contact intervals from data/fulldata.xz"),
+    "histories": ("histories", "1-second histories of the contact intervals"),
+    "hypergraph": ("hypergraph", "spatial hypergraph of each shift (repro3.py)"),
+    "analysis": ("risk", "HCP and anchor risk tables of each shift (analysis.py)"),
+    "report": ("report", "final risk report over shifts (report.py)"),
+    "trend": ("trend", "trend plot of the top 10 HCPs (trend.py)"),
+    "heatmap": ("heatmap", "risk heatmap on the ICU layout (usage.py)"),
+}
+
+
+def buildstage(args):
+    import pipeline
+
+    G = pipeline.graph(args.shifts or pipeline.SHIFTS)
+    stage = STAGES[args.command][0]
+    built = list()
+    for target in pipeline.targets(G, [stage]):
+        pipeline.build(target, {stage} if args.force else set(), built)
+        for place in target.outputs.values() or [target.entry()]:
+            print(target, "->", os.path.relpath(place))
+    print("rebuilt", len(built), "stage(s)")
+
+
+def status(args):
+    import pipeline
+
+    if args.stage and args.stage.isdigit():  # status 2 3: shifts, no stage
+        args.shifts, args.stage = [int(args.stage)] + args.shifts, None
+    G = pipeline.graph(args.shifts or pipeline.SHIFTS)
+    names = [STAGES.get(args.stage, (args.stage,))[0]] if args.stage else []
+    seen, found = set(), 0
+    for target in pipeline.targets(G, names):
+        for s in pipeline.stale(target, seen):
+            print("stale", s, s.fingerprint()[:12])
+            found += 1
+    print(found or "no", "stale stage(s)")
+
+
+def validation(args):
+    import validation
+
+    validation.validate(args.shifts or range(1, 15))
+
+
+def centrality(args):
+    import centrality
+
+    for n in args.shifts or range(1, 15):
+        T = centrality.table(n, args.stage, args.s, args.samples, args.processes)
+        filename = centrality.tablefile(n, args.stage)
+        centrality.save(T, filename)
+        print("saved", filename)
+
+
+def parser():
+    P = argparse.ArgumentParser(prog="micu.py", description=__doc__.split("\n\n")[0].strip())
+    P.add_argument("--root", default=ROOT, help=f"directory of data/, supp/, figures/ (default {ROOT})")
+    sub = P.add_subparsers(dest="command", required=True, metavar="command")
+    for name, (stage, text) in STAGES.items():
+        S = sub.add_parser(name, help=text, description=text)
+        S.add_argument("shifts", nargs="*", type=int, help="shift numbers (default all)")
+        S.add_argument("--force", action="store_true", help=f"rerun {stage} even if cached")
+        S.set_defaults(run=buildstage)
+    S = sub.add_parser("validation", help="plot of badges with contacts by ten minutes (validation.py)")
+    S.add_argument("shifts", nargs="*", type=int, help="shift numbers (default all)")
+    S.set_defaults(run=validation)
+    S = sub.add_parser("centrality", help="hypergraph centrality of badges (centrality.py)")
+    S.add_argument("shifts", nargs="*", type=int, help="shift numbers (default all)")
+    S.add_argument("--stage", action="store_true", help="hyperedges of the hypergraph stage, not the whole shift")
+    S.add_argument("--s", type=int, default=2, help="members shared by adjacent hyperedges (default 2)")
+    S.add_argument("--samples", type=int, default=256, help="betweenness sources (default 256)")
+    S.add_argument("--processes", type=int, help="worker processes (default all CPUs)")
+    S.set_defaults(run=centrality)
+    S = sub.add_parser("status", help="list stale stages, build nothing")
+    S.add_argument("stage", nargs="?", help="a command or stage name (default the final outputs)")
+    S.add_argument("shifts", nargs="*", type=int, help="shift numbers (default all)")
+    S.set_defaults(run=status)
+    return P
+
+
+def main(argv=None):
+    argv = list(sys.argv if argv is None else argv)
+    instrument.configure(argv)
+    args = parser().parse_args(argv[1:])
+    root = os.path.abspath(args.root)
+    os.chdir(root)  # every script names data/, supp/ and figures/ relative to it
+    import pipeline
+
+    pipeline.PUBLISH_DIR = os.path.join(root, "reproducibility")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Parallel processing of one long time range (a dense shift, or a deployment
+of several days) by cutting it into windows, each run by a separate
+process, then stitching the windows so the result equals a serial run.
+
+Contact intervals (partitionintervals): a slot T is merged with the raw
+slots up to T + 15 seconds, and merging removes intervals from those
+later slots. So each window also gets the raw slots of the first 15
+seconds after it, and logs which records it removes there. A window is
+first run as if nothing had been removed from its own first 15 seconds;
+when stitching, if the previous window did remove something, the window
+is rerun serially from its start only until the removals still pending
+match those of the first run, after which the first run's output stands.
+
+Histories (partitionhistory): the per-second contact map of a window only
+needs the contact intervals overlapping it, but the room state machine
+(genstate, with its 60 second in-room timeout and 180 second pending
+cutoff) carries each badge's state across the window boundary. A window
+is first run with every badge idle (no room), as inroomhist starts a
+shift; when stitching, a badge that entered the window in some room is
+rerun from the window start with its true state, until the first moment
+both runs have it idle, after which the first run's states stand.
+
+Reruns are short because merges only reach 15 seconds and badges leave
+rooms within minutes, so the speedup grows with the number of windows.
+
+    python code/partition.py intervals 8     (all shifts, 8 windows each)
+    python code/partition.py histories 8
+"""
+
+import sys, os, json, copy
+from datetime import datetime, timedelta
+from collections import OrderedDict, Counter
+from multiprocessing import Pool
+import make_intervals
+import make_histories
+from make_histories import State
+from make_intervals import clean, enforceSymmetry, intervalMerge
+import jsonstream
+import codec
+import instrument
+
+DATA_DIR = 'data'
+LOOKAHEAD = 15  # seconds, the merge window of makecontactintervals
+
+
+def windows(start, limit, n, minimum=2 * LOOKAHEAD):
+    # cut [start,limit) into n windows of whole seconds, no shorter than minimum
+    seconds = int((limit - start).total_seconds())
+    n = max(1, min(n, seconds // minimum))
+    cuts = [start + timedelta(seconds=seconds * k // n) for k in range(n)] + [limit]
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def groupslots(Raw, start, limit):
+    # steps 2 through 5 of makecontactintervals: dict T -> raw slot
+    G = dict()
+    ShiftData = [e for e in Raw if start <= e[2] < limit]
+    ShiftData = [e for e in ShiftData if not (e[0].startswith("b") and e[1].startswith("b"))]
+    for item in sorted(ShiftData, key=lambda e: e[2]):
+        G.setdefault(item[2], list()).append(item)
+    return G
+
+
+def runslots(G, times, incoming=(), reference=None):
+    """
+    Steps 6 and 7 for slots at datetimes times (sorted), G holding them
+    and the raw slots up to LOOKAHEAD seconds beyond; G is modified.
+    incoming lists (I,record) removals made by the previous window,
+    applied first. Returns (final,log,stop): final is [(T,intervals)],
+    log is [(T,I,record)] for every record removed from slot I while
+    finalizing slot T. With a reference log (of a run of the same
+    window without incoming), the run stops at the first slot after
+    which the pending removals agree with the reference; stop is that
+    slot's position in times, or None if the run went to the end.
+    """
+    for I, record in incoming:
+        if I in G:
+            G[I].remove(list(record))  # one copy, should there be duplicates
+    pending = Counter(incoming)
+    final, log = list(), list()
+    for position, T in enumerate(times):
+        clean(G[T])
+        enforceSymmetry(G[T])
+        for delta in range(LOOKAHEAD + 1):
+            I = T + timedelta(seconds=delta)
+            for item in G[T]:
+                if I in G:
+                    for record in intervalMerge(item, G[I]):
+                        log.append((T, I, tuple(record)))
+                        pending[I, tuple(record)] += 1
+        final.append((T, G[T]))
+        if reference is not None:
+            pending = Counter({(I, r): k for (I, r), k in pending.items() if I > T})
+            expected = Counter((I, r) for t, I, r in reference if t <= T < I)
+            if pending == expected:
+                return final, log, position
+    return final, log, None
+
+
+def intervalwindow(task):
+    # worker: first run of one window, without incoming removals
+    G, times = task
+    final, log, stop = runslots(G, times)
+    return final, log
+
+
+def partitionintervals(Raw, start, limit, filename, nwindows=4, processes=None,
+                       undirected_form=False):
+    """
+    Same output as makecontactintervals(Raw, filename=filename,
+    start=start, limit=limit, undirected_form=undirected_form),
+    computed in nwindows windows
+    """
+    with instrument.span("group") as sp:
+        G = groupslots(Raw, start, limit)
+        sp.count("slots", len(G))
+    W = windows(start, limit, nwindows)
+    tasks = list()
+    for ws, we in W:
+        times = sorted(T for T in G if ws <= T < we)
+        reach = we + timedelta(seconds=LOOKAHEAD)
+        tasks.append(({T: G[T] for T in G if ws <= T <= reach}, times))
+    with instrument.span("windows", windows=len(W)):
+        if processes == 1:
+            results = [intervalwindow(copy.deepcopy(task)) for task in tasks]
+        else:
+            with Pool(processes) as pool:
+                results = pool.map(intervalwindow, tasks)
+    with instrument.span("stitch") as sp:
+        output, incoming = list(), list()
+        for (ws, we), task, (final, log) in zip(W, tasks, results):
+            if incoming:
+                G, times = copy.deepcopy(task)
+                refinal, relog, stop = runslots(G, times, incoming, reference=log)
+                sp.count("rerun_slots", len(refinal))
+                if stop is None:
+                    final, log = refinal, relog
+                else:
+                    T = times[stop]
+                    final = refinal + final[stop + 1 :]
+                    log = relog + [e for e in log if e[0] > T]
+            output.extend(final)
+            incoming = [(I, r) for T, I, r in log if I >= we]
+    with instrument.span("serialize"):
+        R = (item for T, slot in output for item in slot)
+        make_intervals.writeintervals(R, filename, undirected_form)
+
+
+"""
+    Histories
+"""
+
+
+def historywindow(task):
+    """
+    worker: history, inroomhist and combineRoomHist for the seconds
+    [ws,we) of a shift, every badge starting idle; records are the
+    intervals overlapping the window, in file order. Returns the
+    combined map for the window and the State of each badge at its end
+    """
+    records, ws, we, badgeset = task
+    H = OrderedDict()
+    for second in range(int((we - ws).total_seconds())):
+        H[ws + timedelta(seconds=second)] = {b: dict() for b in badgeset if not b.startswith("b")}
+    for r in records:
+        first = max(r[2], ws)
+        last = min(r[2] + timedelta(seconds=r[4]), we)
+        for badge, other in make_intervals.directions(r):
+            if badge.startswith("b"):
+                continue  # ignore anchors in history
+            for t in range(int((last - first).total_seconds())):
+                H[first + timedelta(seconds=t)][badge][other] = r[3]
+    V = make_histories.inroomhist(H)
+    R = make_histories.combineRoomHist(H, V)
+    return R, V[next(reversed(V))] if V else dict()
+
+
+def contactsof(records, badge, first, last):
+    # the history() contact map of one badge, seconds [first,last)
+    T = OrderedDict((first + timedelta(seconds=s), {badge: dict()})
+                    for s in range(int((last - first).total_seconds())))
+    for r in records:
+        t0, t1 = max(r[2], first), min(r[2] + timedelta(seconds=r[4]), last)
+        for other in [b for a, b in make_intervals.directions(r) if a == badge]:
+            for t in range(int((t1 - t0).total_seconds())):
+                T[t0 + timedelta(seconds=t)][badge][other] = r[3]
+    return T
+
+
+def rerunbadge(state, records, R, ws, we):
+    """
+    Run genstate for one badge from its true State at ws, updating R,
+    until the first moment it is idle in both this run and R; returns
+    the badge's true State at we if the runs never agree, else None
+    """
+    badge = state.badge
+    T = contactsof(records, badge, ws, we)
+    State.InitState(None, {badge: state.copy()})
+    for moment in T:
+        make_histories.genstate(T, moment, badge, State.StateMap)
+        current = State.StateMap[badge]
+        entry = R[moment][badge]
+        if not current.room and entry["state"] is None:
+            return None  # converged
+        entry["state"] = {"room": current.room} if current.room else None
+        if current.inroom:
+            entry["state"]["inroom"] = current.inroom
+        if current.pending:
+            entry["state"]["pending"] = current.pending
+    return State.StateMap[badge].copy()
+
+
+def partitionhistory(contactintervalfile, filename, nwindows=4, processes=None):
+    # same output as make_histories.makehistory, computed in nwindows windows
+    with instrument.span("parse"):
+        U = json.loads(codec.readbytes(contactintervalfile))
+        K = [[item[0], item[1], eval(item[2])] + item[3:] for item in U]  # either form
+    mindate = min(t[2] for t in K)
+    maxdate = max(t[2] for t in K)
+    limit = mindate + timedelta(seconds=int((maxdate - mindate).total_seconds()) + 600)
+    badgeset = set(t[0] for t in K) | set(t[1] for t in K)
+    W = windows(mindate, limit, nwindows, minimum=600)
+    tasks = list()
+    for ws, we in W:
+        records = [r for r in K if r[2] < we and r[2] + timedelta(seconds=r[4]) > ws]
+        tasks.append((records, ws, we, badgeset))
+    with instrument.span("windows", windows=len(W)):
+        if processes == 1:
+            results = [historywindow(task) for task in tasks]
+        else:
+            with Pool(processes) as pool:
+                results = pool.map(historywindow, tasks)
+    with instrument.span("stitch") as sp:
+        carry = dict()  # badge -> true State at the end of the previous window
+        for (ws, we), task, (R, endstates) in zip(W, tasks, results):
+            truestates = dict(endstates)
+            for badge, state in carry.items():
+                if not state.room:
+                    continue  # idle, as the window assumed
+                sp.count("reruns")
+                mine = [r for r in task[0] if badge in r[:2]]
+                final = rerunbadge(state, mine, R, ws, we)
+                if final is not None:
+                    truestates[badge] = final
+            carry = truestates
+    with instrument.span("serialize"):
+        S = ((jsonstream.datetimestr(k), v) for R, _ in results for k, v in R.items())
+        with codec.openfile(filename, "wb") as F:
+            jsonstream.dumpmapping(S, F)
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    kind = sys.argv[1] if len(sys.argv) > 1 else "intervals"
+    nwindows = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    if kind == "intervals":
+        Raw = json.loads(codec.readbytes(f"{DATA_DIR}/fulldata.xz"))
+        for item in Raw:
+            if item[2].startswith("datetime"):
+                item[2] = eval(item[2])
+        for n in range(1, 15):
+            start = make_intervals.ShiftTable[n]
+            limit = make_intervals.ShiftTable[n + 1]
+            filename = f"{DATA_DIR}/contact_intervals/intervals{n:02d}.json.xz"
+            with instrument.span("partitionintervals", shift=n):
+                partitionintervals(Raw, start, limit, filename, nwindows)
+            print("saved shift", n, "contact intervals")
+    else:
+        for n in range(1, 15):
+            source = f"{DATA_DIR}/contact_intervals/intervals{n:02d}.json.xz"
+            filename = f"{DATA_DIR}/histories/histories{n:02d}.json.xz"
+            with instrument.span("partitionhistory", shift=n):
+                partitionhistory(source, filename, nwindows)
+            print("saved shift", n, "histories")
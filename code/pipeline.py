@@ -0,0 +1,471 @@
+"""
+Dependency-aware rebuild of the study outputs, with a content-addressed
+artifact cache. The stages, and what each one depends on, are
+
+    raw         data/fulldata.xz
+    intervals   raw, make_intervals.py                      (per shift)
+    histories   intervals, make_histories.py, extractspread.py,
+                  badgelocations.xlsx                       (per shift)
+    hypergraph  histories, repro3.py, placement005.yaml     (per shift)
+    groups      intervals, groups.py, layout.py,
+                  placement005.yaml                         (per shift, on request)
+    risk        hypergraph, analysis.py                     (per shift)
+    report      risk of every shift, report.py
+    hotspots    report, hypergraph of the last shift, correlation.py
+    trend       report, risk of every shift, trend.py
+    stability   hypergraph of every shift, stability.py     (on request)
+    heatmap     risk of shift 2, usage.py, heatmap.py, layout.py,
+                  placement005.yaml, iculayout.png
+
+Every stage gets a fingerprint: a SHA-256 over its name, parameters,
+the fingerprints of its inputs and the contents of the source files
+listed above. Outputs are stored in data/cache/<stage>/<fingerprint>/
+and then copied to the usual locations (data/contact_intervals,
+data/histories, reproducibility/data and figures), so scripts and
+notebooks find them where they always have.
+A stage is run only if no cached artifact has its fingerprint; thus
+editing report.py reruns just report, hotspots and trend, and editing
+a threshold in genstate reruns histories and everything downstream.
+The thresholds listed in PARAMS can also be set for a build without
+editing code, as graph(params=...); sweep.py builds a grid of them.
+
+Usage, from the top directory of the repository:
+
+    python code/pipeline.py                 (build everything)
+    python code/pipeline.py report 2 3      (build report, from shifts 2 and 3)
+    python code/pipeline.py --status        (show stale stages, build nothing)
+    python code/pipeline.py --adopt         (seed the cache with existing outputs)
+
+The distributed repository has contact intervals and histories but not
+fulldata.xz; --adopt records the published files as the artifacts of
+the current fingerprints, so they are reused instead of rebuilt.
+"""
+
+import sys, os, json, hashlib, shutil, tempfile, glob
+from datetime import datetime
+import instrument
+
+DATA_DIR = 'data'
+SUPP_DIR = 'supp'
+FIG_DIR = 'figures'
+CACHE_DIR = f'{DATA_DIR}/cache'
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPRO_DIR = os.path.join(CODE_DIR, os.pardir, 'reproducibility')
+PUBLISH_DIR = REPRO_DIR  # reproducibility/data and figures are published here
+SHIFTS = list(range(1, 15))
+
+# stage -> source files whose contents are part of the fingerprint
+SOURCES = {
+    "intervals": [f"{CODE_DIR}/make_intervals.py"],
+    "histories": [f"{CODE_DIR}/make_histories.py", f"{CODE_DIR}/extractspread.py"],
+    "hypergraph": [f"{REPRO_DIR}/repro3.py"],
+    "groups": [f"{REPRO_DIR}/groups.py", f"{CODE_DIR}/layout.py"],
+    "risk": [f"{REPRO_DIR}/analysis.py"],
+    "report": [f"{REPRO_DIR}/report.py"],
+    "hotspots": [f"{REPRO_DIR}/correlation.py"],
+    "trend": [f"{REPRO_DIR}/trend.py"],
+    "heatmap": [f"{REPRO_DIR}/usage.py", f"{REPRO_DIR}/heatmap.py", f"{CODE_DIR}/layout.py"],
+    "stability": [f"{REPRO_DIR}/stability.py"],
+}
+
+# threshold parameters, by the stage whose code uses them, with their
+# defaults there; a stage's params hold only those set to other values
+# (see graph), so the default build keeps its fingerprints
+PARAMS = {
+    "intervals": {"mindistance": 12, "orphanduration": 10, "mergewindow": 15},
+    "histories": {"timeout": 60, "pendingcutoff": 180},
+    "hypergraph": {"minsize": 3},
+}
+
+filehashes = None  # path -> [size, mtime_ns, sha256], persisted in the cache
+
+
+def hashfile(path):
+    """
+    Return the SHA-256 of a file's contents; large inputs (fulldata.xz)
+    are only rehashed if their size or modification time has changed
+    """
+    global filehashes
+    indexfile = f"{CACHE_DIR}/filehashes.json"
+    if filehashes is None:
+        filehashes = dict()
+        if os.path.exists(indexfile):
+            with open(indexfile) as F:
+                filehashes = json.load(F)
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    known = filehashes.get(key)
+    if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+        return known[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as F:
+        for block in iter(lambda: F.read(1 << 20), b""):
+            h.update(block)
+    filehashes[key] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(indexfile, "w") as F:
+        json.dump(filehashes, F, indent=1)
+    return h.hexdigest()
+
+
+class Stage(object):
+    """
+    One node of the build graph: name and params identify it, inputs
+    are upstream Stage objects, files are plain input files, and
+    outputs maps artifact names (file names within the cache entry)
+    to the places where they are published
+    """
+
+    def __init__(self, name, run, params=None, inputs=(), files=(), outputs=None):
+        self.name, self.run, self.params = name, run, params or dict()
+        self.inputs, self.files = list(inputs), list(files)
+        self.outputs = outputs or dict()
+        self.key = None
+
+    def __repr__(self):
+        return f"{self.name}{self.params or ''}"
+
+    def fingerprint(self):
+        if self.key is None:
+            h = hashlib.sha256()
+            h.update(json.dumps([self.name, self.params], sort_keys=True).encode())
+            for stage in self.inputs:
+                h.update(stage.fingerprint().encode())
+            for path in SOURCES.get(self.name, []) + self.files:
+                h.update(os.path.basename(path).encode())
+                h.update(hashfile(path).encode() if os.path.exists(path) else b"-")
+            self.key = h.hexdigest()
+        return self.key
+
+    def entry(self):
+        key = self.fingerprint()
+        return f"{CACHE_DIR}/{self.name}/{key[:2]}/{key}"
+
+    def artifact(self, name):
+        # path of one output file of this stage, within the cache
+        return f"{self.entry()}/{name}"
+
+    def fresh(self):
+        return os.path.exists(f"{self.entry()}/COMPLETE")
+
+
+def adopt(stage):
+    """
+    Store a stage's published outputs in the cache under its current
+    fingerprint, without running it; returns False if any is missing
+    """
+    if stage.fresh() or not stage.outputs:
+        return stage.fresh()
+    if not all(os.path.exists(target) for target in stage.outputs.values()):
+        return False
+    entry = stage.entry()
+    os.makedirs(entry, exist_ok=True)
+    for name, target in stage.outputs.items():
+        shutil.copy2(target, f"{entry}/{name}")
+    with open(f"{entry}/COMPLETE", "w") as F:
+        json.dump({"stage": stage.name, "params": stage.params, "adopted": True}, F)
+    print("adopted", stage, stage.fingerprint()[:12])
+    return True
+
+
+def published(source, target):
+    # target is a copy of source (copy2 keeps the modification time), linked to nothing
+    if not os.path.exists(target):
+        return False
+    a, b = os.stat(source), os.stat(target)
+    return b.st_nlink == 1 and (a.st_size, a.st_mtime_ns) == (b.st_size, b.st_mtime_ns)
+
+
+def publish(stage):
+    """
+    Copy cached artifacts to their usual locations. Never a hard link:
+    the legacy scripts write those paths in place, which would rewrite
+    the cached artifact under its old fingerprint too
+    """
+    for name, target in stage.outputs.items():
+        source = stage.artifact(name)
+        directory = os.path.dirname(target) or "."
+        os.makedirs(directory, exist_ok=True)
+        if published(source, target):
+            continue
+        fd, scratch = tempfile.mkstemp(dir=directory, prefix=".publish")
+        os.close(fd)
+        try:
+            shutil.copy2(source, scratch)
+            os.replace(scratch, target)  # also breaks a link left by older versions
+        except BaseException:
+            os.remove(scratch)
+            raise
+
+
+def build(stage, force=(), built=None):
+    """
+    Bring stage up to date, building stale inputs first; returns the
+    list of stages that were actually run. force is a collection of
+    stage names to rerun even when their artifacts are cached
+    """
+    built = list() if built is None else built
+    if stage in built:
+        return built  # already run (e.g. forced) for another target
+    if stage.fresh() and stage.name not in force:
+        publish(stage)  # inputs are not needed, even if not cached
+        return built
+    for upstream in stage.inputs:
+        build(upstream, force, built)
+    entry = stage.entry()
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=os.path.dirname(entry))
+    with instrument.span(stage.name, **stage.params):
+        stage.run(stage, scratch)
+    with open(f"{scratch}/COMPLETE", "w") as F:
+        json.dump({"stage": stage.name, "params": stage.params,
+                   "inputs": [s.fingerprint() for s in stage.inputs]}, F)
+    if os.path.exists(entry):
+        shutil.rmtree(entry)  # forced rebuild replaces the old artifact
+    os.rename(scratch, entry)
+    publish(stage)
+    built.append(stage)
+    print("built", stage, stage.fingerprint()[:12])
+    return built
+
+
+"""
+    Stage implementations: each one writes its artifacts into the
+    scratch directory it is given, reading its inputs from the cache
+"""
+
+rawcache = dict()  # fulldata.xz is parsed once even if many shifts are stale
+
+
+def loadraw(path):
+    if path not in rawcache:
+        import codec
+
+        Raw = json.loads(codec.readbytes(path))
+        for item in Raw:
+            if item[2].startswith("datetime"):
+                item[2] = eval(item[2])
+        rawcache.clear()
+        rawcache[path] = Raw
+    return rawcache[path]
+
+
+def thresholds(stage):
+    # the PARAMS of stage that its params set
+    return {k: v for k, v in stage.params.items() if k in PARAMS.get(stage.name, {})}
+
+
+def runintervals(stage, scratch):
+    import make_intervals
+
+    Raw = loadraw(stage.files[0])
+    filename = f"{scratch}/intervals.json.xz"
+    make_intervals.makecontactintervals(Raw, Shift=stage.params["shift"], filename=filename,
+                                        **thresholds(stage))
+
+
+def runhistories(stage, scratch):
+    import make_histories
+
+    source = stage.inputs[0].artifact("intervals.json.xz")
+    make_histories.makehistory(source, f"{scratch}/histories.json.xz", **thresholds(stage))
+
+
+def reproducibility(name):
+    # import a module of the reproducibility directory
+    if REPRO_DIR not in sys.path:
+        sys.path.insert(0, REPRO_DIR)
+    return __import__(name)
+
+
+def runhypergraph(stage, scratch):
+    repro3 = reproducibility("repro3")
+    repro3.build_spatial_hypergraph(
+        shift=f"{stage.params['shift']:02d}",
+        history_file=stage.inputs[0].artifact("histories.json.xz"),
+        output_path=f"{scratch}/spatial_hypergraph.json",
+        placement_file=stage.files[0],
+        **thresholds(stage),
+    )
+
+
+def rungroups(stage, scratch):
+    groups = reproducibility("groups")
+    groups.build_group_hypergraph(
+        shift=f"{stage.params['shift']:02d}",
+        interval_file=stage.inputs[0].artifact("intervals.json.xz"),
+        output_path=f"{scratch}/group_hypergraph.json",
+        placement_file=stage.files[0],
+    )
+
+
+def runrisk(stage, scratch):
+    analysis = reproducibility("analysis")
+    shift = f"{stage.params['shift']:02d}"
+    analysis.analyze(shift, input_file=stage.inputs[0].artifact("spatial_hypergraph.json"),
+                     outdir=scratch)
+    # analyze skips a file when a shift has no HCP or anchor events
+    for kind, column in (("hcp", "HCP_ID,Event_Count"), ("anchor", "Anchor_ID,Usage_Count")):
+        filename = f"{scratch}/{kind}_risk_shift_{shift}.csv"
+        if not os.path.exists(filename):
+            with open(filename, "w") as F:
+                F.write(column + "\n")
+
+
+def riskfiles(stages):
+    return [s.artifact(f"hcp_risk_shift_{s.params['shift']:02d}.csv") for s in stages]
+
+
+def runreport(stage, scratch):
+    report = reproducibility("report")
+    report.generate_final_report(all_files=riskfiles(stage.inputs),
+                                 output_file=f"{scratch}/final_hyperhai_risk_report.csv")
+
+
+def runhotspots(stage, scratch):
+    correlation = reproducibility("correlation")
+    reportstage, hyperstage = stage.inputs
+    correlation.map_top_hcp_hotspots(
+        report_file=reportstage.artifact("final_hyperhai_risk_report.csv"),
+        json_file=hyperstage.artifact("spatial_hypergraph.json"),
+        output_file=f"{scratch}/top_hcp_hotspots.csv",
+    )
+
+
+def runtrend(stage, scratch):
+    trend = reproducibility("trend")
+    reportstage, riskstages = stage.inputs[0], stage.inputs[1:]
+    trend.plot_top_10_hcp_trends(
+        report_path=reportstage.artifact("final_hyperhai_risk_report.csv"),
+        all_files=riskfiles(riskstages),
+        output_path=f"{scratch}/top_10_hcp_risk_trend.png",
+    )
+
+
+def runstability(stage, scratch):
+    stability = reproducibility("stability")
+    files = {s.params["shift"]: s.artifact("spatial_hypergraph.json") for s in stage.inputs}
+    for kind in ("hcp", "anchor"):
+        stability.stability(files, kind, outdir=scratch, **stage.params)
+
+
+def runheatmap(stage, scratch):
+    usage = reproducibility("usage")
+    yamlfile, imgfile = stage.files
+    riskstage = stage.inputs[0]
+    usage.generate_risk_heatmap(yaml_file=yamlfile, img_file=imgfile,
+                                output_file=f"{scratch}/risk_heatmap.png",
+                                anchor_file=riskstage.artifact(
+                                    f"anchor_risk_shift_{riskstage.params['shift']:02d}.csv"))
+
+
+def graph(shifts=SHIFTS, params=None, publish=True):
+    """
+    Return a dictionary stage name -> Stage (or, for per-shift
+    stages, a dictionary shift -> Stage) describing the full build;
+    params maps names of PARAMS to values other than the defaults,
+    and without publish no stage has outputs outside the cache
+    """
+    reprodata = f"{PUBLISH_DIR}/data"
+    reprofigs = f"{PUBLISH_DIR}/figures"
+    placement = f"{SUPP_DIR}/placement005.yaml"
+    params = params or dict()
+    unknown = set(params) - {k for names in PARAMS.values() for k in names}
+    if unknown:
+        raise ValueError(f"unknown parameters {sorted(unknown)}")
+
+    def settings(name, n):
+        # params of stage name for shift n: the shift and any non-default thresholds
+        P = {"shift": n}
+        P.update({k: params[k] for k, v in PARAMS[name].items() if params.get(k, v) != v})
+        return P
+
+    G = {"intervals": {}, "histories": {}, "hypergraph": {}, "groups": {}, "risk": {}}
+    for n in shifts:
+        intervals = Stage("intervals", runintervals, settings("intervals", n),
+                          files=[f"{DATA_DIR}/fulldata.xz"],
+                          outputs={"intervals.json.xz":
+                                   f"{DATA_DIR}/contact_intervals/intervals{n:02d}.json.xz"})
+        histories = Stage("histories", runhistories, settings("histories", n), [intervals],
+                          files=glob.glob(f"{SUPP_DIR}/*.xlsx"),
+                          outputs={"histories.json.xz":
+                                   f"{DATA_DIR}/histories/histories{n:02d}.json.xz"})
+        hypergraph = Stage("hypergraph", runhypergraph, settings("hypergraph", n), [histories],
+                           files=[placement])
+        G["groups"][n] = Stage("groups", rungroups, {"shift": n}, [intervals], files=[placement])
+        risk = Stage("risk", runrisk, {"shift": n}, [hypergraph], outputs={
+            f"{kind}_risk_shift_{n:02d}.csv": f"{reprodata}/{kind}_risk_shift_{n:02d}.csv"
+            for kind in ("hcp", "anchor")})
+        G["intervals"][n], G["histories"][n] = intervals, histories
+        G["hypergraph"][n], G["risk"][n] = hypergraph, risk
+    risks = [G["risk"][n] for n in shifts]
+    G["report"] = Stage("report", runreport, {}, risks, outputs={
+        "final_hyperhai_risk_report.csv": f"{reprodata}/final_hyperhai_risk_report.csv"})
+    G["hotspots"] = Stage("hotspots", runhotspots, {},
+                          [G["report"], G["hypergraph"][shifts[-1]]], outputs={
+        "top_hcp_hotspots.csv": f"{reprodata}/top_hcp_hotspots.csv"})
+    G["trend"] = Stage("trend", runtrend, {}, [G["report"]] + risks, outputs={
+        "top_10_hcp_risk_trend.png": f"{reprofigs}/top_10_hcp_risk_trend.png"})
+    G["stability"] = Stage("stability", runstability,
+                           {"blocksize": 60, "nresamples": 10000, "k": 10},
+                           [G["hypergraph"][n] for n in shifts], outputs={
+        f"rank_stability{part}_{kind}.csv": f"{reprodata}/rank_stability{part}_{kind}.csv"
+        for part in ("", "_pairs") for kind in ("hcp", "anchor")})
+    G["heatmap"] = Stage("heatmap", runheatmap, {}, [G["risk"][2 if 2 in shifts else shifts[0]]],
+                         files=[placement, f"{FIG_DIR}/iculayout.png"], outputs={
+        "risk_heatmap.png": f"{reprofigs}/risk_heatmap.png"})
+    if not publish:
+        for name in G:
+            for stage in targets(G, [name]):
+                stage.outputs = dict()
+    return G
+
+
+def targets(G, names):
+    # flatten requested stage names (default: the final outputs) to Stages
+    T = list()
+    for name in names or ("hotspots", "trend", "heatmap"):
+        T.extend(G[name].values() if isinstance(G[name], dict) else [G[name]])
+    return T
+
+
+def stale(stage, seen=None):
+    # stages that a build of stage would run, upstream first
+    seen = set() if seen is None else seen
+    if id(stage) in seen or stage.fresh():
+        return list()
+    seen.add(id(stage))
+    S = list()
+    for upstream in stage.inputs:
+        S.extend(stale(upstream, seen))
+    S.append(stage)
+    return S
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    args = sys.argv[1:]
+    status = "--status" in args
+    force = set()
+    if "--force" in args:
+        i = args.index("--force")
+        force = set(args[i + 1].split(","))
+        del args[i : i + 2]
+    names = [a for a in args if not a.startswith("--") and not a.isdigit()]
+    shifts = [int(a) for a in args if a.isdigit()] or SHIFTS
+    G = graph(shifts)
+    if "--adopt" in args:
+        for name in ("intervals", "histories", "risk", "report", "hotspots", "trend", "heatmap"):
+            for stage in targets(G, [name]):
+                adopt(stage)
+        sys.exit(0)
+    if status:
+        seen = set()
+        for stage in targets(G, names):
+            for s in stale(stage, seen):
+                print("stale", s, s.fingerprint()[:12])
+        sys.exit(0)
+    built = list()
+    for stage in targets(G, names):
+        build(stage, force, built)
+    print("rebuilt", len(built), "stage(s)")
@@ -0,0 +1,235 @@
+"""
+Contact-seconds over any window of a shift, per badge, per anchor and
+per pair of badges, without going back to per-second data:
+
+    P = loadpyramid(5, registry)
+    P.total("pr045", t1, t2)           seconds of contact, summed over others
+    P.total("b143", t1, t2)            worn-badge seconds at an anchor
+    P.pair("pr045", "pr037", t1, t2)   seconds the two were in contact
+    P.series("pr045", 600)             (block starts, sums) by ten minutes
+    P.totals(t1, t2)                   all badges at once, by badge ID
+
+Times are datetimes or seconds since 1970. The seconds a pair is in
+contact are the union of its contact intervals in either direction
+(contactquery.ContactIndex.overlap looks only at the first badge's), and
+a badge's (or anchor's) series is the sum of the series of its pairs.
+
+The pyramid has levels of 1 second, 1 minute, 10 minutes and 1 hour,
+blocks aligned to clock hours. The minute level is stored as sums per
+block and kept as prefix sums, C[k] being the contact-seconds before
+minute k; the 10 minute and hour levels are every 10th and 60th of
+these (so P.series at any level is a difference of one array), and the
+1 second level is the merged pair intervals themselves, sorted by
+start. So a window [t1,t2) is C(t2) - C(t1), where C(t) is a prefix
+sum plus the part of the minute before t, from the few intervals that
+overlap it.
+
+Built from the compact intervals of sharedshifts.loadintervals and
+saved as data/contact_arrays/pyramidNN.npz.
+
+    python code/pyramid.py               (build all shifts)
+"""
+
+import sys, os, time
+import numpy as np
+import badgeids
+from badgeids import ARRAY_DIR
+import sharedshifts
+import contactquery
+
+DATA_DIR = 'data'
+LEVELS = (1, 60, 600, 3600)  # seconds per block
+
+
+def mergepairs(lo, hi, start, end):
+    """
+    Union of the intervals of each pair (lo,hi): arrays lo, hi, start,
+    end of disjoint intervals, sorted by pair then start
+    """
+    order = np.lexsort((start, hi, lo))
+    lo, hi, start, end = lo[order], hi[order], start[order], end[order]
+    key = (lo.astype(np.int64) << 16) | hi
+    span = int(end.max() - start.min()) + 1
+    base = start.min()
+    # running latest end within each pair, as one increasing sequence
+    reach = np.maximum.accumulate(key * span + (end - base))
+    new = np.ones(len(key), dtype=bool)
+    new[1:] = (key[1:] != key[:-1]) | (key[1:] * span + (start[1:] - base) > reach[:-1])
+    first = np.flatnonzero(new)
+    last = np.append(first[1:], len(key)) - 1
+    return lo[first], hi[first], start[first], reach[last] - key[last] * span + base
+
+
+class Pyramid(object):
+    """
+    origin (seconds, a clock hour), the pairs (array of ID pairs), and
+    for series 0..len(registry)-1 (badges) and the pairs: minute sums
+    and the intervals of each series, grouped by series, sorted by start
+    """
+
+    def __init__(self, arrays, registry):
+        self.registry = registry
+        self.origin = int(arrays["origin"])
+        self.pairs = arrays["pairs"]
+        self.pairid = {(int(a), int(b)): i for i, (a, b) in enumerate(self.pairs.tolist())}
+        self.arrays = arrays
+        self.prefix = dict()  # kind -> prefix sums over minutes
+        for kind in ("badge", "pair"):
+            S = arrays[f"{kind}_minutes"].astype(np.int64)
+            C = np.zeros((S.shape[0], S.shape[1] + 1), dtype=np.int64)
+            np.cumsum(S, axis=1, out=C[:, 1:])
+            self.prefix[kind] = C
+
+    @classmethod
+    def build(cls, A, registry):
+        # pyramid of compact intervals A (badgeids.INTERVAL)
+        lo = np.minimum(A["badge"], A["other"])
+        hi = np.maximum(A["badge"], A["other"])
+        start = A["start"].astype(np.int64)
+        lo, hi, start, end = mergepairs(lo, hi, start, start + A["duration"])
+        origin = int(start.min()) - int(start.min()) % 3600
+        minutes = -(-(int(end.max()) - origin) // 3600) * 60
+        pairs = np.unique(np.stack([lo, hi], axis=1), axis=0)
+        pairindex = np.searchsorted((pairs[:, 0].astype(np.int64) << 16) | pairs[:, 1],
+                                    (lo.astype(np.int64) << 16) | hi)
+        arrays = {"origin": np.int64(origin), "pairs": pairs.astype(np.uint16)}
+        # each merged interval counts for its pair and for both badges
+        for kind, series, S, E, nseries in (
+            ("pair", pairindex, start, end, len(pairs)),
+            ("badge", np.concatenate([lo, hi]), np.concatenate([start, start]),
+             np.concatenate([end, end]), len(registry)),
+        ):
+            order = np.lexsort((S, series))
+            series, S, E = series[order], S[order], E[order]
+            arrays[f"{kind}_start"], arrays[f"{kind}_end"] = S, E
+            arrays[f"{kind}_offsets"] = np.searchsorted(series, np.arange(nseries + 1))
+            arrays[f"{kind}_longest"] = np.zeros(nseries, dtype=np.int64)
+            np.maximum.at(arrays[f"{kind}_longest"], series, E - S)
+            arrays[f"{kind}_minutes"] = minutesums(series, S - origin, E - origin, nseries, minutes)
+        return cls(arrays, registry)
+
+    def save(self, filename):
+        np.savez_compressed(filename, **self.arrays)
+
+    @classmethod
+    def load(cls, filename, registry):
+        with np.load(filename) as F:
+            return cls({name: F[name] for name in F.files}, registry)
+
+    def seconds(self, t):
+        return contactquery.toseconds(t) - self.origin
+
+    def cumulative(self, kind, i, t):
+        # contact-seconds of series i before t (seconds from origin)
+        C = self.prefix[kind][i]
+        k = min(max(t, 0) // 60, len(C) - 1)
+        m = 60 * k
+        if t <= m:
+            return int(C[k])
+        A = self.arrays
+        lo, hi = A[f"{kind}_offsets"][i], A[f"{kind}_offsets"][i + 1]
+        S, E = A[f"{kind}_start"][lo:hi] - self.origin, A[f"{kind}_end"][lo:hi] - self.origin
+        a = np.searchsorted(S, m - A[f"{kind}_longest"][i])
+        b = np.searchsorted(S, t)
+        part = np.minimum(E[a:b], t) - np.maximum(S[a:b], m)
+        return int(C[k] + part[part > 0].sum())
+
+    def window(self, kind, i, t1, t2):
+        if t1 is None and t2 is None:
+            return int(self.prefix[kind][i][-1])
+        t1 = 0 if t1 is None else self.seconds(t1)
+        t2 = 60 * (self.prefix[kind].shape[1] - 1) if t2 is None else self.seconds(t2)
+        if t2 <= t1:
+            return 0
+        return self.cumulative(kind, i, t2) - self.cumulative(kind, i, t1)
+
+    def total(self, badge, t1=None, t2=None):
+        # contact-seconds of badge (name or ID) in [t1,t2)
+        i = self.registry.ids.get(badge) if isinstance(badge, str) else badge
+        if i is None or i >= self.prefix["badge"].shape[0]:
+            return 0
+        return self.window("badge", i, t1, t2)
+
+    def pair(self, a, b, t1=None, t2=None):
+        # seconds badges a and b (names or IDs) were in contact in [t1,t2)
+        ids = [self.registry.ids.get(x) if isinstance(x, str) else x for x in (a, b)]
+        if None in ids:
+            return 0
+        i = self.pairid.get((min(ids), max(ids)))
+        return 0 if i is None else self.window("pair", i, t1, t2)
+
+    def series(self, badge, level=600, t1=None, t2=None):
+        """
+        (starts, sums): block start datetimes and contact-seconds of
+        badge per block of level seconds (60, 600 or 3600), for the
+        blocks overlapping [t1,t2)
+        """
+        step = level // 60
+        i = self.registry.ids.get(badge) if isinstance(badge, str) else badge
+        C = self.prefix["badge"][i][::step]
+        k1 = 0 if t1 is None else max(self.seconds(t1) // level, 0)
+        k2 = len(C) - 1 if t2 is None else min(-(-self.seconds(t2) // level), len(C) - 1)
+        starts = [contactquery.todatetime(self.origin + k * level) for k in range(k1, k2)]
+        return starts, np.diff(C[k1 : k2 + 1])
+
+    def totals(self, t1, t2):
+        # contact-seconds in [t1,t2) of every badge, by badge ID
+        return self.cumulatives(self.seconds(t2)) - self.cumulatives(self.seconds(t1))
+
+    def cumulatives(self, t):
+        C = self.prefix["badge"]
+        k = min(max(t, 0) // 60, C.shape[1] - 1)
+        m = 60 * k
+        result = C[:, k].copy()
+        if t > m:
+            A = self.arrays
+            S, E = A["badge_start"] - self.origin, A["badge_end"] - self.origin
+            part = np.minimum(E, t) - np.maximum(S, m)
+            series = np.repeat(np.arange(C.shape[0]), np.diff(A["badge_offsets"]))
+            np.add.at(result, series[part > 0], part[part > 0])
+        return result
+
+
+def minutesums(series, S, E, nseries, minutes):
+    """
+    Contact-seconds of each series in each minute, for intervals [S,E)
+    (seconds from origin) of series; contact-seconds before t are the
+    sum over intervals of clip(t - S, 0, E - S), so each interval adds
+    a slope +1 from S and -1 from E, summed per minute of each event
+    """
+    slope = np.zeros((nseries, minutes + 1), dtype=np.int64)
+    offset = np.zeros((nseries, minutes + 1), dtype=np.int64)
+    for T, sign in ((S, 1), (E, -1)):
+        k = np.minimum(T // 60 + 1, minutes)  # first minute boundary after the event
+        np.add.at(slope, (series, k), sign)
+        np.add.at(offset, (series, k), sign * T)
+    boundary = 60 * np.arange(minutes + 1)
+    C = boundary * np.cumsum(slope, axis=1) - np.cumsum(offset, axis=1)
+    return np.diff(C, axis=1).astype(np.uint16)
+
+
+def pyramidfile(n, arraydir=ARRAY_DIR):
+    return f"{arraydir}/pyramid{n:02d}.npz"
+
+
+def loadpyramid(n, registry, datadir=DATA_DIR, arraydir=ARRAY_DIR):
+    # pyramid of shift n, from the saved file when it is up to date
+    intervalfile = f"{datadir}/contact_intervals/intervals{n:02d}.json.xz"
+    filename = pyramidfile(n, arraydir)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(intervalfile):
+        return Pyramid.load(filename, registry)
+    P = Pyramid.build(sharedshifts.loadintervals(n, registry, datadir, arraydir), registry)
+    os.makedirs(arraydir, exist_ok=True)
+    P.save(filename)
+    return P
+
+
+if __name__ == "__main__":
+    registry = badgeids.Registry.load()
+    for n in range(1, 15):
+        began = time.perf_counter()
+        P = loadpyramid(n, registry)
+        worn = np.flatnonzero(registry.roles[: P.prefix["badge"].shape[0]] != badgeids.ANCHOR)
+        busiest = worn[np.argmax(P.prefix["badge"][worn, -1])]
+        print(f"shift {n}: {len(P.pairs)} pairs, busiest badge {registry.name(busiest)} "
+              f"{P.total(busiest) / 3600:.1f} contact-hours, {time.perf_counter() - began:.2f}s")
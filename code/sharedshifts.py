@@ -0,0 +1,211 @@
+"""
+All 14 shifts in one block of shared memory, for analyses that look
+across shifts: instead of loading histories one at a time (as
+validation.py does with make_shift and del), the compact arrays of
+every shift are copied once into a multiprocessing.shared_memory block,
+and each worker process attaches to it and gets numpy views of that
+memory, with nothing pickled or copied per worker.
+
+    S = SharedStudy.create()
+    S.intervals(5), S.states(5)         (numpy views)
+    results = S.map(function, range(1, 15))   # function(S, n) in workers
+    S.unlink()
+
+Intervals are those of badgeids.py (undirected form, 19 bytes each).
+States are the room states of a histories file as runs, one for each
+stretch of seconds a badge keeps the same non-idle state (STATE below,
+room and FLAGS for inroom/pending, end exclusive); seconds without a
+run are idle (state None). The state runs of shift n are saved as
+data/contact_arrays/statesNN.npy, built from the histories file once.
+
+    python code/sharedshifts.py          (in-room hours by role, all shifts)
+"""
+
+import sys, os, json, time
+from multiprocessing import Pool, shared_memory
+import numpy as np
+import badgeids
+from badgeids import ARRAY_DIR
+import contactquery
+import codec
+
+DATA_DIR = 'data'
+
+INROOM, PENDING = 1, 2  # state flags
+STATE = np.dtype([
+    ("badge", "<u2"), ("start", "<i8"), ("end", "<i8"), ("room", "<i2"), ("flags", "u1"),
+])
+
+
+def encodestates(historyfile, registry):
+    # state runs of one histories file, ordered by end of run
+    return stateruns(json.loads(codec.readbytes(historyfile)), registry)
+
+
+def stateruns(H, registry):
+    # state runs of a parsed history (second -> badge -> entry)
+    moments = sorted((contactquery.parsetime(k), k) for k in H)
+    current = dict()  # badge -> [start, room, flags, last second] of its run so far
+    runs = list()
+
+    def close(badge):
+        start, room, flags, last = current.pop(badge)
+        runs.append((registry.intern(badge), start, last + 1, room, flags))
+
+    for t, key in moments:
+        for badge, entry in H[key].items():
+            state, run = entry["state"], current.get(badge)
+            if not state:
+                if run:
+                    close(badge)
+                continue
+            room = state["room"]
+            flags = (INROOM if state.get("inroom") else 0) | (PENDING if state.get("pending") else 0)
+            if run and run[1] == room and run[2] == flags and run[3] == t - 1:
+                run[3] = t
+                continue
+            if run:
+                close(badge)
+            current[badge] = [t, room, flags, t]
+    for badge in list(current):
+        close(badge)
+    A = np.array(runs, dtype=STATE)
+    return A[np.argsort(A["end"], kind="stable")]
+
+
+def statefile(n, arraydir=ARRAY_DIR):
+    return f"{arraydir}/states{n:02d}.npy"
+
+
+def loadstates(n, registry, datadir=DATA_DIR, arraydir=ARRAY_DIR):
+    # state runs of shift n, from the saved array when it is up to date
+    historyfile = f"{datadir}/histories/histories{n:02d}.json.xz"
+    filename = statefile(n, arraydir)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(historyfile):
+        return np.load(filename)
+    A = encodestates(historyfile, registry)
+    os.makedirs(arraydir, exist_ok=True)
+    np.save(filename, A)
+    registry.save(f"{arraydir}/badgeids.json")  # in case of new badges
+    return A
+
+
+def loadintervals(n, registry, datadir=DATA_DIR, arraydir=ARRAY_DIR):
+    # compact intervals of shift n, from the saved array when it is up to date
+    intervalfile = f"{datadir}/contact_intervals/intervals{n:02d}.json.xz"
+    filename = badgeids.arrayfile(n, arraydir)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(intervalfile):
+        return np.load(filename)
+    os.makedirs(arraydir, exist_ok=True)
+    A = badgeids.saveshift(n, registry, datadir, arraydir)
+    registry.save(f"{arraydir}/badgeids.json")
+    return A
+
+
+class SharedStudy(object):
+    """
+    Arrays of several shifts in one shared memory block; layout maps
+    (kind,n) -> (offset,count) with kind "intervals" or "states"
+    """
+
+    DTYPES = {"intervals": badgeids.INTERVAL, "states": STATE}
+
+    def __init__(self, shm, layout, names):
+        self.shm, self.layout = shm, layout
+        self.registry = badgeids.Registry(names)
+
+    @classmethod
+    def create(cls, shifts=range(1, 15), datadir=DATA_DIR, arraydir=ARRAY_DIR):
+        registry = badgeids.Registry.load(arraydir, datadir)
+        arrays = dict()
+        for n in shifts:
+            arrays["intervals", n] = loadintervals(n, registry, datadir, arraydir)
+            arrays["states", n] = loadstates(n, registry, datadir, arraydir)
+        layout, size = dict(), 0
+        for key, A in arrays.items():
+            size += -size % 8  # keep each array aligned
+            layout[key] = (size, len(A))
+            size += A.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        S = cls(shm, layout, registry.names)
+        for key, A in arrays.items():
+            S.view(*key)[:] = A
+        return S
+
+    @property
+    def handle(self):
+        # what a worker needs to attach: picklable and small
+        return self.shm.name, self.layout, self.registry.names
+
+    @classmethod
+    def attach(cls, handle):
+        name, layout, names = handle
+        # workers share the creator's resource tracker (fork or spawn),
+        # so the block is unlinked once, by unlink() or at the creator's exit
+        return cls(shared_memory.SharedMemory(name=name), layout, names)
+
+    def view(self, kind, n):
+        offset, count = self.layout[kind, n]
+        return np.ndarray((count,), dtype=self.DTYPES[kind], buffer=self.shm.buf, offset=offset)
+
+    def intervals(self, n):
+        return self.view("intervals", n)
+
+    def states(self, n):
+        return self.view("states", n)
+
+    @property
+    def shifts(self):
+        return sorted(n for kind, n in self.layout if kind == "intervals")
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    def map(self, function, shifts=None, processes=None):
+        # [function(S,n) for n in shifts], each call in a worker attached to S
+        shifts = self.shifts if shifts is None else list(shifts)
+        with Pool(processes, initializer=_attach, initargs=(self.handle,)) as pool:
+            return pool.map(_call, [(function, n) for n in shifts])
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        # release the block (creator only, when all workers are done)
+        self.shm.close()
+        self.shm.unlink()
+
+
+_worker = None  # SharedStudy of a worker process
+
+
+def _attach(handle):
+    global _worker
+    _worker = SharedStudy.attach(handle)
+
+
+def _call(task):
+    function, n = task
+    return function(_worker, n)
+
+
+def inroomhours(S, n):
+    # hours in patient rooms (confirmed, inroom) per role in shift n
+    A = S.states(n)
+    A = A[(A["flags"] & INROOM) != 0]
+    roles = S.registry.roles[A["badge"]]
+    seconds = np.bincount(roles, weights=A["end"] - A["start"], minlength=badgeids.UNKNOWN + 1)
+    return n, [round(e / 3600, 1) for e in seconds[badgeids.NURSE : badgeids.SUPPORT + 1]]
+
+
+if __name__ == "__main__":
+    began = time.perf_counter()
+    S = SharedStudy.create()
+    print(f"{S.nbytes / 2**20:.1f} MB shared, ready in {time.perf_counter() - began:.1f}s")
+    try:
+        print("shift  nurse provider support (in-room hours)")
+        for n, hours in S.map(inroomhours):
+            print(n, *hours)
+    finally:
+        S.unlink()
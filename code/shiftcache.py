@@ -0,0 +1,339 @@
+"""
+One process-wide cache of parsed shifts, for notebook and analysis
+sessions that come back to the same shifts: instead of each function
+decompressing and parsing its histories file (validation.make_shift,
+repro.extract_hyperedges, repro3.build_spatial_hypergraph ...), ask
+
+    H = get_shift(5)                     history of shift 5 (History below)
+    A = get_shift(5, "intervals")        compact intervals (badgeids.INTERVAL)
+    E = get_shift(5, "hypergraph")       hyperedges of repro3.py (Hypergraph below)
+    stats()                              hits, misses, evictions, bytes held
+
+Shifts are held in compact form (numpy arrays of badge IDs of
+badgeids.Registry), least recently used first out when the bytes held
+pass the budget (MICU_CACHE_MB megabytes, 1024 if not set; or
+setbudget). Each entry remembers the size and modification time of its
+source file and is reloaded when they change, so a cache hit costs one
+os.stat. A history is parsed once ever: its arrays are saved as
+data/contact_arrays/historyNN.npz, like the state runs of sharedshifts.
+
+History keeps the contacts of each second (the entries with contacts,
+grouped by second) and the state runs of sharedshifts.stateruns;
+H.snapshot(i) and H.items() give back the dictionaries of the file.
+The hypergraph is the artifact of the pipeline's hypergraph stage for
+the shift, built if stale.
+
+    python code/shiftcache.py 5          (load twice, show timings and stats)
+"""
+
+import sys, os, json, time
+from collections import OrderedDict
+import numpy as np
+import badgeids
+from badgeids import ARRAY_DIR
+import sharedshifts
+import contactquery
+import instrument
+import codec
+
+DATA_DIR = 'data'
+BUDGET = int(os.environ.get("MICU_CACHE_MB", "1024")) << 20  # bytes
+KINDS = ("history", "intervals", "hypergraph")
+
+
+class History(object):
+    """
+    seconds (sorted), badges (those of every snapshot, in file order),
+    second_offsets into the entries (badge, contact_offsets) of badges
+    with contacts, contacts (IDs) and the state runs (sharedshifts.STATE)
+    """
+
+    def __init__(self, arrays, registry):
+        self.arrays, self.registry = arrays, registry
+        self.seconds = arrays["seconds"]
+        self.runs = arrays["states"]
+
+    @classmethod
+    def build(cls, H, registry):
+        # History of a parsed histories file
+        moments = sorted((contactquery.parsetime(k), k) for k in H)
+        first = H[moments[0][1]] if moments else dict()
+        badges = [registry.intern(b) for b in first]
+        seconds, second_offsets = list(), [0]
+        entry_badge, contact_offsets, contacts = list(), [0], list()
+        for t, key in moments:
+            seconds.append(t)
+            for badge, entry in H[key].items():
+                if entry["contacts"]:
+                    entry_badge.append(registry.intern(badge))
+                    contacts.extend(registry.intern(c) for c in entry["contacts"])
+                    contact_offsets.append(len(contacts))
+            second_offsets.append(len(entry_badge))
+        arrays = {
+            "seconds": np.array(seconds, dtype=np.int64),
+            "badges": np.array(badges, dtype=np.uint16),
+            "second_offsets": np.array(second_offsets, dtype=np.int64),
+            "entry_badge": np.array(entry_badge, dtype=np.uint16),
+            "contact_offsets": np.array(contact_offsets, dtype=np.int64),
+            "contacts": np.array(contacts, dtype=np.uint16),
+            "states": sharedshifts.stateruns(H, registry),
+        }
+        return cls(arrays, registry)
+
+    def save(self, filename):
+        np.savez(filename, **self.arrays)
+
+    @classmethod
+    def load(cls, filename, registry):
+        with np.load(filename) as F:
+            return cls({name: F[name] for name in F.files}, registry)
+
+    @property
+    def nbytes(self):
+        return sum(A.nbytes for A in self.arrays.values())
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def index(self, t):
+        # index of second t (datetime or seconds), or of the next one held
+        return int(np.searchsorted(self.seconds, contactquery.toseconds(t)))
+
+    def contacts(self, i):
+        # {badge: [contacts]} of the badges with contacts in second i
+        A, name = self.arrays, self.registry.name
+        lo, hi = A["second_offsets"][i], A["second_offsets"][i + 1]
+        C, offsets = A["contacts"], A["contact_offsets"]
+        return {name(b): [name(c) for c in C[offsets[e] : offsets[e + 1]].tolist()]
+                for e, b in zip(range(lo, hi), A["entry_badge"][lo:hi].tolist())}
+
+    def states(self, i):
+        # {badge: state} of the badges with a state in second i
+        t, R = self.seconds[i], self.runs
+        R = R[(R["start"] <= t) & (t < R["end"])]
+        found = dict()
+        for badge, room, flags in zip(R["badge"].tolist(), R["room"].tolist(), R["flags"].tolist()):
+            state = {"room": room}
+            if flags & sharedshifts.INROOM:
+                state["inroom"] = True
+            if flags & sharedshifts.PENDING:
+                state["pending"] = True
+            found[self.registry.name(badge)] = state
+        return found
+
+    def snapshot(self, i):
+        # second i as in the histories file: badge -> {"contacts", "state"}
+        contacts, states = self.contacts(i), self.states(i)
+        return {b: {"contacts": contacts.get(b, []), "state": states.get(b)}
+                for b in map(self.registry.name, self.arrays["badges"].tolist())}
+
+    def items(self):
+        # (datetime, snapshot) of every second, in time order
+        for i, t in enumerate(self.seconds.tolist()):
+            yield contactquery.todatetime(t), self.snapshot(i)
+
+
+class Hypergraph(object):
+    """
+    Hyperedges of repro3.py: time (time_t), offsets into members (IDs,
+    in file order) and centroid (x, y; nan for None)
+    """
+
+    def __init__(self, arrays, registry):
+        self.arrays, self.registry = arrays, registry
+        self.time = arrays["time"]
+
+    @classmethod
+    def build(cls, events, registry):
+        members, offsets = list(), [0]
+        for event in events:
+            members.extend(registry.intern(m) for m in event["members"])
+            offsets.append(len(members))
+        centroid = [e["centroid_location"] or (np.nan, np.nan) for e in events]
+        arrays = {
+            "time": np.array([e["time_t"] for e in events], dtype=np.int64),
+            "offsets": np.array(offsets, dtype=np.int64),
+            "members": np.array(members, dtype=np.uint16),
+            "centroid": np.array(centroid, dtype=np.float64).reshape(-1, 2),
+        }
+        return cls(arrays, registry)
+
+    @property
+    def nbytes(self):
+        return sum(A.nbytes for A in self.arrays.values())
+
+    def __len__(self):
+        return len(self.time)
+
+    def members(self, i):
+        A = self.arrays
+        return [self.registry.name(m) for m in A["members"][A["offsets"][i] : A["offsets"][i + 1]].tolist()]
+
+    def __iter__(self):
+        # the events as in the hypergraph file
+        for i, t in enumerate(self.time.tolist()):
+            x, y = self.arrays["centroid"][i].tolist()
+            yield {"time_t": t, "members": self.members(i),
+                   "centroid_location": None if np.isnan(x) else [x, y]}
+
+
+def historyfile(n, arraydir=ARRAY_DIR):
+    return f"{arraydir}/history{n:02d}.npz"
+
+
+def loadhistory(n, registry, datadir=DATA_DIR, arraydir=ARRAY_DIR):
+    # History of shift n, from the saved arrays when they are up to date
+    source = f"{datadir}/histories/histories{n:02d}.json.xz"
+    filename = historyfile(n, arraydir)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(source):
+        return History.load(filename, registry)
+    H = History.build(json.loads(codec.readbytes(source)), registry)
+    os.makedirs(arraydir, exist_ok=True)
+    H.save(filename)
+    registry.save(f"{arraydir}/badgeids.json")  # in case of new badges
+    return H
+
+
+def hypergraphstage(n):
+    import pipeline
+
+    return pipeline.graph([n])["hypergraph"][n]
+
+
+def loadhypergraph(n, registry):
+    import pipeline
+
+    stage = hypergraphstage(n)
+    pipeline.build(stage)
+    with codec.openfile(stage.artifact("spatial_hypergraph.json"), "rt") as F:
+        return Hypergraph.build(json.load(F), registry)
+
+
+def nbytes(value):
+    return value.nbytes
+
+
+class ShiftCache(object):
+    """
+    (kind, n) -> (source stamp, value), least recently used first;
+    budget in bytes
+    """
+
+    def __init__(self, budget=BUDGET, datadir=DATA_DIR, arraydir=ARRAY_DIR):
+        self.budget, self.datadir, self.arraydir = budget, datadir, arraydir
+        self.entries = OrderedDict()
+        self.held = 0
+        self.counts = dict.fromkeys(("hits", "misses", "invalidations", "evictions"), 0)
+        self.loadtime = 0.0
+        self._registry = None
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            self._registry = badgeids.Registry.load(self.arraydir, self.datadir)
+        return self._registry
+
+    def source(self, kind, n):
+        # the file the value of (kind, n) is made from
+        if kind == "history":
+            return f"{self.datadir}/histories/histories{n:02d}.json.xz"
+        if kind == "intervals":
+            return f"{self.datadir}/contact_intervals/intervals{n:02d}.json.xz"
+        # a new fingerprint of the stage (edited code, thresholds) is a new path
+        return hypergraphstage(n).artifact("spatial_hypergraph.json")
+
+    def stamp(self, path):
+        if not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        return path, st.st_size, st.st_mtime_ns
+
+    def load(self, kind, n):
+        if kind == "history":
+            return loadhistory(n, self.registry, self.datadir, self.arraydir)
+        if kind == "intervals":
+            return sharedshifts.loadintervals(n, self.registry, self.datadir, self.arraydir)
+        return loadhypergraph(n, self.registry)
+
+    def get(self, n, kind="history"):
+        if kind not in KINDS:
+            raise ValueError(f"kind is one of {KINDS}, not {kind!r}")
+        key = (kind, n)
+        stamp = self.stamp(self.source(kind, n))
+        if key in self.entries:
+            held, value = self.entries[key]
+            if held == stamp:
+                self.counts["hits"] += 1
+                self.entries.move_to_end(key)
+                return value
+            self.counts["invalidations"] += 1
+            self.drop(key)
+        self.counts["misses"] += 1
+        began = time.perf_counter()
+        with instrument.span("shiftcache", kind=kind, shift=n) as sp:
+            value = self.load(kind, n)
+            sp.count("bytes", nbytes(value))
+        self.loadtime += time.perf_counter() - began
+        # stamp again: a missing hypergraph has just been built
+        self.entries[key] = (stamp or self.stamp(self.source(kind, n)), value)
+        self.held += nbytes(value)
+        self.evict()
+        return value
+
+    def drop(self, key):
+        stamp, value = self.entries.pop(key)
+        self.held -= nbytes(value)
+
+    def evict(self):
+        # least recently used out, keeping at least the newest entry
+        while self.held > self.budget and len(self.entries) > 1:
+            self.drop(next(iter(self.entries)))
+            self.counts["evictions"] += 1
+
+    def setbudget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.held = 0
+
+    def stats(self):
+        return dict(self.counts, entries=list(self.entries), bytes=self.held,
+                    budget=self.budget, loadtime=round(self.loadtime, 3))
+
+
+CACHE = ShiftCache()
+
+
+def get_shift(n, kind="history"):
+    """
+    Shift n (an int) as kind: "history" (History), "intervals" (numpy
+    array of badgeids.INTERVAL) or "hypergraph" (Hypergraph), from the
+    cache when its source file has not changed since it was loaded
+    """
+    return CACHE.get(n, kind)
+
+
+def stats():
+    return CACHE.stats()
+
+
+def setbudget(megabytes):
+    CACHE.setbudget(int(megabytes * 2**20))
+
+
+def clear():
+    CACHE.clear()
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for kind in KINDS:
+        for attempt in ("first", "again"):
+            began = time.perf_counter()
+            value = get_shift(n, kind)
+            print(f"{kind:10s} {attempt}: {time.perf_counter() - began:8.4f}s, "
+                  f"{nbytes(value) / 2**20:.1f} MB, {len(value)} items")
+    print(stats())
@@ -10,20 +10,25 @@ be calculated with respect to the architecture.
 """
 
 import sys  # for debugging only
-import cv2
-import skimage.exposure
-import yaml
 
 SUPP_DIR = 'supp'
 FIG_DIR = 'figures'
 
-with open(f"{SUPP_DIR}/placement005.yaml") as F:
-    R = yaml.load(F, Loader=yaml.FullLoader)
-anchorlist = R["anchors"]
+
+def anchors():
+    # anchor name -> {"x", "y"} of placement005.yaml (read when first needed)
+    import yaml
+
+    with open(f"{SUPP_DIR}/placement005.yaml") as F:
+        R = yaml.load(F, Loader=yaml.FullLoader)
+    return R["anchors"]
 
 
 def anchordots():
     # produce anchordots.png showing location of anchors
+    import cv2
+
+    anchorlist = anchors()
     iculayout = cv2.imread(f"{FIG_DIR}/iculayout.png")
     height, width, depth = iculayout.shape
     minx = int(min(anchorlist[badge]["x"] for badge in anchorlist))
@@ -41,6 +46,10 @@ def anchordots():
 
 def selectedarea():
     # produce enlarged portion of icu layout to show badge names
+    import cv2
+    import skimage.exposure
+
+    anchorlist = anchors()
     iculayout = cv2.imread(f"{FIG_DIR}/iculayout.png")
     height, width, depth = iculayout.shape
     # pre-treatment to get lighter background
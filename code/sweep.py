@@ -0,0 +1,151 @@
+"""
+Sensitivity of the results to the thresholds of the pipeline (PARAMS in
+pipeline.py: clean's distance cutoff and orphan duration, the merge
+window of makecontactintervals, genstate's in-room timeout and pending
+cutoff, and the least hyperedge size of repro3.py). A grid of settings
+becomes one build graph per point, none of them publishing outside the
+cache; stages get the same fingerprint wherever a point's settings do
+not affect them, so the stages of all points are pooled by fingerprint
+and each is built once, level by level (every intervals stage, then
+histories, hypergraph, risk) on a process pool. Cached stages, from
+earlier sweeps or the default build, are not rebuilt.
+
+The result is one row per point and shift (and per point, shift "all",
+for the event counts summed over shifts): the settings, the count of
+contact intervals, of in-room and pending badge-seconds, of hyperedges
+and of HCPs with events, and how the HCP ranking by event count
+compares with that of the default settings (Spearman correlation over
+the HCPs both have, and the share of the default top k kept).
+
+    python code/sweep.py timeout=30,60,120 pendingcutoff=120,180,300 [2 3]
+                         [--processes 4] [--out sweep.csv]
+
+The histories stage is the costly one (minutes a shift, and some GB of
+memory each), so mind processes when timeout or pendingcutoff vary;
+the intervals stage needs data/fulldata.xz.
+"""
+
+import sys, json, itertools
+from multiprocessing import Pool
+import pandas as pd
+from scipy.stats import spearmanr
+import instrument
+import codec
+import pipeline
+
+LEVELS = ("intervals", "histories", "hypergraph", "risk")
+
+
+def grid(**axes):
+    # list of points (dictionaries) of the product of the axes' values
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[k] for k in names))]
+
+
+def measure(stage):
+    # counts of one built stage, for the sweep table
+    if stage.name == "intervals":
+        return {"intervals": len(json.loads(codec.readbytes(stage.artifact("intervals.json.xz"))))}
+    if stage.name == "histories":
+        H = json.loads(codec.readbytes(stage.artifact("histories.json.xz")))
+        inroom = pending = 0
+        for entry in H.values():
+            for status in entry.values():
+                state = status["state"]
+                if state:
+                    inroom += bool(state.get("inroom"))
+                    pending += bool(state.get("pending"))
+        return {"inroom_seconds": inroom, "pending_seconds": pending}
+    if stage.name == "hypergraph":
+        with codec.openfile(stage.artifact("spatial_hypergraph.json"), "rt") as F:
+            return {"hyperedges": len(json.load(F))}
+    table = pd.read_csv(stage.artifact(f"hcp_risk_shift_{stage.params['shift']:02d}.csv"))
+    return {"ranking": dict(zip(table["HCP_ID"], table["Event_Count"]))}
+
+
+def buildstage(stage):
+    # worker: build one stage (its inputs are built) and measure it
+    pipeline.build(stage)
+    return stage.fingerprint(), measure(stage)
+
+
+def compare(ranking, baseline, k):
+    # Spearman over common HCPs, and share of the baseline top k kept
+    common = sorted(set(ranking) & set(baseline))
+    rho = float("nan")
+    X, Y = [ranking[h] for h in common], [baseline[h] for h in common]
+    if len(set(X)) > 1 and len(set(Y)) > 1:  # else no ranking to compare
+        rho = spearmanr(X, Y)[0]
+    top = lambda R: set(sorted(R, key=lambda h: (-R[h], h))[:k])
+    kept = len(top(ranking) & top(baseline)) / max(1, min(k, len(baseline)))
+    return rho, kept
+
+
+def sweep(points, shifts=pipeline.SHIFTS, processes=None, k=10):
+    """
+    Build every point of the grid for shifts and return the table (a
+    DataFrame); the default settings are added as a point if missing
+    """
+    defaults = {name: v for P in pipeline.PARAMS.values() for name, v in P.items()}
+    points = [dict(defaults, **point) for point in points]
+    if defaults not in points:
+        points.insert(0, defaults)
+    graphs = [pipeline.graph(shifts, point, publish=False) for point in points]
+    unique = {level: dict() for level in LEVELS}  # level -> fingerprint -> Stage
+    for G in graphs:
+        for level in LEVELS:
+            for stage in G[level].values():
+                unique[level].setdefault(stage.fingerprint(), stage)  # hashes files once, here
+    measured = dict()  # fingerprint -> counts
+    with Pool(processes) as pool:
+        for level in LEVELS:
+            stages = list(unique[level].values())
+            with instrument.span("sweep", level=level, stages=len(stages)) as sp:
+                sp.count("stale", sum(not s.fresh() for s in stages))
+                measured.update(pool.imap_unordered(buildstage, stages))
+
+    rows = list()
+    base = graphs[points.index(defaults)]
+    for point, G in zip(points, graphs):
+        totals, basetotals = dict(), dict()
+        for n in shifts:
+            row = dict(point, shift=n)
+            for level in LEVELS[:-1]:
+                row.update(measured[G[level][n].fingerprint()])
+            ranking = measured[G["risk"][n].fingerprint()]["ranking"]
+            baseline = measured[base["risk"][n].fingerprint()]["ranking"]
+            row["hcps"] = len(ranking)
+            row["spearman"], row["topk_kept"] = compare(ranking, baseline, k)
+            rows.append(row)
+            for h, c in ranking.items():
+                totals[h] = totals.get(h, 0) + c
+            for h, c in baseline.items():
+                basetotals[h] = basetotals.get(h, 0) + c
+        row = dict(point, shift="all")
+        for column in ("intervals", "inroom_seconds", "pending_seconds", "hyperedges"):
+            row[column] = sum(r[column] for r in rows[-len(shifts):])
+        row["hcps"] = len(totals)
+        row["spearman"], row["topk_kept"] = compare(totals, basetotals, k)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    args = sys.argv[1:]
+    processes, out = None, f"{pipeline.REPRO_DIR}/data/parameter_sweep.csv"
+    for flag in ("--processes", "--out"):
+        if flag in args:
+            i = args.index(flag)
+            value = args[i + 1]
+            del args[i : i + 2]
+            if flag == "--processes":
+                processes = int(value)
+            else:
+                out = value
+    axes = {a.split("=")[0]: [int(v) for v in a.split("=")[1].split(",")] for a in args if "=" in a}
+    shifts = [int(a) for a in args if a.isdigit()] or pipeline.SHIFTS
+    table = sweep(grid(**axes), shifts, processes)
+    table.to_csv(out, index=False)
+    print(table[table["shift"] == "all"].to_string(index=False))
+    print("saved", out)
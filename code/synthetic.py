@@ -0,0 +1,290 @@
+from datetime import datetime, timedelta
+import sys, os, json, random, time
+import yaml
+import extractspread
+import jsonstream
+import codec
+DATA_DIR = 'data'
+SUPP_DIR = 'supp'
+
+"""
+    Goal of this module is to manufacture raw badge data, in exactly
+    the form of fulldata.xz, for testing how the processing pipeline
+    scales beyond the 14 shifts of the 2023 study. The simulation uses
+    the real anchors (placement005.yaml for all anchors, badgelocations.xlsx
+    through extractspread.getAnchors for patient rooms, doors and interior
+    anchors), so make_histories can infer room states from the output.
+
+    The simulation is itinerary based, repeated for each worn badge:
+        1. reserve blocks of time for group rounds; a round is a group
+             of badges visiting a sequence of patient rooms together
+        2. fill the remaining time with individual visits, either to a
+             patient room or to a hallway anchor (hallway anchors are
+             weighted so that a few of them become hubs), separated by
+             short walks and occasional absences from the unit
+        3. a room visit makes a short door contact followed by contacts
+             with the interior anchors of the room; a hallway visit
+             makes a contact with its anchor
+        4. two badges at the same place at the same time make a contact
+             (in a hallway only with probability density)
+    Each contact becomes Instant-Trace records: a start-of-contact record
+    with duration 0 and a matching end-of-contact record, whose duration is
+    a multiple of 15 (max 600, so long contacts are reported in pieces);
+    some start-of-contact records are left as orphans, and the reporting
+    badge's clock may be off by a few seconds, as in the real data.
+"""
+
+# default population, roughly that of the 2023 study
+ROLES = (("n", 50), ("pr", 45), ("ss", 45))
+# default weights for the number of badges in a group round
+GROUPSIZES = {2: 0.35, 3: 0.3, 4: 0.2, 5: 0.1, 7: 0.05}
+
+
+def getlayout(suppdir):
+    """
+    Return (rooms, hallway) where rooms maps room number to a
+    dictionary {"door": [anchors], "interior": [anchors]} and
+    hallway is the list of anchors that are not in a patient room
+    """
+    with open(f"{suppdir}/placement005.yaml") as F:
+        placement = yaml.load(F, Loader=yaml.FullLoader)
+    AnchorTable = extractspread.getAnchors(suppdir)
+    rooms = dict()
+    for anchor, (room, role) in sorted(AnchorTable.items()):
+        entry = rooms.setdefault(room, {"door": [], "interior": []})
+        entry["door" if role == "door" else "interior"].append(anchor)
+    # a room needs a door for make_histories to ever see an entry
+    rooms = {r: e for r, e in rooms.items() if e["door"] and e["interior"]}
+    hallway = sorted(a for a in placement["anchors"] if a not in AnchorTable)
+    return rooms, hallway
+
+
+def makebadges(roles=ROLES, scale=1):
+    # names like n001, pr017, ss045 for the worn badges
+    badges = list()
+    for prefix, count in roles:
+        for i in range(1, int(count * scale) + 1):
+            badges.append(f"{prefix}{i:03d}")
+    return badges
+
+
+def choosesize(rng, groupsizes):
+    sizes = sorted(groupsizes)
+    return rng.choices(sizes, weights=[groupsizes[k] for k in sizes])[0]
+
+
+def makerounds(rng, badges, rooms, seconds, roundrate, groupsizes):
+    """
+    Return a dictionary badge -> list of (place,start,end) visits for
+    group rounds; roundrate is the number of rounds started per hour
+    """
+    roomlist = sorted(rooms)
+    visits = {badge: list() for badge in badges}
+    busy = {badge: list() for badge in badges}  # reserved (start,end)
+    for _ in range(int(roundrate * seconds / 3600)):
+        t = rng.randrange(seconds)
+        size = min(choosesize(rng, groupsizes), len(badges))
+        plan, cursor = list(), t
+        for room in rng.sample(roomlist, min(len(roomlist), rng.randint(2, 6))):
+            dwell = rng.randint(120, 420)
+            plan.append((("room", room), cursor, cursor + dwell))
+            cursor += dwell + rng.randint(10, 40)  # walk to the next room
+        end = min(cursor, seconds)
+        free = [b for b in badges
+                if not any(s < end and t < e for s, e in busy[b])]
+        for badge in rng.sample(free, min(size, len(free))):
+            busy[badge].append((t, end))
+            visits[badge].extend((p, s, min(e, seconds)) for p, s, e in plan if s < seconds)
+    return visits
+
+
+def makeitinerary(rng, rounds, rooms, hallway, weights, seconds, roomfraction):
+    """
+    Return a sorted list of (place,start,end) visits for one badge,
+    where place is ("room",number) or ("hall",anchor); rounds is the
+    list of group round visits already reserved for the badge
+    """
+    roomlist = sorted(rooms)
+    blocked = sorted(rounds, key=lambda v: v[1])
+    visits, t = list(rounds), rng.randint(0, 900)  # staggered arrival
+    while t < seconds:
+        if blocked and blocked[0][1] <= t:
+            t = max(t, blocked.pop(0)[2] + rng.randint(5, 30))
+            continue
+        if rng.random() < 0.05:
+            t += int(rng.expovariate(1 / 900))  # away from the unit
+            continue
+        if rng.random() < roomfraction:
+            place, dwell = ("room", rng.choice(roomlist)), rng.expovariate(1 / 240)
+        else:
+            place = ("hall", rng.choices(hallway, weights=weights)[0])
+            dwell = rng.expovariate(1 / 120)
+        end = min(t + max(15, int(dwell)), seconds)
+        if blocked and blocked[0][1] < end:
+            end = blocked[0][1]  # cut short by a group round
+        if end > t:
+            visits.append((place, t, end))
+        t = end + rng.randint(5, 30)  # walk to the next place
+    return sorted(visits, key=lambda v: v[1])
+
+
+def anchorcontacts(rng, badge, visits, rooms):
+    # yields (badge,anchor,start,end) contacts for the visits of a badge
+    for (kind, where), start, end in visits:
+        if kind == "hall":
+            yield badge, where, start, end
+            continue
+        door = rng.choice(rooms[where]["door"])
+        enter = min(end, start + rng.randint(5, 20))
+        yield badge, door, start, enter
+        if end - enter < 15:
+            continue
+        for anchor in rooms[where]["interior"]:
+            if rng.random() < 0.7:
+                yield badge, anchor, enter + rng.randint(0, 10), end
+
+
+def badgecontacts(rng, itineraries, density):
+    # yields (badge,otherbadge,start,end) for badges sharing a place
+    byplace = dict()
+    for badge in sorted(itineraries):
+        for place, start, end in itineraries[badge]:
+            byplace.setdefault(place, list()).append((start, end, badge))
+    for place in sorted(byplace):
+        active = list()
+        for start, end, badge in sorted(byplace[place]):
+            active = [v for v in active if v[1] > start]
+            for ostart, oend, other in active:
+                if other == badge:
+                    continue
+                if place[0] == "hall" and rng.random() >= density:
+                    continue
+                yield other, badge, start, min(end, oend)
+            active.append((start, end, badge))
+
+
+def makerecords(rng, a, b, start, end, orphanrate, skew):
+    """
+    Convert one contact into Instant-Trace records; the reporting
+    badge is chosen at random and its clock may be off by skew seconds
+    """
+    if rng.random() < 0.5:
+        a, b = b, a
+    distance = rng.randint(12, 72)
+    offset = rng.randint(-skew, skew)
+    records, t = list(), start
+    while t < end:
+        duration = min(600, 15 * max(1, round((end - t) / 15)))
+        T = max(0, t + offset)  # seconds after origin, converted later
+        records.append([a, b, T, distance, 0])
+        if rng.random() >= orphanrate:
+            records.append([a, b, T, distance, duration])
+        t += duration
+    return records
+
+
+def synthesize(
+    start=datetime(2023, 4, 18, 7, 0),
+    hours=12,
+    scale=1,
+    roles=ROLES,
+    density=0.6,
+    roundrate=4,
+    groupsizes=GROUPSIZES,
+    roomfraction=0.5,
+    orphanrate=0.1,
+    skew=3,
+    seed=2023,
+    suppdir=SUPP_DIR,
+):
+    """
+    Input:
+        start is the datetime of the first second simulated
+        hours is the length of simulated time
+        scale multiplies the number of badges in roles, which is
+          a sequence of (prefix,count) for worn badges
+        density is the probability that two badges at the same hallway
+          anchor are in contact (room visitors always are)
+        roundrate is the number of group rounds per hour (it is also
+          multiplied by scale) with sizes drawn from groupsizes weights
+        roomfraction is the fraction of individual visits to rooms
+        orphanrate is the fraction of contacts without an end record
+        skew is the largest clock error, in seconds, of a badge report
+    Output:
+        a list of raw records [badge,otherbadge,datetime,distance,duration],
+        the datetime a string such as "datetime(2023, 4, 19, 0, 2, 27)",
+        sorted by datetime as in fulldata.xz
+    """
+    rng = random.Random(seed)
+    rooms, hallway = getlayout(suppdir)
+    weights = [1 / (1 + i) for i in range(len(hallway))]  # a few hubs
+    rng.shuffle(weights)
+    seconds = int(hours * 3600)
+    badges = makebadges(roles, scale)
+    rounds = makerounds(rng, badges, rooms, seconds, roundrate * scale, groupsizes)
+    itineraries = dict()
+    for badge in badges:
+        itineraries[badge] = makeitinerary(
+            rng, rounds[badge], rooms, hallway, weights, seconds, roomfraction
+        )
+    Raw = list()
+    contacts = [c for badge in badges
+                for c in anchorcontacts(rng, badge, itineraries[badge], rooms)]
+    contacts.extend(badgecontacts(rng, itineraries, density))
+    for a, b, s, e in contacts:
+        if e > s:
+            Raw.extend(makerecords(rng, a, b, s, e, orphanrate, skew))
+    Raw.sort(key=lambda item: item[2])
+    for item in Raw:
+        T = start + timedelta(seconds=item[2])
+        item[2] = repr(T).replace("datetime.datetime", "datetime")
+    return Raw
+
+
+def writeraw(Raw, filename):
+    # write records as fulldata.xz is written
+    with codec.openfile(filename, "wb") as F:
+        jsonstream.dumprecords(Raw, F)
+
+
+def scalingcurve(scales=(1, 2, 5, 10), hours=12, **kwargs):
+    """
+    Time make_intervals and make_histories on synthetic data for each
+    scale factor; returns a list of dictionaries, one per scale, with
+    the number of raw records and the seconds taken by each stage
+    """
+    import tempfile
+    import make_intervals, make_histories
+
+    start = kwargs.pop("start", datetime(2023, 4, 18, 7, 0))
+    limit = start + timedelta(hours=hours)
+    rows = list()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        intervalfile = f"{tmpdir}/intervals.json.xz"
+        historyfile = f"{tmpdir}/histories.json.xz"
+        for scale in scales:
+            Raw = synthesize(start=start, hours=hours, scale=scale, **kwargs)
+            for item in Raw:
+                item[2] = eval(item[2])
+            began = time.perf_counter()
+            make_intervals.makecontactintervals(
+                Raw, filename=intervalfile, start=start, limit=limit
+            )
+            middle = time.perf_counter()
+            make_histories.makehistory(intervalfile, historyfile)
+            done = time.perf_counter()
+            rows.append({"scale": scale, "records": len(Raw),
+                         "intervals": middle - began, "histories": done - middle})
+            print("scale", scale, rows[-1])
+    return rows
+
+
+if __name__ == "__main__":
+    # write one synthetic shift, optionally scaled, e.g.
+    #   python code/synthetic.py 5 24   (5x the badges, 24 hours)
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 12
+    Raw = synthesize(scale=scale, hours=hours)
+    filename = f"{DATA_DIR}/synthetic_x{scale:g}_{hours:g}h.xz"
+    writeraw(Raw, filename)
+    print("saved", len(Raw), "synthetic records to", filename)
@@ -1,6 +1,5 @@
 import sys
 import os
-import lzma
 import json
 import numpy as np
 from datetime import datetime, timedelta
@@ -10,16 +9,12 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import numpy as np
 from scipy import stats
-import extractspread
+import instrument
+import codec
 import gc
 DATA_DIR = 'data'
 SUPP_DIR = 'supp'
 FIG_DIR = 'figures'
-# table of anchors that are in patient rooms
-# maps badge -> (roomnumber,role) where role is one of "door",
-#               "computer", "vitals", "sink"
-AnchorTable = extractspread.getAnchors(SUPP_DIR)
-
 careabout = "n pr ss vitals sink computer door anchor unknown".split()
 
 
@@ -61,21 +56,22 @@ def plotbybucket(shiftcount):
         count[tenminslot] = shiftcount[(
             shift, tenminslot)] + count.get(tenminslot, 0)
     # from total to mean
-    meancount = {h: count[h]/14.0 for h in count}
+    nshifts = len({shift for shift, tenminslot in shiftcount})
+    meancount = {h: count[h]/nshifts for h in count}
     print("periods for mean", list(sorted(meancount.keys())))
     fig = plt.figure()
     ax = fig.add_subplot(111)
     ax.set_ylabel('mean number of badges', loc="center", fontsize=10)
     ax.set_xlabel('ten-minute period in day [0-147]')
     ax.set_xlim(0, 148)  # 148 = 24 * 6 because six ten-minute periods per hour
-    x = list(range(7*6))  # 42 = six periods per hour, up to 7am.
+    x = [h for h in range(7*6) if h in meancount]  # 42 = six periods per hour, up to 7am.
     y = [meancount[h] for h in x]
     ax.plot(x, y, 's', color='b')
-    x = list(range(19*6, 148))  # from 7pm to midnite
+    x = [h for h in range(19*6, 148) if h in meancount]  # from 7pm to midnite
     y = [meancount[h] for h in x]
     ax.plot(x, y, 's', color='b')
     # plt.savefig("dayniteTen.png")
-    x = list(range(7*6, 19*6))  # from 7am to 7pm
+    x = [h for h in range(7*6, 19*6) if h in meancount]  # from 7am to 7pm
     y = [meancount[h] for h in x]
     ax.plot(x, y, 'o', color='c')
     savepath = f"{FIG_DIR}/dayniteTen.png"
@@ -86,23 +82,32 @@ def plotbybucket(shiftcount):
 def make_shift(shift):
     # change fname as needed depending on your directory structure
     fname = "histories{0:02d}.json".format(shift)
-    with lzma.open(f"{DATA_DIR}/histories/{fname}.xz", mode='rb') as F:
-        T = json.load(F)
+    with instrument.span("make_shift", shift=shift) as sp:
+        T = json.loads(codec.readbytes(f"{DATA_DIR}/histories/{fname}.xz"))
         K = [(eval(i.replace("datetime.datetime", "datetime")), j)
              for i, j in T.items()]
         T = OrderedDict(sorted(K))
+        sp.count("seconds", len(T))
     return T
 
 
-if __name__ == "__main__":
+def validate(shifts=range(1, 15)):
+    # ten-minute counts of badges with contacts, over shifts, and their plot
     contactotals = dict()
-    for i in range(1, 15):  # shift 1 through shift 14
+    for i in shifts:
         M = make_shift(i)
         print("got shift", i)
         # for each contact, for each second, add to hour bucket
         contactsummary = dict()
-        hcwcount(M, contactsummary, i)
+        with instrument.span("hcwcount", shift=i):
+            hcwcount(M, contactsummary, i)
         contactotals.update(contactsummary)  # should not be conflict
         del M
 
-    plotbybucket(contactotals)
+    with instrument.span("plotbybucket"):
+        plotbybucket(contactotals)
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    validate()
@@ -0,0 +1,430 @@
+"""
+What-if interventions on one shift: remove or restrict HCPs and anchors
+and see how exposure, group events and reach change, without rebuilding
+intervals or hypergraphs:
+
+    E = Engine(5)
+    r = E.evaluate({"name": "no pr045", "remove": ["pr045"]})
+    r["exposure"]["pr037"], r["events"]["b143"], r["reach"]["pr045"]
+    r["top"]["reach"]                    [(badge, value), ...] top k
+    results = evaluate(5, scenarios, processes=8)
+
+A scenario is a dictionary of any of
+
+    remove       badges (HCPs or anchors) whose contacts and memberships go
+    exclude      (t1, t2) windows (datetimes or seconds) cut out of every contact
+    maxdistance  contacts measured farther than this (inches) are dropped
+    cap          {anchor: k}: at most k badges at the anchor at once, first come
+    split        [group, group]: badges of one group no longer meet the other
+    name         a label
+
+and the measures are, per badge: exposure, the seconds in contact with
+any badge (the union of each pair's intervals, as in pyramid.py);
+events, the hyperedges of repro3.py it is a member of (as analysis.py
+counts; an event keeps at least minsize members, and a split event
+becomes one per group), built from every second of the shift's history
+like the contacts, where the hypergraph stage stops after the first
+hour; and reach, for a worn badge, the worn badges
+reachable from it over the shift by time-respecting paths of contacts
+(through anchors too unless viaanchors is False): a contact [s,e)
+between u and v passes from u to v at max(s, arrival of u) if u was
+reached before e. Distances and caps apply to contacts only, events
+have no distance or occupancy.
+
+Every scenario only removes contact time, so work is kept to what it
+touches: exposure is recomputed for the pairs with a changed contact,
+event counts for the hyperedges holding a removed or split member, and
+reach only for sources whose earliest arrivals used a removed contact,
+and for those only from the first time one did (arrivals before it
+stand). Scenarios run on a process pool, each worker with a copy of
+the baseline.
+
+    python code/whatif.py [shift] [--processes P]    (hub scenarios, and every HCP removed)
+"""
+
+import sys, time
+from multiprocessing import Pool
+import numpy as np
+import badgeids
+import contactquery
+import pyramid
+import shiftcache
+import centrality
+import instrument
+
+INF = np.inf
+
+
+def arrivals(A, lo, hi, start, end):
+    """
+    Earliest arrivals, in place: A is nodes x sources (seconds, INF if
+    not reached), the edges are contacts [start,end) of lo and hi. One
+    pass over the starts and ends of contacts and the finite arrivals
+    of A, in time order (ends first at equal times): the sources that
+    reached a node are bits of a Python int, and whenever a contact
+    starts or a node is reached, what its ends hold spreads through the
+    contacts active at that moment. Returns the number of arrivals found
+    """
+    END, START, REACH = range(3)
+    nodes = len(A)
+    events = [(e, END, u, v) for u, v, e in zip(lo.tolist(), hi.tolist(), end.tolist())]
+    events += [(s, START, u, v) for u, v, s in zip(lo.tolist(), hi.tolist(), start.tolist())]
+    N, J = np.nonzero(A < INF)
+    events += [(t, REACH, n, j) for n, j, t in zip(N.tolist(), J.tolist(), A[N, J].tolist())]
+    events.sort()
+    bits = [0] * nodes
+    active = [dict() for _ in range(nodes)]  # node -> {other: contacts now}
+    found = 0
+
+    def reached(node, new, t):
+        # record the sources of bits new as reaching node at t
+        nonlocal found
+        bits[node] |= new
+        while new:
+            low = new & -new
+            j = low.bit_length() - 1
+            A[node, j] = min(A[node, j], t)
+            new ^= low
+            found += 1
+
+    for t, kind, x, y in events:
+        if kind == END:
+            for a, b in ((x, y), (y, x)):
+                active[a][b] -= 1
+                if not active[a][b]:
+                    del active[a][b]
+            continue
+        if kind == START:
+            active[x][y] = active[x].get(y, 0) + 1
+            active[y][x] = active[y].get(x, 0) + 1
+            queue = [x, y]
+        else:
+            if bits[x] >> y & 1:
+                continue
+            reached(x, 1 << y, t)
+            queue = [x]
+        while queue:  # spread through the contacts active at t
+            a = queue.pop()
+            for b in active[a]:
+                new = bits[a] & ~bits[b]
+                if new:
+                    reached(b, new, t)
+                    queue.append(b)
+    return found
+
+
+class Engine(object):
+    """
+    Baseline of one shift: contact records (compact intervals), merged
+    pair intervals, hyperedge incidence, and the baseline measures
+    """
+
+    def __init__(self, n, minsize=3, viaanchors=True, k=10):
+        self.n, self.minsize, self.viaanchors, self.k = n, minsize, viaanchors, k
+        registry = shiftcache.CACHE.registry
+        self.registry = registry
+        A = shiftcache.get_shift(n, "intervals")
+        self.lo = np.minimum(A["badge"], A["other"]).astype(np.int64)
+        self.hi = np.maximum(A["badge"], A["other"]).astype(np.int64)
+        self.start = A["start"].astype(np.int64)
+        self.end = self.start + A["duration"]
+        self.distance = A["distance"]
+        self.origin = int(self.start.min())
+        self.nodes = len(registry)
+        self.pairkey = self.lo * self.nodes + self.hi
+        self.pairs, self.pairof = np.unique(self.pairkey, return_inverse=True)
+        # merged intervals of each pair, and their seconds
+        self.merged = self.merge(np.ones(len(self.lo), dtype=bool))
+        self.pairseconds = np.bincount(self.merged[4], weights=self.merged[3] - self.merged[2],
+                                       minlength=len(self.pairs))
+        self.exposure = self.badgesums(np.arange(len(self.pairs)), self.pairseconds)
+        # hyperedges: members in CSR, and the events of each member
+        # of every second of the shift, as exposure and reach (the stage has the first hour)
+        H = shiftcache.get_shift(n, "history")
+        when, offsets, members = centrality.historyedges(H)
+        sizes = np.diff(offsets)
+        keep = sizes >= minsize
+        self.members = members[np.repeat(keep, sizes)].astype(np.int64)
+        self.offsets = np.r_[0, np.cumsum(sizes[keep])]
+        self.eventof = np.repeat(np.arange(keep.sum()), sizes[keep])
+        self.eventtime = H.seconds[when[keep]]
+        self.events = np.bincount(self.members, minlength=self.nodes)
+        # reach: sources are the worn badges with contacts
+        worn = registry.roles[: self.nodes] != badgeids.ANCHOR
+        present = np.zeros(self.nodes, dtype=bool)
+        present[self.lo], present[self.hi] = True, True
+        self.worn = worn
+        self.sources = np.flatnonzero(worn & present)
+        with instrument.span("whatif-baseline", shift=n, edges=len(self.merged[0])):
+            self.arrival = self.reachfrom(self.merged, self.sources)
+        self.reach = self.reachcounts(self.arrival)
+
+    def merge(self, keep, extra=None):
+        # merged pair intervals (lo, hi, start, end, pair) of kept records and extra pieces
+        lo, hi, start, end = self.lo[keep], self.hi[keep], self.start[keep], self.end[keep]
+        if extra is not None:
+            lo, hi, start, end = (np.concatenate([x, y]) for x, y in zip((lo, hi, start, end), extra))
+        if len(lo) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, empty, empty
+        lo, hi, start, end = pyramid.mergepairs(lo, hi, start, end)
+        pair = np.searchsorted(self.pairs, lo * self.nodes + hi)
+        order = np.argsort(start, kind="stable")
+        return lo[order], hi[order], start[order], end[order], pair[order]
+
+    def badgesums(self, pairs, values):
+        # per badge sums of values of pairs (indices), over both badges of each pair
+        S = np.zeros(self.nodes)
+        np.add.at(S, self.pairs[pairs] // self.nodes, values)
+        np.add.at(S, self.pairs[pairs] % self.nodes, values)
+        return S
+
+    def usable(self, M):
+        # edges of merged intervals M that carry reach
+        if self.viaanchors:
+            return np.ones(len(M[0]), dtype=bool)
+        return self.worn[M[0]] & self.worn[M[1]]
+
+    def reachfrom(self, M, sources, A=None, after=None):
+        # arrivals (nodes x sources) over merged edges M, from A if given
+        if A is None:
+            A = np.full((self.nodes, len(sources)), INF)
+            A[sources, np.arange(len(sources))] = self.origin
+        use = self.usable(M)
+        if after is not None:
+            use &= M[3] > after
+        arrivals(A, M[0][use], M[1][use], M[2][use].astype(float), M[3][use].astype(float))
+        return A
+
+    def reachcounts(self, A):
+        # worn badges reached from each source, itself excluded
+        counts = np.zeros(self.nodes, dtype=np.int64)
+        counts[self.sources] = (A[self.worn] < INF).sum(axis=0) - 1
+        return counts
+
+    def ids(self, names):
+        return np.array([self.registry.ids[b] for b in names if b in self.registry.ids], dtype=np.int64)
+
+    def apply(self, scenario):
+        """
+        The contacts of a scenario: (keep, pieces), keep a mask of the
+        records and pieces the (lo, hi, start, end) arrays of the parts
+        of excluded-window records that are left
+        """
+        keep = np.ones(len(self.lo), dtype=bool)
+        removed = self.ids(scenario.get("remove", ()))
+        if len(removed):
+            keep &= ~np.isin(self.lo, removed) & ~np.isin(self.hi, removed)
+        if "maxdistance" in scenario:
+            keep &= self.distance <= scenario["maxdistance"]
+        if "split" in scenario:
+            a, b = (np.isin(np.arange(self.nodes), self.ids(g)) for g in scenario["split"])
+            keep &= ~((a[self.lo] & b[self.hi]) | (b[self.lo] & a[self.hi]))
+        for anchor, k in scenario.get("cap", {}).items():
+            keep &= self.capmask(self.registry.ids.get(anchor), k, keep)
+        pieces = [np.zeros(0, dtype=np.int64)] * 4
+        windows = [tuple(map(contactquery.toseconds, w)) for w in scenario.get("exclude", ())]
+        if windows:
+            hit = np.zeros(len(self.lo), dtype=bool)
+            for t1, t2 in windows:
+                hit |= (self.start < t2) & (self.end > t1)
+            pieces = self.cutpieces(windows, np.flatnonzero(keep & hit))
+            keep &= ~hit  # records cut by a window come back as pieces
+        return keep, pieces
+
+    def cutpieces(self, windows, idx):
+        # what is left of records idx outside all windows, as (lo, hi, start, end)
+        lo, hi, start, end = self.lo[idx], self.hi[idx], self.start[idx], self.end[idx]
+        for t1, t2 in windows:
+            cut = (start < t2) & (end > t1)
+            left, right = cut & (start < t1), cut & (end > t2)
+            lo = np.concatenate([lo[~cut], lo[left], lo[right]])
+            hi = np.concatenate([hi[~cut], hi[left], hi[right]])
+            start, end = (np.concatenate([start[~cut], start[left], np.full(right.sum(), t2)]),
+                          np.concatenate([end[~cut], np.full(left.sum(), t1), end[right]]))
+        return lo, hi, start, end
+
+    def capmask(self, anchor, k, keep):
+        # records kept when at most k badges are at anchor at once, first come
+        mask = np.ones(len(self.lo), dtype=bool)
+        if anchor is None:
+            return mask
+        idx = np.flatnonzero(keep & ((self.lo == anchor) | (self.hi == anchor)))
+        idx = idx[np.argsort(self.start[idx], kind="stable")]
+        present = dict()  # badge -> end of its admitted time
+        for i in idx.tolist():
+            badge = int(self.hi[i] if self.lo[i] == anchor else self.lo[i])
+            s, e = int(self.start[i]), int(self.end[i])
+            for other in [b for b, end in present.items() if end <= s]:
+                del present[other]
+            if badge in present or len(present) < k:
+                present[badge] = max(present.get(badge, e), e)
+            else:
+                mask[i] = False
+        return mask
+
+    def evaluate(self, scenario):
+        """
+        Measures of a scenario: a dictionary with name, exposure, events
+        and reach (badge -> value, badges with a nonzero baseline or
+        scenario value), top (measure -> top k), totals, and counts of
+        the work done (pairs, events and sources recomputed)
+        """
+        began = time.perf_counter()
+        keep, pieces = self.apply(scenario)
+        hitpairs = np.unique(self.pairof[~keep])  # cut records are among them
+        # exposure: only pairs with a changed record
+        inpairs = np.isin(self.pairof, hitpairs)
+        M = self.merge(keep & inpairs, pieces)
+        seconds = np.bincount(M[4], weights=M[3] - M[2], minlength=len(self.pairs))[hitpairs]
+        exposure = self.exposure - self.badgesums(hitpairs, self.pairseconds[hitpairs]) \
+            + self.badgesums(hitpairs, seconds)
+        events, nevents = self.eventcounts(scenario)
+        reach, nsources = self.reachafter(M, hitpairs)
+        result = {"name": scenario.get("name", ""), "scenario": scenario}
+        named = lambda V: {self.registry.name(i): V[i].item() for i in np.flatnonzero(V)}
+        result["exposure"] = named(np.round(exposure).astype(np.int64))
+        result["events"], result["reach"] = named(events), named(reach)
+        hcp = lambda V: [(self.registry.name(i), V[i].item()) for i in
+                         sorted(np.flatnonzero(self.worn & (V > 0)), key=lambda i: (-V[i], i))[: self.k]]
+        anchor = lambda V: [(self.registry.name(i), V[i].item()) for i in
+                            sorted(np.flatnonzero(~self.worn & (V > 0)), key=lambda i: (-V[i], i))[: self.k]]
+        result["top"] = {"exposure": hcp(exposure.round().astype(np.int64)), "events": hcp(events),
+                         "reach": hcp(reach), "anchors": anchor(events)}
+        result["totals"] = {"exposure_hours": float(exposure[self.worn].sum()) / 3600,
+                            "events": int(events.sum()), "reach": float(reach[self.sources].mean())}
+        result["work"] = {"pairs": len(hitpairs), "events": nevents, "sources": nsources,
+                          "seconds": time.perf_counter() - began}
+        return result
+
+    def eventcounts(self, scenario):
+        # memberships per badge with the scenario's removals, windows and split
+        out = np.zeros(self.nodes, dtype=bool)
+        out[self.ids(scenario.get("remove", ()))] = True
+        nevents = len(self.offsets) - 1
+        dropped = np.zeros(nevents, dtype=bool)  # events within a window
+        for t1, t2 in scenario.get("exclude", ()):
+            t1, t2 = contactquery.toseconds(t1), contactquery.toseconds(t2)
+            dropped |= (self.eventtime >= t1) & (self.eventtime < t2)
+        touched = dropped.copy()
+        touched[self.eventof[out[self.members]]] = True
+        groups = [np.isin(np.arange(self.nodes), self.ids(g)) for g in scenario.get("split", ())]
+        if groups:  # events with members of both groups left
+            ga, gb = (g[self.members] & ~out[self.members] for g in groups)
+            split = (np.bincount(self.eventof, weights=ga, minlength=nevents) > 0) & \
+                    (np.bincount(self.eventof, weights=gb, minlength=nevents) > 0)
+            touched |= split
+        # memberships of touched events out, then those of what is left of them back in
+        entries = touched[self.eventof]
+        counts = self.events - np.bincount(self.members[entries], minlength=self.nodes)
+        left = entries & ~dropped[self.eventof] & ~out[self.members]
+        parts = [left]
+        if groups:
+            split = split[self.eventof]
+            parts = [left & ~(split & gb), left & split & ~ga]
+        for P in parts:
+            size = np.bincount(self.eventof, weights=P, minlength=nevents)
+            P &= size[self.eventof] >= self.minsize
+            counts += np.bincount(self.members[P], minlength=self.nodes)
+        return counts, int(touched.sum())
+
+    def reachafter(self, M, hitpairs):
+        """
+        Reach with the merged intervals of hitpairs replaced by M: sources
+        whose earliest arrivals used a removed contact are swept again
+        from the first such arrival, the others keep their baseline
+        """
+        B = self.merged
+        old = np.isin(B[4], hitpairs)
+        oldkeys = set(zip(*(X[old].tolist() for X in B[:4])))
+        newkeys = set(zip(*(X.tolist() for X in M[:4])))
+        gone = oldkeys - newkeys
+        if not self.viaanchors:
+            gone = [g for g in gone if self.worn[g[0]] and self.worn[g[1]]]
+        A = self.arrival
+        redo = np.full(len(self.sources), INF)  # first arrival a removed contact gave, per source
+        for u, v, s, e in gone:
+            for a, b in ((u, v), (v, u)):
+                got = np.where(A[a] < e, np.maximum(A[a], s), INF)
+                used = (got == A[b]) & (got < INF)
+                redo[used] = np.minimum(redo[used], got[used])
+        again = np.flatnonzero(redo < INF)
+        if len(again) == 0:
+            return self.reach.copy(), 0
+        R = A[:, again].copy()
+        R[R >= redo[again]] = INF
+        R[self.sources[again], np.arange(len(again))] = self.origin
+        edges = tuple(np.concatenate([X[~old], Y]) for X, Y in zip(B, M))
+        order = np.argsort(edges[2], kind="stable")
+        edges = tuple(X[order] for X in edges)
+        self.reachfrom(edges, self.sources[again], R, after=redo[again].min())
+        reach = self.reach.copy()
+        reach[self.sources[again]] = (R[self.worn] < INF).sum(axis=0) - 1
+        return reach, len(again)
+
+
+_engine = None  # Engine of a worker process
+
+
+def _prepare(engine):
+    global _engine
+    _engine = engine
+
+
+def _evaluate(scenario):
+    return _engine.evaluate(scenario)
+
+
+def evaluate(n, scenarios, processes=None, engine=None, **kwargs):
+    # results of scenarios on shift n, on a pool sharing one baseline
+    engine = engine or Engine(n, **kwargs)
+    with Pool(processes, initializer=_prepare, initargs=(engine,)) as pool:
+        return pool.map(_evaluate, scenarios, chunksize=max(1, len(scenarios) // (4 * (processes or 8))))
+
+
+def hubscenarios(engine, hubs=("pr045", "pr037", "b004", "b143")):
+    # the scenarios of the main block: hubs, restrictions, and every HCP removed
+    S = [{"name": "baseline"}]
+    S += [{"name": f"remove {h}", "remove": [h]} for h in hubs]
+    S.append({"name": "remove hubs", "remove": list(hubs)})
+    S.append({"name": "cap b143 at 2", "cap": {"b143": 2}})
+    S.append({"name": "cap b004 at 2", "cap": {"b004": 2}})
+    S.append({"name": "contacts within 48in", "maxdistance": 48})
+    first = contactquery.todatetime(engine.origin - engine.origin % 3600)
+    S.append({"name": "no contacts hour 3", "exclude": [(contactquery.toseconds(first) + 2 * 3600,
+                                                        contactquery.toseconds(first) + 3 * 3600)]})
+    names = [engine.registry.name(i) for i in engine.sources]
+    S.append({"name": "split nurses/providers", "split": [[b for b in names if b.startswith("n")],
+                                                         [b for b in names if b.startswith("pr")]]})
+    S += [{"name": f"remove {b}", "remove": [b]} for b in names]
+    return S
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    args = sys.argv[1:]
+    processes = None
+    if "--processes" in args:
+        i = args.index("--processes")
+        processes = int(args[i + 1])
+        del args[i : i + 2]
+    n = int(args[0]) if args else 5
+    began = time.perf_counter()
+    E = Engine(n)
+    print(f"shift {n}: baseline in {time.perf_counter() - began:.1f}s, "
+          f"{len(E.merged[0])} merged contacts, {len(E.sources)} sources")
+    scenarios = hubscenarios(E)
+    began = time.perf_counter()
+    results = evaluate(n, scenarios, processes, engine=E)
+    print(f"{len(results)} scenarios in {time.perf_counter() - began:.1f}s")
+    base = results[0]["totals"]
+    print(f"{'scenario':28s} {'exposure h':>10s} {'events':>8s} {'reach':>6s}  top reach")
+    for r in results[:11]:
+        T = r["totals"]
+        print(f"{r['name']:28s} {T['exposure_hours']:10.1f} {T['events']:8d} {T['reach']:6.1f}  "
+              + " ".join(f"{b}:{v}" for b, v in r["top"]["reach"][:3]))
+    single = sorted(results[11:], key=lambda r: r["totals"]["reach"])[:5]
+    print("single removals that most lower mean reach:")
+    for r in single:
+        print(f"  {r['name']:26s} reach {r['totals']['reach']:.1f} "
+              f"(baseline {base['reach']:.1f}), events {r['totals']['events']}")
@@ -3,11 +3,13 @@ import pandas as pd
 from collections import Counter
 import sys
 import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import codec
 
-def analyze(shift_arg):
-    input_file = 'spatial_hypergraph_final.json'
-    output_file_hcp = f'hcp_risk_shift_{shift_arg}.csv'
-    output_file_anchor = f'anchor_risk_shift_{shift_arg}.csv'
+def analyze(shift_arg, input_file='spatial_hypergraph_final.json', outdir='.'):
+    output_file_hcp = os.path.join(outdir, f'hcp_risk_shift_{shift_arg}.csv')
+    output_file_anchor = os.path.join(outdir, f'anchor_risk_shift_{shift_arg}.csv')
 
     if not os.path.exists(input_file):
         print(f"[ERROR] File '{input_file}' not found for Shift {shift_arg}!")
@@ -15,7 +17,7 @@ def analyze(shift_arg):
 
     # Read JSON data
     try:
-        with open(input_file, 'r') as f:
+        with codec.openfile(input_file, 'rt') as f, instrument.span("load", shift=shift_arg):
             data = json.load(f)
     except json.JSONDecodeError as e:
         print(f"[ERROR] Failed to read JSON: {e}")
@@ -23,17 +25,15 @@ def analyze(shift_arg):
 
     print(f"--- Analyzing Risk for Shift {shift_arg} ({len(data)} Hyper-events) ---")
 
-    # Collect all members
-    all_members = []
-    spatial_events_count = 0
+    # Count members event by event (no list of all members)
+    with instrument.span("count", shift=shift_arg, events=len(data)):
+        member_counts = Counter()
+        spatial_events_count = 0
 
-    for event in data:
-        members = event.get('members', [])
-        all_members.extend(members)
-        if event.get('centroid_location') is not None:
-            spatial_events_count += 1
-
-    member_counts = Counter(all_members)
+        for event in data:
+            member_counts.update(event.get('members', []))
+            if event.get('centroid_location') is not None:
+                spatial_events_count += 1
 
     # Separate HCPs and Anchors
     hcp_centrality = {k: v for k, v in member_counts.items() if not k.startswith('b')}
@@ -65,6 +65,7 @@ def analyze(shift_arg):
         df_anchor = pd.DataFrame(columns=['Anchor_ID', 'Usage_Count'])  # empty placeholder
 
 if __name__ == "__main__":
+    instrument.configure(sys.argv)
     if len(sys.argv) != 2:
         print("Usage: python analysis.py <shift_number>")
         sys.exit(1)
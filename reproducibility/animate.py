@@ -0,0 +1,175 @@
+import cv2
+import numpy as np
+import os
+import sys
+from multiprocessing import Pool
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import layout
+import badgeids
+import make_intervals
+import localize
+import pyramid
+import sharedshifts
+import contactquery
+
+"""
+Time-lapse of a shift on the ICU layout, one frame every step seconds
+(a minute by default), each showing at that moment
+
+    anchor occupancy    a circle at each anchor, its size the number of
+                        worn badges in contact over the step before
+    badge positions     a dot for each worn badge placed by localize.py,
+                        colored by role
+    hyperedges          lines between worn badges in contact, and the
+                        outline of each group of three or more
+
+Frame contents are computed in this process from the compact arrays of
+badgeids.py and localize.py (occupancy for all seconds at once, as a
+running sum of the starts and ends of each anchor and badge's intervals,
+merged by pyramid.mergepairs); the layout image and anchor
+positions are prepared once and handed to the pool's workers, which
+only draw and write the frames. With video, the frames are then joined
+into an mp4 file.
+
+    python reproducibility/animate.py 5 [step] [--video]
+"""
+
+REPRO_DIR = os.path.dirname(os.path.abspath(__file__))
+ROLECOLORS = {badgeids.NURSE: (200, 80, 0), badgeids.PROVIDER: (0, 140, 0),
+              badgeids.SUPPORT: (160, 0, 160), badgeids.UNKNOWN: (90, 90, 90)}
+
+
+def occupancy(intervals, registry, first, last):
+    # (seconds, anchors) count of distinct worn badges in contact with each anchor
+    A = intervals[(intervals['flags'] & make_intervals.ANCHOR) != 0]
+    isanchor = registry.roles[A['badge']] == badgeids.ANCHOR
+    anchor = np.where(isanchor, A['badge'], A['other']).astype(np.int64)
+    worn = np.where(isanchor, A['other'], A['badge']).astype(np.int64)
+    keep = registry.roles[worn] != badgeids.ANCHOR
+    start = A['start'].astype(np.int64)
+    end = start + A['duration']
+    # one record per direction, overlapping records: union each pair first
+    anchor, worn, start, end = pyramid.mergepairs(anchor[keep], worn[keep], start[keep], end[keep])
+    count = np.zeros((last - first + 1, len(registry)), dtype=np.int32)
+    start = np.clip(start - first, 0, last - first)
+    end = np.clip(end - first, 0, last - first)
+    np.add.at(count, (start, anchor), 1)
+    np.add.at(count, (end, anchor), -1)
+    return np.cumsum(count, axis=0)[:-1]
+
+
+def groups(pairs):
+    # connected groups of badges from a list of contact pairs
+    parent = dict()
+
+    def find(a):
+        while parent.setdefault(a, a) != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    for a, b in pairs:
+        parent[find(a)] = find(b)
+    G = dict()
+    for a in parent:
+        G.setdefault(find(a), list()).append(a)
+    return list(G.values())
+
+
+def framedata(n, step=60, registry=None):
+    """
+    List of frames of shift n: each a dictionary with time (datetime),
+    occupancy (anchor name -> badges over the step), dots (x,y,role),
+    lines ((x,y),(x,y)) and hulls (list of (x,y), groups of 3 or more)
+    """
+    registry = registry or badgeids.Registry.load()
+    intervals = sharedshifts.loadintervals(n, registry)
+    track = localize.loadtrack(n, registry)
+    first = int(intervals['start'].min())
+    last = int((intervals['start'] + intervals['duration']).max())
+    count = occupancy(intervals, registry, first, last)
+    worn = (intervals['flags'] & make_intervals.ANCHOR) == 0
+    W = intervals[worn]
+    frames = list()
+    for t in range(first + step, last, step):
+        window = count[t - step - first : t - first]
+        busy = np.nonzero(window.max(axis=0))[0]
+        here = track[(track['start'] <= t) & (track['end'] > t)]
+        where = {int(b): (float(x), float(y)) for b, x, y in zip(here['badge'], here['x'], here['y'])}
+        now = W[(W['start'] <= t) & (W['start'] + W['duration'] > t)]
+        pairs = {(int(a), int(b)) for a, b in zip(now['badge'], now['other'])
+                 if a in where and b in where}
+        frames.append({
+            'time': contactquery.todatetime(t),
+            'occupancy': {registry.name(a): int(window[:, a].max()) for a in busy},
+            'dots': [(x, y, registry.role(b)) for b, (x, y) in where.items()],
+            'lines': [(where[a], where[b]) for a, b in pairs],
+            'hulls': [[where[b] for b in g] for g in groups(pairs) if len(g) >= 3],
+        })
+    return frames
+
+
+_base = None  # (image, anchor coordinates) in each worker
+
+
+def _prepare(img_file, yaml_file):
+    global _base
+    image = cv2.imread(img_file)
+    image = cv2.addWeighted(image, 0.5, np.full_like(image, 255), 0.5, 0)  # fade the drawing
+    _base = image, layout.anchorcoords(yaml_file)
+
+
+def drawframe(task):
+    # draw one frame and write it to filename
+    frame, filename = task
+    image, coords = _base
+    out = image.copy()
+    for anchor, k in frame['occupancy'].items():
+        if anchor in coords:
+            x, y = coords[anchor]
+            cv2.circle(out, (int(x), int(y)), 4 + 3 * k, (0, 0, 255), 1, cv2.LINE_AA)
+    for hull in frame['hulls']:
+        points = cv2.convexHull(np.array(hull, dtype=np.int32))
+        cv2.polylines(out, [points], True, (0, 165, 255), 2, cv2.LINE_AA)
+    for (x1, y1), (x2, y2) in frame['lines']:
+        cv2.line(out, (int(x1), int(y1)), (int(x2), int(y2)), (0, 165, 255), 1, cv2.LINE_AA)
+    for x, y, role in frame['dots']:
+        cv2.circle(out, (int(x), int(y)), 4, ROLECOLORS.get(role, (90, 90, 90)), -1, cv2.LINE_AA)
+    cv2.putText(out, frame['time'].strftime('%Y-%m-%d %H:%M'), (10, 25),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+    cv2.imwrite(filename, out)
+    return filename
+
+
+def animate(n, step=60, outdir=None, video=False, fps=10, processes=None,
+            img_file='figures/iculayout.png', yaml_file='supp/placement005.yaml'):
+    # frames of shift n as PNG files in outdir (and an mp4); returns the files
+    outdir = outdir or os.path.join(REPRO_DIR, 'figures', 'animation', f'shift{n:02d}')
+    os.makedirs(outdir, exist_ok=True)
+    with instrument.span("framedata", shift=n) as sp:
+        frames = framedata(n, step)
+        sp.count("frames", len(frames))
+    tasks = [(frame, os.path.join(outdir, f'frame_{i:04d}.png')) for i, frame in enumerate(frames)]
+    with instrument.span("draw", shift=n):
+        with Pool(processes, initializer=_prepare, initargs=(img_file, yaml_file)) as pool:
+            files = pool.map(drawframe, tasks, chunksize=8)
+    if video and files:
+        with instrument.span("video", shift=n):
+            height, width = cv2.imread(files[0]).shape[:2]
+            videofile = os.path.join(outdir, f'shift{n:02d}.mp4')
+            writer = cv2.VideoWriter(videofile, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+            for filename in files:
+                writer.write(cv2.imread(filename))
+            writer.release()
+        files.append(videofile)
+    return files
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    shift = int(args[0]) if args else 2
+    step = int(args[1]) if len(args) > 1 else 60
+    files = animate(shift, step, video='--video' in sys.argv)
+    print(f"{len(files)} files written to {os.path.dirname(files[0])}" if files else "no frames")
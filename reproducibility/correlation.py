@@ -1,10 +1,14 @@
 import json
 import pandas as pd
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import codec
 
-def map_top_hcp_hotspots():
-    report_file = 'final_hyperhai_risk_report.csv'
-    json_file = 'spatial_hypergraph_final.json'
+def map_top_hcp_hotspots(report_file='final_hyperhai_risk_report.csv',
+                         json_file='spatial_hypergraph_final.json',
+                         output_file='top_hcp_hotspots.csv'):
     
     # 1. Load Top 10 HCP IDs from the final report
     if not os.path.exists(report_file):
@@ -26,7 +30,7 @@ def map_top_hcp_hotspots():
         print(f"[ERROR] File '{json_file}' not found!")
         return
 
-    with open(json_file, 'r') as f:
+    with codec.openfile(json_file, 'rt') as f, instrument.span("load"):
         try:
             hyper_data = json.load(f)
         except json.JSONDecodeError as e:
@@ -53,8 +57,10 @@ def map_top_hcp_hotspots():
     print("\n--- Locations of High-Risk Interactions (Top 10 HCP) ---")
     print(df_hotspots.head(5))
 
-    df_hotspots.to_csv('top_hcp_hotspots.csv', index=False)
-    print("\n[SUCCESS] Interaction hotspots saved to 'top_hcp_hotspots.csv'")
+    df_hotspots.to_csv(output_file, index=False)
+    print(f"\n[SUCCESS] Interaction hotspots saved to '{output_file}'")
 
 if __name__ == "__main__":
-    map_top_hcp_hotspots()
+    instrument.configure(sys.argv)
+    with instrument.span("hotspots"):
+        map_top_hcp_hotspots()
@@ -1,10 +1,12 @@
 import pandas as pd
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+
+def generate_key_findings(report_file='final_hyperhai_risk_report.csv',
+                          hotspot_file='top_hcp_hotspots.csv'):
 
-def generate_key_findings():
-    report_file = 'final_hyperhai_risk_report.csv'
-    hotspot_file = 'top_hcp_hotspots.csv'
-    
     if not os.path.exists(report_file) or not os.path.exists(hotspot_file):
         print("[ERROR] Make sure the files 'final_hyperhai_risk_report.csv' and 'top_hcp_hotspots.csv' exist.")
         return
@@ -33,4 +35,6 @@ def generate_key_findings():
     print(f"   high-risk clusters across at least 10 out of 14 shifts analyzed.")
 
 if __name__ == "__main__":
-    generate_key_findings()
+    instrument.configure(sys.argv)
+    with instrument.span("findings"):
+        generate_key_findings()
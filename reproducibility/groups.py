@@ -0,0 +1,243 @@
+import json
+import os
+import sys
+from collections import Counter
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import codec
+import layout
+import make_intervals
+import contactquery
+
+"""
+Groups of worn badges in contact, as hyperedges. repro.py unions all
+badges with contacts in a second into one set, and repro3.py emits
+every badge's ego-set [badge] + contacts, so that one group of four is
+counted four times; here a group is a connected component of the graph
+of worn badges in contact at that second (or, with cliques, each
+maximal clique of one), and each spell of a group with fixed members
+is one hyperedge.
+
+Contacts change only where contact intervals start or end, so the
+components are kept from one such time to the next rather than found
+anew each second: added edges merge components (union by size, the
+smaller set relabelled), and a removed edge only has its own component
+searched again for a split. Anchors do not join groups (one anchor in a
+hallway would join everyone near it); the anchors in contact with a
+group's members during a spell are listed with its members, as in the
+hypergraph of repro3.py, and their mean position (layout.py pixels) is
+its centroid_location. A hyperedge is
+
+    {'time_t': seconds from the first interval, 'duration': seconds,
+     'members': worn badges then anchors, 'centroid_location': (x,y)}
+
+so analysis.py and stability.py can read the output as they read the
+spatial hypergraph.
+
+    python reproducibility/groups.py 02 [--cliques]
+"""
+
+
+def edgeevents(records):
+    """
+    Map seconds -> list of (delta, a, b): a contact of worn badges a < b
+    (or of worn badge a and anchor b) begins (+1) or ends (-1) then
+    """
+    events = dict()
+    for item in records:
+        start = contactquery.toseconds(item[2])
+        pairs = {(min(p), max(p)) for p in make_intervals.directions(item)}
+        for a, b in pairs:
+            if a.startswith("b"):
+                a, b = b, a  # anchor second
+            if a.startswith("b"):
+                continue
+            events.setdefault(start, list()).append((1, a, b))
+            events.setdefault(start + item[4], list()).append((-1, a, b))
+    return events
+
+
+def maximalcliques(adjacency, members):
+    # Bron-Kerbosch with pivot, over the subgraph of members
+    cliques = list()
+
+    def expand(R, P, X):
+        if not P and not X:
+            cliques.append(R)
+            return
+        pivot = max(P | X, key=lambda u: len(adjacency[u].keys() & P))
+        for v in list(P - adjacency[pivot].keys()):
+            N = adjacency[v].keys()
+            expand(R | {v}, P & N, X & N)
+            P = P - {v}
+            X = X | {v}
+
+    expand(frozenset(), set(members), set())
+    return cliques
+
+
+class Groups(object):
+    """
+    Components of the contact graph of worn badges, kept up to date by
+    step(t, changes); hyperedges of closed spells accumulate in
+    self.hyperedges
+    """
+
+    def __init__(self, origin, coords, minsize=3, cliques=False):
+        self.origin, self.coords = origin, coords
+        self.minsize, self.cliques = minsize, cliques
+        self.adjacency = dict()  # badge -> Counter of worn badges in contact
+        self.anchors = dict()  # badge -> Counter of anchors in contact
+        self.component = dict()  # badge -> set of its component, if it has contacts
+        self.open = dict()  # frozenset of members -> spell
+        self.spells = dict()  # badge -> open spells (their members) it is in
+        self.hyperedges = list()
+
+    def merge(self, a, b):
+        A = self.component.setdefault(a, {a})
+        B = self.component.setdefault(b, {b})
+        if A is B:
+            return
+        if len(A) < len(B):
+            A, B = B, A
+        A |= B
+        for badge in B:
+            self.component[badge] = A
+
+    def split(self, members):
+        # search members (one former component) again for components
+        unseen = set(members)
+        while unseen:
+            start = unseen.pop()
+            if not self.adjacency.get(start):
+                self.component.pop(start, None)
+                continue
+            C, frontier = {start}, [start]
+            while frontier:
+                for other in self.adjacency[frontier.pop()]:
+                    if other not in C:
+                        C.add(other)
+                        frontier.append(other)
+            unseen -= C
+            for badge in C:
+                self.component[badge] = C
+
+    def step(self, t, changes):
+        # apply the (delta, badge, other) contact changes at seconds t
+        touched, dirty = set(), list()
+        for delta, a, b in changes:
+            if b.startswith("b"):
+                self.anchorchange(t, delta, a, b)
+                continue
+            touched.update((a, b))
+        before = self.units(touched)
+        for delta, a, b in changes:
+            if b.startswith("b") or delta > 0:
+                continue
+            for u, v in ((a, b), (b, a)):
+                self.adjacency[u][v] -= 1
+                if self.adjacency[u][v] == 0:
+                    del self.adjacency[u][v]
+                    dirty.append(u)
+        for delta, a, b in changes:
+            if b.startswith("b") or delta < 0:
+                continue
+            for u, v in ((a, b), (b, a)):
+                self.adjacency.setdefault(u, Counter())[v] += 1
+            self.merge(a, b)
+        searched = set()  # components after the merges, of badges that lost an edge
+        for u in dirty:
+            C = self.component.get(u)
+            if C is not None and id(C) not in searched:
+                searched.add(id(C))
+                self.split(list(C))
+        after = self.units(touched)
+        for members in before - after:
+            self.close(members, t)
+        for members in after - before:
+            self.begin(members, t)
+
+    def units(self, badges):
+        # groups (components, or their maximal cliques) of at least minsize with any of badges
+        C = {frozenset(self.component[u]) for u in badges if u in self.component}
+        C = {members for members in C if len(members) >= self.minsize}
+        if not self.cliques:
+            return C
+        return {clique for members in C for clique in maximalcliques(self.adjacency, members)
+                if len(clique) >= self.minsize}
+
+    def anchorchange(self, t, delta, badge, anchor):
+        self.anchors.setdefault(badge, Counter())[anchor] += delta
+        if self.anchors[badge][anchor] == 0:
+            del self.anchors[badge][anchor]
+        elif delta > 0:
+            for members in self.spells.get(badge, ()):
+                self.open[members]["anchors"].add(anchor)
+
+    def begin(self, members, t):
+        anchors = set().union(*(self.anchors.get(u, ()) for u in members))
+        self.open[members] = {"start": t, "anchors": anchors}
+        for u in members:
+            self.spells.setdefault(u, set()).add(members)
+
+    def close(self, members, t):
+        spell = self.open.pop(members)
+        for u in members:
+            self.spells[u].discard(members)
+        if t == spell["start"]:
+            return
+        anchors = sorted(spell["anchors"])
+        points = [self.coords[a] for a in anchors if a in self.coords]
+        centroid = None
+        if points:
+            centroid = (sum(p[0] for p in points) / len(points),
+                        sum(p[1] for p in points) / len(points))
+        self.hyperedges.append({
+            "time_t": spell["start"] - self.origin,
+            "duration": t - spell["start"],
+            "members": sorted(members) + anchors,
+            "centroid_location": centroid,
+        })
+
+    def finish(self, t):
+        for members in list(self.open):
+            self.close(members, t)
+        self.hyperedges.sort(key=lambda e: (e["time_t"], e["members"]))
+        return self.hyperedges
+
+
+def detectgroups(records, coords=None, minsize=3, cliques=False):
+    # hyperedges of the groups in contact intervals (either form, datetimes)
+    coords = layout.anchorcoords() if coords is None else coords
+    events = edgeevents(records)
+    if not events:
+        return list()
+    G = Groups(min(events), coords, minsize, cliques)
+    for t in sorted(events):
+        G.step(t, events[t])
+    return G.finish(max(events))
+
+
+def build_group_hypergraph(shift='02', interval_file=None, output_path='group_hypergraph.json',
+                           placement_file='supp/placement005.yaml', minsize=3, cliques=False,
+                           output_codec='raw'):
+    if interval_file is None:
+        interval_file = f'data/contact_intervals/intervals{shift}.json.xz'
+    with instrument.span("load", shift=shift):
+        records = make_intervals.readintervals(interval_file, directed_form=False)
+    with instrument.span("groups", shift=shift) as sp:
+        hyperedges = detectgroups(records, layout.anchorcoords(placement_file), minsize, cliques)
+        sp.count("hyperedges", len(hyperedges))
+    with codec.openfile(output_path, 'wt', codec=output_codec) as out, instrument.span("serialize", shift=shift):
+        json.dump(hyperedges, out)
+    return hyperedges
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    shift_arg = args[0] if args else '02'
+    hyperedges = build_group_hypergraph(shift=shift_arg, cliques='--cliques' in sys.argv)
+    sizes = Counter(sum(1 for m in e['members'] if not m.startswith('b')) for e in hyperedges)
+    print(f"{len(hyperedges)} group hyperedges saved to group_hypergraph.json")
+    print("badges per group:", dict(sorted(sizes.items())))
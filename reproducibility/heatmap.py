@@ -0,0 +1,110 @@
+import cv2
+import numpy as np
+import pandas as pd
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import layout
+
+"""
+Heatmaps on the ICU layout from weights at positions: per-anchor counts
+(an anchor risk table of analysis.py, or any Anchor_ID/weight table), or
+per-position weights such as the seconds of a trajectory table of
+localize.py. All weights are first added into one float grid the size
+of the image (np.add.at), the grid is convolved once with a Gaussian
+kernel (cv2.filter2D), and the result is colored and blended into the
+layout once; so the cost is one pass over the points plus one over the
+image, whatever the number of anchors or positions.
+
+    python reproducibility/heatmap.py        (one figure per shift, from
+                                              anchor_risk_shift_NN.csv)
+"""
+
+REPRO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def kernel(radius):
+    # Gaussian kernel with peak 1, sigma radius/3 so that it fades out by radius
+    size = 2 * radius + 1
+    g = cv2.getGaussianKernel(size, radius / 3, cv2.CV_32F)
+    K = g @ g.T
+    return K / K.max()
+
+
+def anchorweights(table, coords, column=None):
+    """
+    (points, weights, labels) from a table of Anchor_ID and a count
+    column (by default the second column); anchors with no position
+    in coords are skipped
+    """
+    df = pd.read_csv(table) if isinstance(table, str) else table
+    column = column or df.columns[1]
+    df = df[df['Anchor_ID'].isin(coords.keys())]
+    points = np.array([coords[a] for a in df['Anchor_ID']], dtype=np.float32).reshape(-1, 2)
+    return points, df[column].to_numpy(dtype=np.float32), list(df['Anchor_ID'])
+
+
+def trackweights(track):
+    # (points, weights): positions of a trajectory table, weighted by seconds
+    points = np.stack([track['x'], track['y']], axis=1).astype(np.float32)
+    return points, (track['end'] - track['start']).astype(np.float32)
+
+
+def accumulate(shape, points, weights, radius=25):
+    # float buffer of the weights spread by the kernel, scaled to peak 1
+    height, width = shape[:2]
+    grid = np.zeros((height, width), dtype=np.float32)
+    x = np.clip(np.rint(points[:, 0]).astype(int), 0, width - 1)
+    y = np.clip(np.rint(points[:, 1]).astype(int), 0, height - 1)
+    np.add.at(grid, (y, x), weights)
+    buffer = cv2.filter2D(grid, -1, kernel(radius), borderType=cv2.BORDER_CONSTANT)
+    peak = buffer.max()
+    return buffer / peak if peak > 0 else buffer
+
+
+def composite(image, buffer, opacity=0.6, floor=0.02):
+    # blend the colored buffer into image, where it is above floor
+    colored = cv2.applyColorMap((255 * buffer).astype(np.uint8), cv2.COLORMAP_JET)
+    alpha = (opacity * np.clip(buffer / max(floor, 1e-6), 0, 1))[..., None]
+    return (image * (1 - alpha) + colored * alpha).astype(np.uint8)
+
+
+def render(image, points, weights, labels=None, top=5, radius=25, title=None):
+    # the layout image with a heatmap of weights at points, top labels named
+    out = composite(image, accumulate(image.shape, points, weights, radius))
+    if labels is not None:
+        for i in np.argsort(-weights)[:top]:
+            x, y = int(points[i][0]), int(points[i][1])
+            cv2.putText(out, labels[i], (x + 5, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+    if title:
+        cv2.putText(out, title, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+    return out
+
+
+def shiftheatmaps(shifts=range(1, 15), datadir=os.path.join(REPRO_DIR, 'data'),
+                  outdir=os.path.join(REPRO_DIR, 'figures', 'heatmaps'),
+                  img_file='figures/iculayout.png', yaml_file='supp/placement005.yaml'):
+    # one heatmap per shift from its anchor risk table; returns files written
+    image = cv2.imread(img_file)
+    coords = layout.anchorcoords(yaml_file)
+    os.makedirs(outdir, exist_ok=True)
+    written = list()
+    for n in shifts:
+        table = os.path.join(datadir, f'anchor_risk_shift_{n:02d}.csv')
+        if not os.path.exists(table):
+            continue
+        with instrument.span("render", shift=n):
+            points, weights, labels = anchorweights(table, coords)
+            if len(weights) == 0:
+                continue
+            output_file = os.path.join(outdir, f'risk_heatmap_shift_{n:02d}.png')
+            cv2.imwrite(output_file, render(image, points, weights, labels, title=f"shift {n}"))
+        written.append(output_file)
+    return written
+
+
+if __name__ == "__main__":
+    instrument.configure(sys.argv)
+    for filename in shiftheatmaps():
+        print(f"Risk heatmap saved to {filename}")
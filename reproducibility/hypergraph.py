@@ -1,24 +1,28 @@
 import json
+import os
+import sys
 import pandas as pd
 from collections import Counter
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import codec
 
 def analyze_hyperhai_risk():
     input_file = 'spatial_hypergraph_final.json'
 
-    with open(input_file, 'r') as f:
+    with codec.openfile(input_file, 'rt') as f, instrument.span("load"):
         data = json.load(f)
 
     print(f"--- Analyzing Risk from {len(data)} Hyper-events ---")
 
-    all_members = []
-    spatial_events_count = 0
+    with instrument.span("count", events=len(data)):
+        member_counts = Counter()
+        spatial_events_count = 0
 
-    for event in data:
-        all_members.extend(event['members'])
-        if event.get('centroid_location') is not None:
-            spatial_events_count += 1
-
-    member_counts = Counter(all_members)
+        for event in data:
+            member_counts.update(event['members'])
+            if event.get('centroid_location') is not None:
+                spatial_events_count += 1
 
     hcp_centrality = {k: v for k, v in member_counts.items() if not k.startswith('b')}
     anchor_centrality = {k: v for k, v in member_counts.items() if k.startswith('b')}
@@ -40,4 +44,5 @@ def analyze_hyperhai_risk():
     print("\n[SUCCESS] Risk analysis results saved to 'hcp_risk_ranking.csv'")
 
 if __name__ == "__main__":
+    instrument.configure(sys.argv)
     analyze_hyperhai_risk()
\ No newline at end of file
@@ -1,10 +1,14 @@
 import pandas as pd
 import glob
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
 
-def generate_final_report():
+def generate_final_report(all_files=None, output_file='final_hyperhai_risk_report.csv'):
     # 1. Find all per-shift HCP risk files
-    all_files = glob.glob('hcp_risk_shift_*.csv')
+    if all_files is None:
+        all_files = glob.glob('hcp_risk_shift_*.csv')
     if not all_files:
         print("[ERROR] No 'hcp_risk_shift_*.csv' files found.")
         return
@@ -31,19 +35,22 @@ def generate_final_report():
         return
 
     # 2. Merge all data
-    full_df = pd.concat(li, axis=0, ignore_index=True)
+    with instrument.span("aggregate", files=len(li)):
+        full_df = pd.concat(li, axis=0, ignore_index=True)
 
-    # 3. Consistency analysis (who appears most frequently in Top 10 across shifts)
-    consistency = full_df.groupby('HCP_ID')['Event_Count'].agg(['sum', 'count', 'mean'])
-    consistency = consistency.sort_values(by='sum', ascending=False)
+        # 3. Consistency analysis (who appears most frequently in Top 10 across shifts)
+        consistency = full_df.groupby('HCP_ID')['Event_Count'].agg(['sum', 'count', 'mean'])
+        consistency = consistency.sort_values(by='sum', ascending=False)
 
     print("\n--- FINAL HYPERHAI RESEARCH REPORT ---")
     print("Top 10 HCPs with Highest Accumulated Risk (1 Week):")
     print(consistency.head(10))
 
     # 4. Save for publication / paper
-    consistency.to_csv('final_hyperhai_risk_report.csv')
-    print("\n[SUCCESS] Final report saved as 'final_hyperhai_risk_report.csv'")
+    consistency.to_csv(output_file)
+    print(f"\n[SUCCESS] Final report saved as '{output_file}'")
 
 if __name__ == "__main__":
-    generate_final_report()
\ No newline at end of file
+    instrument.configure(sys.argv)
+    with instrument.span("report"):
+        generate_final_report()
\ No newline at end of file
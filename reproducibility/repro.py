@@ -1,6 +1,9 @@
-import lzma
 import json
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import codec
 
 def extract_hyperedges(shift='02'):
     history_file = f'data/histories/histories{shift}.json.xz'
@@ -12,10 +15,11 @@ def extract_hyperedges(shift='02'):
         print(f"[ERROR] File {history_file} not found.")
         return
 
-    with lzma.open(history_file, 'rt') as f:
-        history = json.load(f)
+    with instrument.span("load", shift=shift):
+        history = json.loads(codec.readbytes(history_file))
         # history = {timestamp: {hcp_id: {contacts, state}}}
 
+    with instrument.span("extract", shift=shift) as sp:
         # Sample first 1 hour (3600 seconds)
         for i, (ts, second_data) in enumerate(history.items()):
             if i >= 3600:
@@ -32,13 +36,15 @@ def extract_hyperedges(shift='02'):
 
             if len(current_event) > 2:  # Hyperedge requires at least 3 entities
                 hyperedges.append(list(current_event))
+        sp.count("hyperedges", len(hyperedges))
 
     print(f"Successfully extracted {len(hyperedges)} hyper-events.")
     print(f"Example hyperedge at one second: {hyperedges[0] if hyperedges else 'Empty'}")
 
     # Save result
-    with open('hypergraph_structure.json', 'w') as out:
+    with codec.openfile('hypergraph_structure.json', 'wt', codec='raw') as out, instrument.span("serialize"):
         json.dump(hyperedges, out)
 
 if __name__ == "__main__":
+    instrument.configure(sys.argv)
     extract_hyperedges()
@@ -1,12 +1,17 @@
-import lzma
 import json
 import yaml
 import os
 import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import codec
 
-def build_spatial_hypergraph(shift='02'):
+def build_spatial_hypergraph(shift='02', history_file=None,
+                             output_path='spatial_hypergraph_final.json',
+                             placement_file='supp/placement005.yaml', output_codec='raw',
+                             minsize=3):
     try:
-        with open('supp/placement005.yaml', 'r') as f:
+        with open(placement_file, 'r') as f:
             placement = yaml.safe_load(f)
 
         anchor_coords = {}
@@ -26,7 +31,8 @@ def build_spatial_hypergraph(shift='02'):
         print(f"[ERROR] Failed to read YAML: {e}")
         return
 
-    history_file = f'data/histories/histories{shift}.json.xz'
+    if history_file is None:
+        history_file = f'data/histories/histories{shift}.json.xz'
     if not os.path.exists(history_file):
         print(f"[ERROR] File {history_file} not found.")
         return
@@ -34,9 +40,10 @@ def build_spatial_hypergraph(shift='02'):
     spatial_hypergraph = []
     print(f"--- Building Spatial Hypergraph for Shift {shift} ---")
 
-    with lzma.open(history_file, 'rt') as f:
-        history = json.load(f)
+    with instrument.span("load", shift=shift):
+        history = json.loads(codec.readbytes(history_file))
 
+    with instrument.span("build", shift=shift) as sp:
         for i, (ts, second_data) in enumerate(history.items()):
             if i >= 3600:
                 break
@@ -45,16 +52,16 @@ def build_spatial_hypergraph(shift='02'):
                 contacts = info['contacts']
                 if contacts:
                     event_members = set([hcp] + contacts)
-                    if len(event_members) >= 3:
+                    if len(event_members) >= minsize:
                         coords = [anchor_coords[m] for m in event_members if m in anchor_coords]
                         spatial_hypergraph.append({
                             'time_t': i,
                             'members': list(event_members),
                             'centroid_location': coords[0] if coords else None
                         })
+        sp.count("hyperedges", len(spatial_hypergraph))
 
-    output_path = 'spatial_hypergraph_final.json'
-    with open(output_path, 'w') as out:
+    with codec.openfile(output_path, 'wt', codec=output_codec) as out, instrument.span("serialize", shift=shift):
         json.dump(spatial_hypergraph, out)
 
     print(f"Success! {len(spatial_hypergraph)} hyper-events saved to {output_path}")
@@ -62,5 +69,6 @@ def build_spatial_hypergraph(shift='02'):
         print(f"Example data: {spatial_hypergraph[0]}")
 
 if __name__ == "__main__":
+    instrument.configure(sys.argv)
     shift_arg = sys.argv[1] if len(sys.argv) > 1 else '02'
     build_spatial_hypergraph(shift=shift_arg)
@@ -0,0 +1,200 @@
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from scipy.stats import rankdata
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
+import codec
+
+"""
+How stable are the risk rankings from shift to shift? report.py counts
+in how many shifts an HCP appears, and extractor.py calls an HCP
+consistent at count >= 10; this gives that claim error bars.
+
+For each shift, the event count of every HCP (or anchor) is the number
+of hyper-events of the shift's spatial hypergraph (repro3.py) that
+include it, as in analysis.py. Bootstrap resamples of a shift draw its
+time blocks (blocksize seconds of time_t) with replacement, or its
+hyper-events when blocksize is 0; a resample's counts are W @ C, where
+C has the counts of each block (or event) and W the multiplicities of
+each draw, done for a batch of resamples at a time. For every pair of
+shifts, the Spearman and Kendall (tau-b) rank correlations, over the
+IDs that both shifts observed, and the overlap of their top k, are
+computed for the observed counts and for every resample; for every ID,
+the number of shifts where it ranks in the top k. Resamples and shift
+pairs are spread over a process pool.
+
+Outputs (in outdir), with 95% percentile intervals:
+    rank_stability_pairs_{kind}.csv     one row per pair of shifts
+    rank_stability_{kind}.csv           one row per HCP (or anchor)
+"""
+
+BATCH = 1 << 24  # most elements of W in one batch
+
+
+def loadcounts(hypergraph_file, kind='hcp', blocksize=60):
+    # (ids, C): C[u, i] is the number of events of unit u including ids[i]
+    with codec.openfile(hypergraph_file, 'rt') as f:
+        data = json.load(f)
+    keep = (lambda m: not m.startswith('b')) if kind == 'hcp' else (lambda m: m.startswith('b'))
+    ids = sorted({m for event in data for m in event['members'] if keep(m)})
+    column = {m: i for i, m in enumerate(ids)}
+    units = [event['time_t'] // blocksize for event in data] if blocksize else range(len(data))
+    rows = {u: r for r, u in enumerate(sorted(set(units)))}
+    C = np.zeros((len(rows), len(ids)), dtype=np.float32)
+    for event, u in zip(data, units):
+        for m in event['members']:
+            if m in column:
+                C[rows[u], column[m]] += 1
+    return ids, C
+
+
+def resample(task):
+    # counts of nresamples bootstrap resamples of the units of C
+    C, nresamples, seed = task
+    rng = np.random.default_rng(seed)
+    units = len(C)
+    if units == 0:
+        return np.zeros((nresamples, C.shape[1]), dtype=np.float32)
+    batch = max(1, BATCH // units)
+    out = list()
+    for start in range(0, nresamples, batch):
+        W = rng.multinomial(units, np.full(units, 1 / units), size=min(batch, nresamples - start))
+        out.append(W.astype(np.float32) @ C)
+    return np.concatenate(out)
+
+
+def topmask(X, k):
+    # rows of X -> boolean mask of the k largest (ties broken by position)
+    order = np.argsort(-X, axis=1, kind='stable')[:, :k]
+    mask = np.zeros(X.shape, dtype=bool)
+    np.put_along_axis(mask, order, True, axis=1)
+    return mask & (X > 0)
+
+
+def spearman(X, Y):
+    # row-wise Spearman correlation of two equal-shape arrays
+    RX, RY = rankdata(X, axis=1), rankdata(Y, axis=1)
+    RX -= RX.mean(axis=1, keepdims=True)
+    RY -= RY.mean(axis=1, keepdims=True)
+    denom = np.sqrt((RX * RX).sum(axis=1) * (RY * RY).sum(axis=1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (RX * RY).sum(axis=1) / denom
+
+
+def kendall(X, Y, chunk=512):
+    # row-wise Kendall tau-b of two equal-shape arrays
+    a, b = np.triu_indices(X.shape[1], 1)
+    tau = np.empty(len(X))
+    for s in range(0, len(X), chunk):
+        SX = np.sign(X[s : s + chunk, a] - X[s : s + chunk, b])
+        SY = np.sign(Y[s : s + chunk, a] - Y[s : s + chunk, b])
+        denom = np.sqrt((SX * SX).sum(axis=1) * (SY * SY).sum(axis=1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tau[s : s + chunk] = (SX * SY).sum(axis=1) / denom
+    return tau
+
+
+def pairstats(task):
+    # observed and resampled statistics for one pair of shifts
+    (A, obsA), (B, obsB), k = task
+    both = (obsA > 0) & (obsB > 0)  # IDs observed in both shifts
+    stats = dict()
+    for name, X, Y in (('observed', obsA[None, :], obsB[None, :]), ('boot', A, B)):
+        stats[name] = {'topk': (topmask(X, k) & topmask(Y, k)).sum(axis=1) / k}
+        if both.sum() < 2:  # no ranking to compare (shift 1 is short)
+            stats[name]['spearman'] = stats[name]['kendall'] = np.full(len(X), np.nan)
+            continue
+        stats[name]['spearman'] = spearman(X[:, both], Y[:, both])
+        stats[name]['kendall'] = kendall(X[:, both], Y[:, both])
+    return both.sum(), stats
+
+
+def interval(values):
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.nan, np.nan
+    return tuple(np.percentile(values, [2.5, 97.5]))
+
+
+def stability(hypergraph_files, kind='hcp', blocksize=60, nresamples=10000, k=10,
+              processes=None, seed=2023, outdir='.'):
+    """
+    hypergraph_files maps shift number -> spatial hypergraph file;
+    returns (pairs, ranking) DataFrames, also saved as CSV in outdir
+    """
+    shifts = sorted(hypergraph_files)
+    with instrument.span("load", kind=kind, shifts=len(shifts)):
+        loaded = {n: loadcounts(hypergraph_files[n], kind, blocksize) for n in shifts}
+    ids = sorted({m for n in shifts for m in loaded[n][0]})
+    column = {m: i for i, m in enumerate(ids)}
+    C, observed = dict(), dict()
+    for n in shifts:
+        own, counts = loaded[n]
+        # widen each shift's C to all ids, so that columns line up
+        C[n] = np.zeros((len(counts), len(ids)), dtype=np.float32)
+        C[n][:, [column[m] for m in own]] = counts
+        observed[n] = C[n].sum(axis=0)
+    # resamples in chunks, for an even spread over the pool
+    nchunks = max(1, (processes or os.cpu_count()) * 2 // max(1, len(shifts)))
+    sizes = [nresamples // nchunks + (i < nresamples % nchunks) for i in range(nchunks)]
+    seeds = iter(np.random.SeedSequence(seed).spawn(len(shifts) * nchunks))
+    tasks = [(C[n], size, next(seeds)) for n in shifts for size in sizes if size]
+    pairs = [(i, j) for x, i in enumerate(shifts) for j in shifts[x + 1 :]]
+    with Pool(processes) as pool:
+        with instrument.span("resample", kind=kind, resamples=nresamples) as sp:
+            parts = pool.map(resample, tasks)
+            per = len(parts) // max(1, len(shifts))
+            boot = {n: np.concatenate(parts[x * per : (x + 1) * per]) for x, n in enumerate(shifts)}
+            sp.count("units", sum(len(C[n]) for n in shifts))
+        with instrument.span("pairs", kind=kind, pairs=len(pairs)):
+            results = pool.map(pairstats, [((boot[i], observed[i]), (boot[j], observed[j]), k)
+                                           for i, j in pairs])
+
+    rows = list()
+    for (i, j), (common, stats) in zip(pairs, results):
+        row = {'Shift_A': i, 'Shift_B': j, 'Common_IDs': common}
+        for name in ('spearman', 'kendall', 'topk'):
+            row[name] = stats['observed'][name][0]
+            row[f'{name}_lo'], row[f'{name}_hi'] = interval(stats['boot'][name])
+        rows.append(row)
+    df_pairs = pd.DataFrame(rows)
+
+    # shifts where each ID ranks in the top k, observed and per resample
+    topk_observed = sum(topmask(observed[n][None, :], k)[0].astype(int) for n in shifts)
+    topk_boot = sum(topmask(boot[n], k).astype(np.int16) for n in shifts)
+    lo, hi = np.percentile(topk_boot, [2.5, 97.5], axis=0)
+    df_ids = pd.DataFrame({
+        'ID': ids,
+        'Shifts_Present': sum((observed[n] > 0).astype(int) for n in shifts),
+        'Event_Count': sum(observed[n] for n in shifts).astype(int),
+        'TopK_Shifts': topk_observed,
+        'TopK_Shifts_lo': lo,
+        'TopK_Shifts_hi': hi,
+    }).sort_values(by=['TopK_Shifts', 'Event_Count'], ascending=False)
+
+    df_pairs.to_csv(os.path.join(outdir, f'rank_stability_pairs_{kind}.csv'), index=False)
+    df_ids.to_csv(os.path.join(outdir, f'rank_stability_{kind}.csv'), index=False)
+    return df_pairs, df_ids
+
+
+if __name__ == "__main__":
+    # python reproducibility/stability.py [hcp|anchor] [resamples] [blocksize]
+    # (from the top directory; hypergraphs come from the pipeline cache)
+    instrument.configure(sys.argv)
+    import pipeline
+    kind = sys.argv[1] if len(sys.argv) > 1 else 'hcp'
+    nresamples = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    blocksize = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+    G = pipeline.graph()
+    files = dict()
+    for n, stage in G["hypergraph"].items():
+        pipeline.build(stage)
+        files[n] = stage.artifact("spatial_hypergraph.json")
+    with instrument.span("stability", kind=kind):
+        df_pairs, df_ids = stability(files, kind, blocksize, nresamples)
+    print(df_pairs.describe().loc[['mean', 'min', 'max']].round(3))
+    print(df_ids.head(10))
@@ -1,4 +1,8 @@
 import subprocess
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
 
 def run_full_repro_suite():
     shifts = [f"{i:02d}" for i in range(1, 15)]
@@ -8,11 +12,12 @@ def run_full_repro_suite():
         print(f"\n>>> Processing Shift {s}...")
 
         try:
-            res1 = subprocess.run(
-                ['python', 'repro3.py', s],
-                capture_output=True,
-                text=True
-            )
+            with instrument.span("repro3", shift=s):
+                res1 = subprocess.run(
+                    ['python', 'repro3.py', s],
+                    capture_output=True,
+                    text=True
+                )
             if res1.returncode != 0:
                 print(f"[ERROR] Hypergraph build failed for Shift {s}")
                 print(res1.stderr)
@@ -22,11 +27,12 @@ def run_full_repro_suite():
             continue
 
         try:
-            res2 = subprocess.run(
-                ['python', 'analysis.py', s],
-                capture_output=True,
-                text=True
-            )
+            with instrument.span("analysis", shift=s):
+                res2 = subprocess.run(
+                    ['python', 'analysis.py', s],
+                    capture_output=True,
+                    text=True
+                )
             if res2.returncode != 0:
                 print(f"[ERROR] Risk analysis failed for Shift {s}")
                 print(res2.stderr)
@@ -38,4 +44,5 @@ def run_full_repro_suite():
     print("\n[DONE] Check hcp_risk_shift_*.csv files in your folder.")
 
 if __name__ == "__main__":
+    instrument.configure(sys.argv)
     run_full_repro_suite()
@@ -2,9 +2,12 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import glob
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "code"))
+import instrument
 
-def plot_top_10_hcp_trends():
-    report_path = 'final_hyperhai_risk_report.csv'
+def plot_top_10_hcp_trends(report_path='final_hyperhai_risk_report.csv', all_files=None,
+                           output_path='figures/top_10_hcp_risk_trend.png'):
     if not os.path.exists(report_path):
         print(f"[ERROR] File '{report_path}' tidak ditemukan. Jalankan report.py terlebih dahulu.")
         return
@@ -13,7 +16,9 @@ def plot_top_10_hcp_trends():
     top_10_ids = report_df['HCP_ID'].head(10).tolist()
     print(f"Processing trends for Top 10 HCPs: {', '.join(top_10_ids)}")
 
-    all_files = sorted(glob.glob('hcp_risk_shift_*.csv'))
+    if all_files is None:
+        all_files = glob.glob('hcp_risk_shift_*.csv')
+    all_files = sorted(all_files)
     if not all_files:
         print("[ERROR] Tidak ada file 'hcp_risk_shift_*.csv' ditemukan.")
         return
@@ -21,7 +26,7 @@ def plot_top_10_hcp_trends():
     data_list = []
     for filename in all_files:
         try:
-            shift_num = int(filename.split('_')[-1].split('.')[0])
+            shift_num = int(os.path.basename(filename).split('_')[-1].split('.')[0])
             df = pd.read_csv(filename)
             for hcp_id in top_10_ids:
                 val = df[df['HCP_ID'] == hcp_id]['Event_Count'].values
@@ -54,14 +59,15 @@ def plot_top_10_hcp_trends():
     plt.legend(title="HCP ID", bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
     plt.grid(True, linestyle=':', alpha=0.6)
 
-    if not os.path.exists('figures'):
-        os.makedirs('figures')
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
 
-    output_path = 'figures/top_10_hcp_risk_trend.png'
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    with instrument.span("savefig"):
+        plt.savefig(output_path, dpi=300, bbox_inches='tight')
     plt.close()
     
     print(f"[SUCCESS] Top 10 HCP risk trend plot saved at: {output_path}")
 
 if __name__ == "__main__":
-    plot_top_10_hcp_trends()
+    instrument.configure(sys.argv)
+    with instrument.span("trend"):
+        plot_top_10_hcp_trends()